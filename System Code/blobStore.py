@@ -0,0 +1,147 @@
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from ipfsCid import CIDBuilder
+from metrics import record_cache
+
+
+# Content-addressed store of encrypted payloads next to the sharing pipeline, with an index of what was shared to whom
+BLOB_STORE_DIR = "blob_store"
+
+
+def content_digest(plaintext: bytes, key: bytes) -> str:
+    # Keyed so the index does not reveal which records were shared to anyone without the key
+    return hmac.new(key, plaintext, hashlib.sha256).hexdigest()
+
+
+class BlobStore:
+    def __init__(self, directory: str = BLOB_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                cid TEXT PRIMARY KEY,
+                size INTEGER,
+                pinned_at REAL,
+                created_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS contents (
+                digest TEXT PRIMARY KEY,
+                cid TEXT,
+                wrapped_key BLOB
+            );
+            CREATE TABLE IF NOT EXISTS shares (
+                cid TEXT,
+                receiver TEXT,
+                patient TEXT,
+                tx_hash TEXT,
+                shared_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS shares_by_cid ON shares (cid);
+            CREATE INDEX IF NOT EXISTS shares_by_receiver ON shares (receiver);
+            CREATE INDEX IF NOT EXISTS shares_by_patient ON shares (patient);
+        """)
+        if "wrapped_key" not in [row[1] for row in self.conn.execute("PRAGMA table_info(contents)")]:
+            # Stores created before envelope encryption; their entries have no data key and are re-encrypted
+            self.conn.execute("ALTER TABLE contents ADD COLUMN wrapped_key BLOB")
+        self.conn.commit()
+
+    def path(self, cid: str) -> str:
+        return os.path.join(self.directory, cid)
+
+    def put_stream(self, chunks) -> tuple:
+        # Writes the blob block by block while computing its CID, then files it under that CID
+        builder = CIDBuilder()
+        size = 0
+        temp_path = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    builder.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            cid = builder.cid()
+            os.replace(temp_path, self.path(cid))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO blobs (cid, size, pinned_at, created_at) VALUES (?, ?, NULL, ?)",
+                (cid, size, time.time())
+            )
+            self.conn.commit()
+        return cid, size
+
+    def lookup(self, digest: str):
+        # (CID, wrapped data key) of content stored earlier, as long as the blob is still on disk
+        with self.lock:
+            row = self.conn.execute("SELECT cid, wrapped_key FROM contents WHERE digest = ?", (digest,)).fetchone()
+        found = row is not None and row[1] is not None and os.path.exists(self.path(row[0]))
+        record_cache("blob_store", found)
+        return (row[0], row[1]) if found else None
+
+    def link(self, digest: str, cid: str, wrapped_key: bytes):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO contents VALUES (?, ?, ?)", (digest, cid, wrapped_key))
+            self.conn.commit()
+
+    def rename(self, cid: str, pinned_cid: str):
+        # The pinning service reported a different CID than the local computation; index the blob under its pinned CID
+        os.replace(self.path(cid), self.path(pinned_cid))
+        with self.lock:
+            self.conn.execute("UPDATE OR REPLACE blobs SET cid = ? WHERE cid = ?", (pinned_cid, cid))
+            self.conn.execute("UPDATE contents SET cid = ? WHERE cid = ?", (pinned_cid, cid))
+            self.conn.commit()
+
+    def is_pinned(self, cid: str) -> bool:
+        with self.lock:
+            row = self.conn.execute("SELECT pinned_at FROM blobs WHERE cid = ?", (cid,)).fetchone()
+        return row is not None and row[0] is not None
+
+    def mark_pinned(self, cid: str):
+        with self.lock:
+            self.conn.execute("UPDATE blobs SET pinned_at = ? WHERE cid = ?", (time.time(), cid))
+            self.conn.commit()
+
+    def record_share(self, cid: str, receiver: str, patient: str, tx_hash: str):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO shares VALUES (?, ?, ?, ?, ?)",
+                (cid, receiver.lower(), patient.lower() if patient else None, tx_hash, time.time())
+            )
+            self.conn.commit()
+
+    def shares(self, cid: str = None, receiver: str = None, patient: str = None) -> list:
+        # What was shared to whom, newest first; every filter is optional
+        clauses, params = [], []
+        for column, value in (("cid", cid), ("receiver", receiver), ("patient", patient)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value if column == "cid" else value.lower())
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT cid, receiver, patient, tx_hash, shared_at FROM shares {where} ORDER BY shared_at DESC", params
+            ).fetchall()
+        return [
+            {"cid": row[0], "receiver": row[1], "patient": row[2], "tx_hash": row[3], "shared_at": row[4]}
+            for row in rows
+        ]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_blob_store() -> BlobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BlobStore()
+    return _store
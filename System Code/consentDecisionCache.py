@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+from consentMirror import get_consent_mirror
+from metrics import record_cache
+
+
+# Consent verification results of the orchestrator, reused when the same check is asked again (clarifications,
+# re-filtering...). Each entry is tagged with the block its consent rows were read at and dropped when a consent, revoke
+# or request event for its patient or government arrives from a later block. Revoke calls are only seen by scanning
+# followed blocks, so entries also expire after a maximum age. The latest event per subject is remembered, so a decision
+# computed while an event for its subjects was being handled is never stored.
+CONSENT_DECISION_MAX_AGE = 300
+
+
+def decision_key(patient: str, receiver: str, purposes, data_types, requirement: str, *context) -> str:
+    # Order, case and whitespace differences map to the same check
+    def normalize(value):
+        if isinstance(value, (list, tuple)):
+            return sorted(normalize(v) for v in value)
+        return " ".join(str(value).lower().split())
+    return json.dumps([normalize(part) for part in (patient, receiver, purposes, data_types or [], requirement, *context)])
+
+
+class ConsentDecisionCache:
+    def __init__(self, max_age: float = CONSENT_DECISION_MAX_AGE):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = {}
+        # subject -> (highest event block, monotonic time of the latest event)
+        self.events = {}
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry["created_at"] > self.max_age:
+                del self.entries[key]
+                entry = None
+        record_cache("consent_decisions", entry is not None)
+        return entry["decision"] if entry is not None else None
+
+    def put(self, key: str, decision: str, block: int, subjects, started: float = None) -> bool:
+        # block is the mirror block the decision was computed at, started the monotonic time its reads began;
+        # a decision that an event may have outdated before it got here is refused
+        subjects = {subject.lower() for subject in subjects if subject}
+        now = time.monotonic()
+        started = now if started is None else started
+        with self.lock:
+            self._prune(now)
+            for subject in subjects:
+                eventBlock, eventAt = self.events.get(subject, (None, None))
+                if (eventBlock is not None and (block is None or eventBlock > block)) or (eventAt is not None and eventAt >= started):
+                    return False
+            self.entries[key] = {"decision": decision, "block": block, "created_at": now, "subjects": subjects}
+        return True
+
+    def _prune(self, now: float):
+        # Events older than max_age cannot outdate a decision that would still be served
+        for subject in [subject for subject, (_, at) in self.events.items() if now - at > self.max_age]:
+            del self.events[subject]
+
+    def invalidate(self, subject: str, block: int = None):
+        # An event at block drops the decisions of its subject computed before it; no block drops them all
+        subject = subject.lower()
+        now = time.monotonic()
+        with self.lock:
+            blocks = [b for b in (self.events.get(subject, (None, None))[0], block) if b is not None]
+            self.events[subject] = (max(blocks) if blocks else None, now)
+            self._prune(now)
+            for key in [key for key, entry in self.entries.items()
+                        if subject in entry["subjects"] and (block is None or entry["block"] is None or entry["block"] < block)]:
+                del self.entries[key]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_consent_decision_cache() -> ConsentDecisionCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ConsentDecisionCache()
+            # Events seen by the consent mirror's block follower invalidate decisions
+            get_consent_mirror().subscribe(_cache.invalidate)
+    return _cache
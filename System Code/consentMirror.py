@@ -0,0 +1,378 @@
+import asyncio
+import contextvars
+import json
+import sqlite3
+import threading
+import time
+from web3 import Web3
+from metrics import record_cache
+from multicall import BlockPin, batched_call, current_block_pin
+from runtimeContext import get_consent_contract, get_web3
+from tracing import span
+
+
+# Local SQLite mirror of ConsentManager reads. The consent events only carry addresses and IDs, so the mirror keeps
+# the getters' row sets per subject and re-reads a subject whenever an event or a revoke transaction touches it.
+# Revocations emit no event; followed blocks are scanned for revoke* calls and every snapshot also expires after a TTL.
+CONSENT_MIRROR_PATH = "consent_mirror.db"
+CONSENT_MIRROR_TTL = 600
+# Set to the ConsentManager deployment block so the first backfill does not scan the whole chain
+MIRROR_START_BLOCK = 0
+LOG_PAGE_SIZE = 2000
+# Blocks handled per sync step during the backfill; the checkpoint is persisted after each step
+SYNC_WINDOW = 20 * LOG_PAGE_SIZE
+MIN_LOG_PAGE_SIZE = 16
+FOLLOW_INTERVAL = 12
+# Recent block hashes kept to detect reorgs, and the largest gap still scanned transaction by transaction for revocations
+REORG_DEPTH = 64
+REVOKE_SCAN_LIMIT = 64
+REFRESH_BATCH_SIZE = 100
+
+PATIENT_FUNCTIONS = ["getUniversalConsents", "getHospitalConsents", "getLabConsents", "getInsuranceConsents"]
+CONSENT_EVENTS = {
+    "NewPatientConsentAdded(address,uint256)": "patient",
+    "NewSpecificPatientConsentAdded(address,address,uint256)": "specific",
+    "NewGovernmentConsentAdded(address,uint256)": "government",
+    # Requests change no consent rows but do change what a pending decision should say
+    "NewPatientConsentRequested(address)": "request",
+    "NewGovernmentConsentRequested(address)": "request",
+}
+EVENT_TOPICS = {bytes(Web3.keccak(text=signature)).hex(): kind for signature, kind in CONSENT_EVENTS.items()}
+REVOKE_FUNCTIONS = ["revokeGovernmentConsent", "revokeHospitalConsent", "revokeInsuranceConsent", "revokeLabConsent", "revokeSpecificConsent", "revokeBroadConsent"]
+REVOKE_SELECTORS = {bytes(Web3.keccak(text=f"{name}(uint256)")[:4]).hex(): name for name in REVOKE_FUNCTIONS}
+# Row slot holding the expiry; the deployed contract keeps a Duration there, so only absolute timestamps count as validUntil
+VALID_UNTIL_SLOT = {"getSpecificConsents": 4, "getGovernmentConsents": 5, **{function: 4 for function in PATIENT_FUNCTIONS}}
+MIN_VALID_UNTIL = 10 ** 9
+
+# Blocks the consent rows of the current decision were read at; read() appends one per answer (None when unknown)
+current_read_blocks = contextvars.ContextVar("current_read_blocks", default=None)
+
+
+def _address(value) -> str:
+    return value.lower() if value else ""
+
+
+def _hex(value) -> str:
+    # HexBytes, bytes and 0x-strings as plain lowercase hex
+    if isinstance(value, str):
+        return value[2:].lower() if value.startswith("0x") else value.lower()
+    return bytes(value).hex()
+
+
+def _word_address(word: bytes) -> str:
+    return "0x" + word[-20:].hex()
+
+
+def read_block(blocks: list, default: int = None):
+    # Block a decision built on these reads reflects: the oldest one, None if any is unknown, default without reads
+    if not blocks:
+        return default
+    return None if None in blocks else min(blocks)
+
+
+def is_expired(function: str, row: list, now: float) -> bool:
+    slot = VALID_UNTIL_SLOT.get(function)
+    if slot is None or slot >= len(row) or not isinstance(row[slot], int):
+        return False
+    return MIN_VALID_UNTIL <= row[slot] < now
+
+
+class ConsentMirror:
+    def __init__(self, path: str = CONSENT_MIRROR_PATH, ttl: float = CONSENT_MIRROR_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.invalidated = {}
+        self.thread = None
+        self.listeners = []
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                function TEXT,
+                subject TEXT,
+                receiver TEXT,
+                rows TEXT,
+                block INTEGER,
+                fetched_at REAL,
+                PRIMARY KEY (function, subject, receiver)
+            );
+            CREATE TABLE IF NOT EXISTS events (
+                block INTEGER,
+                kind TEXT,
+                subject TEXT,
+                receiver TEXT
+            );
+            CREATE INDEX IF NOT EXISTS events_by_block ON events (block);
+            CREATE TABLE IF NOT EXISTS blocks (
+                number INTEGER PRIMARY KEY,
+                hash TEXT
+            );
+            CREATE TABLE IF NOT EXISTS checkpoint (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                block INTEGER
+            );
+        """)
+        self.conn.commit()
+
+    # Lookups
+
+    def lookup(self, function: str, subject: str, receiver: str = None):
+        # Unexpired rows of a fresh snapshot, or None when the mirror cannot answer
+        snapshot = self._snapshot(function, subject, receiver)
+        return snapshot[0] if snapshot is not None else None
+
+    def _snapshot(self, function: str, subject: str, receiver: str = None):
+        # (unexpired rows, block they were read at) of a fresh snapshot. Without a follower no event or revocation
+        # reaches the snapshots, so they are not served at all.
+        if not self.following():
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT rows, block, fetched_at FROM snapshots WHERE function = ? AND subject = ? AND receiver = ?",
+                (function, _address(subject), _address(receiver))
+            ).fetchone()
+        if row is None or time.time() - row[2] > self.ttl:
+            return None
+        now = time.time()
+        return [r for r in json.loads(row[0]) if not is_expired(function, r, now)], row[1]
+
+    def is_fresh(self, function: str, subject: str, receiver: str = None) -> bool:
+        return self.lookup(function, subject, receiver) is not None
+
+    def store(self, function: str, subject: str, receiver, rows, block: int = None, started: float = None):
+        key = (function, _address(subject), _address(receiver))
+        with self.lock:
+            # A read that started before the subject was invalidated may already be stale
+            if started is not None and self.invalidated.get(key[1], 0) > started:
+                return
+            self.conn.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, json.dumps([list(r) for r in rows or []]), block, time.time())
+            )
+            self.conn.commit()
+
+    async def read(self, function: str, subject: str, receiver, fetch):
+        # Mirror first; fetch() is the on-chain fallback and its answer is kept for the next lookup.
+        # fetch() reads at the block pin of the request (possibly prefetched), so that is the block of its rows.
+        snapshot = self._snapshot(function, subject, receiver)
+        record_cache("consent_mirror", snapshot is not None)
+        if snapshot is not None:
+            rows, block = snapshot
+        else:
+            started = time.time()
+            rows = await fetch()
+            pin = current_block_pin.get()
+            block = pin.block if pin is not None else None
+            self.store(function, subject, receiver, rows, block, started=started)
+        blocks = current_read_blocks.get()
+        if blocks is not None:
+            blocks.append(block)
+        return rows
+
+    def invalidate(self, subject: str, receiver: str = None) -> list:
+        # Drops a subject's snapshots (or one receiver's) and returns their keys for re-reading
+        subject = _address(subject)
+        with self.lock:
+            self.invalidated[subject] = time.time()
+            query, params = "FROM snapshots WHERE subject = ?", [subject]
+            if receiver is not None:
+                query, params = query + " AND receiver = ?", params + [_address(receiver)]
+            keys = self.conn.execute(f"SELECT function, subject, receiver {query}", params).fetchall()
+            self.conn.execute(f"DELETE {query}", params)
+            self.conn.commit()
+        return keys
+
+    def subscribe(self, callback):
+        # callback(subject, block) runs for every consent, revoke or request event; block is None after a reorg
+        self.listeners.append(callback)
+
+    def _notify(self, subject: str, block: int = None):
+        for callback in self.listeners:
+            callback(subject, block)
+
+    def expire_all(self):
+        # Used when blocks were skipped and a revocation may have been missed
+        with self.lock:
+            self.conn.execute("UPDATE snapshots SET fetched_at = 0")
+            self.conn.commit()
+
+    # Chain following
+
+    def checkpoint(self) -> int:
+        with self.lock:
+            row = self.conn.execute("SELECT block FROM checkpoint WHERE id = 1").fetchone()
+        return row[0] if row is not None else MIRROR_START_BLOCK - 1
+
+    def _advance(self, block: int, block_hash: str = None):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO checkpoint VALUES (1, ?)", (block,))
+            if block_hash is not None:
+                self.conn.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?)", (block, block_hash))
+                self.conn.execute("DELETE FROM blocks WHERE number < ?", (block - REORG_DEPTH,))
+                self.conn.execute("DELETE FROM events WHERE block < ?", (block - REORG_DEPTH,))
+            self.conn.commit()
+
+    async def _logs(self, start: int, end: int) -> list:
+        # Paginated eth_getLogs over the three consent events; pages shrink when the node rejects a range
+        logs = []
+        page = LOG_PAGE_SIZE
+        while start <= end:
+            stop = min(start + page - 1, end)
+            try:
+                with span("consent_mirror.logs", from_block=start, to_block=stop):
+                    logs += await get_web3().eth.get_logs({
+                        "address": get_consent_contract().address,
+                        "fromBlock": start, "toBlock": stop,
+                        "topics": [["0x" + topic for topic in EVENT_TOPICS]]
+                    })
+            except Exception as e:
+                if page <= MIN_LOG_PAGE_SIZE:
+                    raise
+                page = max(page // 2, MIN_LOG_PAGE_SIZE)
+                print(f"⚠️ Consent log scan of blocks {start}-{stop} failed ({e}). Retrying with {page}-block pages.")
+                continue
+            start = stop + 1
+        return logs
+
+    def _record_events(self, logs: list) -> set:
+        # Keys to re-read for the subjects the events touched
+        keys = set()
+        rows = []
+        for log in logs:
+            kind = EVENT_TOPICS.get(_hex(log["topics"][0]))
+            data = bytes.fromhex(_hex(log["data"]))
+            # The events have no indexed parameters, so the addresses are the first words of the data
+            subject = _word_address(data[:32])
+            receiver = _word_address(data[32:64]) if kind == "specific" else ""
+            rows.append((log["blockNumber"], kind, subject, receiver))
+            self._notify(subject, log["blockNumber"])
+            if kind == "patient":
+                self.invalidate(subject)
+                keys.update((function, subject, "") for function in PATIENT_FUNCTIONS)
+            elif kind == "specific":
+                keys.update(self.invalidate(subject, receiver))
+                keys.add(("getSpecificConsents", subject, receiver))
+            elif kind == "government":
+                # Government consents are read per receiver, which the event does not name
+                keys.update(self.invalidate(subject))
+        if rows:
+            with self.lock:
+                self.conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?)", rows)
+                self.conn.commit()
+        return keys
+
+    async def _revocations(self, start: int, end: int) -> set:
+        # revoke* calls to ConsentManager in the followed blocks; the revoker is the consent's patient or government
+        keys = set()
+        consentAddress = get_consent_contract().address.lower()
+        for number in range(start, end + 1):
+            block = await get_web3().eth.get_block(number, full_transactions=True)
+            for tx in block["transactions"]:
+                selector = _hex(tx.get("input") or b"")[:8]
+                if (tx.get("to") or "").lower() == consentAddress and selector in REVOKE_SELECTORS:
+                    keys.update(self.invalidate(tx["from"]))
+                    self._notify(tx["from"], number)
+        return keys
+
+    async def _reorged(self) -> bool:
+        # Rewinds to the newest recorded block still on the canonical chain and drops what changed above it
+        with self.lock:
+            recorded = self.conn.execute("SELECT number, hash FROM blocks ORDER BY number DESC").fetchall()
+        for index, (number, block_hash) in enumerate(recorded):
+            block = await get_web3().eth.get_block(number)
+            if _hex(block["hash"]) == block_hash:
+                if index == 0:
+                    return False
+                break
+        else:
+            if not recorded:
+                return False
+            number = recorded[-1][0] - 1
+            self.expire_all()
+        print(f"⚠️ Chain reorganization detected. Rewinding the consent mirror to block {number}.")
+        with self.lock:
+            subjects = self.conn.execute("SELECT DISTINCT subject FROM events WHERE block > ?", (number,)).fetchall()
+            self.conn.execute("DELETE FROM events WHERE block > ?", (number,))
+            self.conn.execute("DELETE FROM blocks WHERE number > ?", (number,))
+            self.conn.commit()
+        for (subject,) in subjects:
+            self.invalidate(subject)
+            self._notify(subject)
+        self._advance(number)
+        return True
+
+    async def refresh(self, keys):
+        # Re-reads snapshots through the multicall batcher, one batch per REFRESH_BATCH_SIZE keys
+        keys = list(keys)
+        functions = get_consent_contract().functions
+        for start in range(0, len(keys), REFRESH_BATCH_SIZE):
+            batch = keys[start:start + REFRESH_BATCH_SIZE]
+            started = time.time()
+            # One pin per batch, so the snapshots record the block they were read at
+            pin = BlockPin()
+            token = current_block_pin.set(pin)
+            try:
+                results = await asyncio.gather(*(
+                    batched_call(getattr(functions, function)(*[Web3.to_checksum_address(a) for a in (subject, receiver) if a]))
+                    for function, subject, receiver in batch
+                ), return_exceptions=True)
+            finally:
+                current_block_pin.reset(token)
+            for (function, subject, receiver), rows in zip(batch, results):
+                if not isinstance(rows, Exception):
+                    self.store(function, subject, receiver, rows, pin.block, started=started)
+
+    async def sync(self) -> bool:
+        # One step of at most SYNC_WINDOW blocks: reorg check, event scan, revocation scan, re-reads, checkpoint.
+        # Returns True once the mirror has reached the head.
+        await self._reorged()
+        head = await get_web3().eth.block_number
+        start = self.checkpoint() + 1
+        if start > head:
+            return True
+        end = min(head, start + SYNC_WINDOW - 1)
+        with span("consent_mirror.sync", from_block=start, to_block=end):
+            keys = self._record_events(await self._logs(start, end))
+            if head - start < REVOKE_SCAN_LIMIT:
+                keys |= await self._revocations(start, end)
+            elif start > MIRROR_START_BLOCK:
+                # Too far behind to look at every transaction, so nothing mirrored can be trusted without a re-read
+                self.expire_all()
+            await self.refresh(keys)
+        self._advance(end, _hex((await get_web3().eth.get_block(end))["hash"]))
+        return end == head
+
+    async def _loop(self):
+        while True:
+            try:
+                caughtUp = await self.sync()
+            except Exception as e:
+                print(f"⚠️ Consent mirror sync failed: {e}")
+                caughtUp = True
+            if caughtUp:
+                await asyncio.sleep(FOLLOW_INTERVAL)
+
+    def following(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        # Backfills and then follows new blocks on its own thread and loop, like the receipt watcher
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=lambda: asyncio.run(self._loop()), daemon=True)
+                self.thread.start()
+        return self.thread
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+def get_consent_mirror() -> ConsentMirror:
+    global _mirror
+    with _mirror_lock:
+        if _mirror is None:
+            _mirror = ConsentMirror()
+    return _mirror
+
+
+def start_consent_mirror():
+    return get_consent_mirror().start()
@@ -0,0 +1,139 @@
+import re
+import time
+from consentMirror import is_expired
+
+
+# Deterministic consent matching, following the rules the Consent Verification Agent is instructed with.
+# Data types and purposes are bitsets over their contract IDs; the "All ..." IDs expand to every bit.
+ALL_DATA_TYPES = 7
+ALL_PURPOSES = 6
+
+# Receiver role -> role-based consent getter and DataExchange role
+ROLE_CATEGORIES = {
+    "hospital": ("getHospitalConsents", 1),
+    "research lab": ("getLabConsents", 2),
+    "research laboratory": ("getLabConsents", 2),
+    "lab": ("getLabConsents", 2),
+    "insurance company": ("getInsuranceConsents", 3),
+    "insurance": ("getInsuranceConsents", 3),
+}
+ANY_LOCATION = {"all", "any", "all countries", "global", "worldwide", "*"}
+# Requirement texts containing these are left to the assistant rather than guessed
+AMBIGUOUS_WORDS = re.compile(r"\b(not|no|without|unless|except|optional|or|either|may)\b")
+# Approval by a public body other than the literal "government" (ministry, data protection authority...) cannot be
+# matched against government consents safely, so it is left to the assistant as well
+APPROVAL_WORDS = re.compile(r"\b(approv\w*|authori[sz]\w*|authorit\w*|ministr\w*|regulator\w*|agenc\w*|commission\w*|permi\w*|clearance)\b")
+
+
+def _normalize(text) -> str:
+    return " ".join(str(text).lower().split())
+
+
+def full_mask(all_id: int) -> int:
+    return sum(1 << i for i in range(1, all_id))
+
+
+def to_mask(ids, all_id: int) -> int:
+    mask = 0
+    for i in ids:
+        if i == all_id:
+            return full_mask(all_id)
+        mask |= 1 << i
+    return mask
+
+
+def from_mask(mask: int, all_id: int) -> list:
+    if mask == full_mask(all_id):
+        return [all_id]
+    return [i for i in range(1, all_id) if mask & (1 << i)]
+
+
+def purpose_mask(purposes, purpose_map: dict):
+    # Requested purposes as a bitset, or None if any of them is not a known purpose
+    if isinstance(purposes, str):
+        purposes = re.split(r",|\band\b", purposes)
+    names = {_normalize(name): id for id, name in purpose_map.items()}
+    names["all purposes"] = ALL_PURPOSES
+    ids = []
+    for purpose in purposes:
+        if isinstance(purpose, int):
+            ids.append(purpose)
+        elif _normalize(purpose):
+            if _normalize(purpose) not in names:
+                return None
+            ids.append(names[_normalize(purpose)])
+    return to_mask(ids, ALL_PURPOSES) if ids else None
+
+
+def role_category(role: str):
+    # (consent getter, DataExchange role) for a receiver role, or None
+    key = _normalize(role)
+    # Plurals: "hospitals", "research labs", "insurance companies"
+    singular = key[:-3] + "y" if key.endswith("ies") else key.removesuffix("s")
+    return ROLE_CATEGORIES.get(key) or ROLE_CATEGORIES.get(singular)
+
+
+def government_required(requirement: str):
+    # True/False when the regulation's consent requirement clearly asks for patient consent with or without
+    # government consent; None when it needs interpretation
+    text = _normalize(requirement)
+    if "consent" not in text or AMBIGUOUS_WORDS.search(text):
+        return None
+    if "government" not in text and APPROVAL_WORDS.search(text):
+        return None
+    return "government" in text
+
+
+def _covers(consent_purposes: list, requested: int) -> bool:
+    return to_mask(consent_purposes, ALL_PURPOSES) & requested == requested
+
+
+def _location_matches(locations: list, country: str) -> bool:
+    wanted = _normalize(country)
+    return any(_normalize(location) in ANY_LOCATION or _normalize(location) == wanted for location in locations)
+
+
+def matches(function: str, r: list, requested: int, receiver: str, receiver_country: str, now: float) -> bool:
+    # Active, unexpired and covering the requested purposes; plus the receiver or location check of its category
+    if function == "getSpecificConsents":
+        return r[5] and r[0].lower() == receiver.lower() and _covers(r[2], requested) and not is_expired(function, r, now)
+    if function == "getGovernmentConsents":
+        return r[3] and r[2].lower() == receiver.lower() and _covers(r[1], requested) and not is_expired(function, r, now)
+    return r[5] and _covers(r[1], requested) and _location_matches(r[2], receiver_country) and not is_expired(function, r, now)
+
+
+def evaluate(requested: int, receiver: str, receiver_country: str, role_function: str, consents: dict, require_government: bool, now: float = None) -> dict:
+    # consents maps a getter name to its rows; returns the allowed data type IDs and the matching ConsentIDs per category
+    now = time.time() if now is None else now
+    patientMask = 0
+    anonymity = False
+    matched = {"specific": [], "role": [], "universal": [], "government": []}
+
+    for r in consents.get("getSpecificConsents") or []:
+        if matches("getSpecificConsents", r, requested, receiver, receiver_country, now):
+            patientMask |= to_mask(r[1], ALL_DATA_TYPES)
+            anonymity = anonymity or r[3]
+            matched["specific"].append(r[6])
+    for category, function in [("role", role_function), ("universal", "getUniversalConsents")]:
+        for r in consents.get(function) or []:
+            if matches(function, r, requested, receiver, receiver_country, now):
+                patientMask |= to_mask(r[0], ALL_DATA_TYPES)
+                anonymity = anonymity or r[3]
+                matched[category].append(r[6])
+
+    allowed = patientMask
+    if require_government:
+        governmentMask = 0
+        for r in consents.get("getGovernmentConsents") or []:
+            if matches("getGovernmentConsents", r, requested, receiver, receiver_country, now):
+                governmentMask |= to_mask(r[0], ALL_DATA_TYPES)
+                matched["government"].append(r[4])
+        # Both the patient and the government have to approve a data type
+        allowed &= governmentMask
+
+    return {
+        "valid": allowed != 0,
+        "allowed_data_types": from_mask(allowed, ALL_DATA_TYPES),
+        "anonymization_required": bool(anonymity),
+        "consent_ids": {category: ids for category, ids in matched.items() if ids},
+    }
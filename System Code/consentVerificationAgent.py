@@ -1,48 +1,24 @@
-import streamlit as st
-from openai import OpenAI
+import asyncio
+from openaiClient import client
 import os
 import json
-from web3 import Web3
-from web3 import AsyncWeb3
-from web3.providers.async_rpc import AsyncHTTPProvider
+import time
+import threading
+import contextvars
+from collections import OrderedDict
+from progressEvents import step
+from consentMirror import get_consent_mirror, is_expired
+from consentRules import ALL_DATA_TYPES, ALL_PURPOSES, ROLE_CATEGORIES, evaluate, from_mask, government_required, matches, purpose_mask, role_category, to_mask
+from multicall import batched_call, pinned_block
+from runtimeContext import get_consent_contract
+from runExecutor import RunExecutor, dispatch_tool_calls
+from stagePlanner import planned
+from userDirectory import get_user_directory
 
 
 # Set up your API key
 os.environ["OPENAI_API_KEY"] = ""
 CONSENT_ASSISTANT_ID = ""
-infuraUrl = ""
-
-# Web3 setup
-web3 = AsyncWeb3(AsyncHTTPProvider(infuraUrl))
-assert web3.is_connected()
-
-# Smart contract ABIs & addresses
-consentSCAddr = "0x39daf39dc5999B19fc737AfF18B1513B477f4BFf";
-dataSCAddr = "0xb9cf17726836E7c067124F947255329c31D23429";
-consentSCAbi = []
-dataSCAbi = []
-
-if "consentSC" not in st.session_state:
-    st.session_state.consentSC = web3.eth.contract(address=Web3.to_checksum_address(consentSCAddr), abi=consentSCAbi)
-if "dataSC" not in st.session_state:
-    st.session_state.dataSC = web3.eth.contract(address=Web3.to_checksum_address(dataSCAddr), abi=dataSCAbi)
-consentSC = st.session_state.consentSC
-dataSC = st.session_state.dataSC
-
-client = OpenAI()
-
-def submitToolOutputs(output, threadId, runId, callID):
-    run = client.beta.threads.runs.submit_tool_outputs(
-        thread_id=threadId,
-        run_id=runId,
-        tool_outputs=[
-            {
-                "tool_call_id": callID,
-                "output": output
-            }
-        ]
-    )
-    return run
 
 
 DATA_TYPE_MAP = {
@@ -64,306 +40,454 @@ PURPOSE_MAP = {
     6: "All Pusposes"
 }
 
+# "compact" sends consent rows as tables with short headers and numeric IDs, explained by a legend once per thread;
+# "json" sends the verbose list of dicts
+CONSENT_OUTPUT_FORMAT = "compact"
+COMPACT_COLUMNS = {
+    "specific": ("id|rcv|dt|p|anon|dur", lambda r: (r[6], r[0], r[1], r[2], r[3], r[4])),
+    "general": ("id|dt|p|loc|anon|dur", lambda r: (r[6], r[0], r[1], r[2], r[3], r[4])),
+    "government": ("id|dt|p|rcv", lambda r: (r[4], r[0], r[1], r[2])),
+}
+
+# Threads whose legend was submitted, least recently used first
+LEGEND_THREADS_LIMIT = 1024
+
+
+class ConsentThread:
+    # Thread of one consent run; legend_pending is set once a tool output of the current step carries the legend
+    def __init__(self, threadId: str):
+        self.id = threadId
+        self.legend_pending = False
+
+
+# Consent run the current tool calls belong to; the legend is sent once per thread
+current_consent_thread = contextvars.ContextVar("current_consent_thread", default=None)
+_legendThreads = OrderedDict()
+_legendLock = threading.Lock()
+
+
+def legend_submitted(threadId: str) -> bool:
+    with _legendLock:
+        if threadId in _legendThreads:
+            _legendThreads.move_to_end(threadId)
+            return True
+    return False
+
+
+def mark_legend_submitted():
+    # Called after the tool outputs of a step went out; a failed submit leaves the thread without the legend
+    thread = current_consent_thread.get()
+    if thread is None or not thread.legend_pending:
+        return
+    with _legendLock:
+        _legendThreads[thread.id] = True
+        _legendThreads.move_to_end(thread.id)
+        while len(_legendThreads) > LEGEND_THREADS_LIMIT:
+            _legendThreads.popitem(last=False)
+
 async def run_consent_agent(user_input: str, threadId: str) -> str:
+    current_consent_thread.set(ConsentThread(threadId))
 
     # Step 1: Add user message
-    client.beta.threads.messages.create(
+    await client.beta.threads.messages.create(
         thread_id=threadId,
         role="user",
         content=user_input
     )
 
     # Step 2: Start a run with the assistant
-    run = client.beta.threads.runs.create(
+    run = await client.beta.threads.runs.create(
         thread_id=threadId,
         assistant_id=CONSENT_ASSISTANT_ID
     )
 
     # Step 3: Get the assistant response
+    handlers = dict(CONSENT_TOOLS)
+    handlers["getSpecificConsent"] = getSpecificConsentWithProgress
+    handlers["getGovernmentConsent"] = getGovernmentConsentWithProgress
+    handlers["validateReceiver"] = validateReceiverWithProgress
+    handlers["getConsentBundle"] = getConsentBundleWithProgress
+    executor = RunExecutor(client, "Consent Agent")
     while True:
-        messages = client.beta.threads.messages.list(thread_id=threadId)
-        run = client.beta.threads.runs.retrieve(
-            thread_id=threadId,
-            run_id=run.id
-        )
-        if (run.status == "requires_action" and run.required_action.type == "submit_tool_outputs"):
-            if (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getSpecificConsent"):
-                st.markdown(
-                    '<span style="font-size:14px;">🔍 Searching for valid patient consent...</span>',
-                    unsafe_allow_html=True
-                )
-                st.session_state.chat_history.append({
-                    "role": "status",
-                    "agent": "Consent Agent",
-                    "label": "✓ 🔐 Consent Verification Agent analysis completed!",
-                    "details": (
-                        "🔍 Searching for valid patient consent..."
-                    )
-                })
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getSpecificConsent(arg["patient"], arg["receiver"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getGovernmentConsent"):
-                st.markdown(
-                    '<span style="font-size:14px;">🔍 Searching for valid government consent...</span>',
-                    unsafe_allow_html=True
-                )
-                for chat in st.session_state.chat_history:
-                        if chat["role"] == "status" and chat["agent"] == "Consent Agent":
-                            chat["details"] += "\n 🔍 Searching for valid government consent..."
-                            break
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getGovernmentConsent(arg["country"], arg["receiver"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getUniversalConsents"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getUniversalConsents(arg["patient"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getHospitalConsents"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getHospitalConsents(arg["patient"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getResearchLabConsents"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getResearchLabConsents(arg["patient"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getInsuranceCompanyConsents"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getInsuranceConsents(arg["patient"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "validateReceiver"):
-                st.markdown(
-                    '<span style="font-size:14px;">⚙️ Validating the receiver...</span>',
-                    unsafe_allow_html=True
-                )
-                for chat in st.session_state.chat_history:
-                        if chat["role"] == "status" and chat["agent"] == "Consent Agent":
-                            chat["details"] += "\n ⚙️ Validating the receiver..."
-                            break
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await validateReceiver(arg["address"], arg["role"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-        elif (messages.data and messages.data[0].role == "assistant" and len(messages.data[0].content) > 0):
-            st.markdown(
-                    '<span style="font-size:14px;">🧠 Consent Verification Agent is reasoning...</span>',
-                    unsafe_allow_html=True
-                )
-            for chat in st.session_state.chat_history:
-                        if chat["role"] == "status" and chat["agent"] == "Consent Agent":
-                            chat["details"] += "\n 🧠 Consent Verification Agent is reasoning..."
-                            break
+        run = await executor.wait(threadId, run.id)
+        if run.status in ["failed", "cancelled", "expired", "incomplete"]:
+            raise Exception(f"Assistant run failed with status: {run.status}")
+        elif (run.status == "requires_action" and run.required_action.type == "submit_tool_outputs"):
+            # All consent lookups of this step run concurrently, go out as one multicall and are submitted together
+            with pinned_block():
+                await dispatch_tool_calls(client, run, handlers)
+            mark_legend_submitted()
+        elif run.status == "completed":
+            messages = await client.beta.threads.messages.list(thread_id=threadId)
+            step("Consent Agent", "🧠 Consent Verification Agent is reasoning...")
             consentAgentResponse = messages.data[0].content[0].text.value
             print("Consent Validation Agent Response: ")
             print(consentAgentResponse)
+            executor.report()
             break 
     
     return consentAgentResponse
 
 async def run_consent_agent2(user_input: str, threadId: str) -> str:
+    current_consent_thread.set(ConsentThread(threadId))
 
     # Step 1: Add user message
-    client.beta.threads.messages.create(
+    await client.beta.threads.messages.create(
         thread_id=threadId,
         role="user",
         content=user_input
     )
 
     # Step 2: Start a run with the assistant
-    run = client.beta.threads.runs.create(
+    run = await client.beta.threads.runs.create(
         thread_id=threadId,
         assistant_id=CONSENT_ASSISTANT_ID
     )
 
     # Step 3: Get the assistant response
+    executor = RunExecutor(client, "Consent Agent")
     while True:
-        messages = client.beta.threads.messages.list(thread_id=threadId)
-        run = client.beta.threads.runs.retrieve(
-            thread_id=threadId,
-            run_id=run.id
-        )
-        if (run.status == "requires_action" and run.required_action.type == "submit_tool_outputs"):
-            if (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getSpecificConsent"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getSpecificConsent(arg["patient"], arg["receiver"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getGovernmentConsent"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getGovernmentConsent(arg["country"], arg["receiver"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getUniversalConsents"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getUniversalConsents(arg["patient"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getHospitalConsents"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getHospitalConsents(arg["patient"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getResearchLabConsents"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getResearchLabConsents(arg["patient"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "getInsuranceCompanyConsents"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await getInsuranceConsents(arg["patient"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run.required_action.submit_tool_outputs.tool_calls[0].function.name == "validateReceiver"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                output = await validateReceiver(arg["address"], arg["role"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
-        elif (messages.data and messages.data[0].role == "assistant" and len(messages.data[0].content) > 0):
+        run = await executor.wait(threadId, run.id)
+        if run.status in ["failed", "cancelled", "expired", "incomplete"]:
+            raise Exception(f"Assistant run failed with status: {run.status}")
+        elif (run.status == "requires_action" and run.required_action.type == "submit_tool_outputs"):
+            with pinned_block():
+                await dispatch_tool_calls(client, run, CONSENT_TOOLS)
+            mark_legend_submitted()
+        elif run.status == "completed":
+            messages = await client.beta.threads.messages.list(thread_id=threadId)
             consentAgentResponse = messages.data[0].content[0].text.value
             print("Consent Agent Response: ")
             print(consentAgentResponse)
+            executor.report()
             break 
     
     return consentAgentResponse
 
+async def evaluate_consent(arg: dict):
+    # Rule-engine decision for a consent check, or None when the request cannot be mapped onto contract IDs
+    # (unknown purpose or role, or a consent requirement that needs interpretation) and the assistant has to decide
+    requested = purpose_mask(arg["purposes"], PURPOSE_MAP)
+    category = role_category(arg["receiver_role"])
+    requireGovernment = government_required(arg["consent_requirements"])
+    if requested is None or category is None or requireGovernment is None:
+        return None
+    patient, receiver = arg["patient_address"], arg["receiver_address"]
+    roleFunction, roleId = category
+
+    directory = get_user_directory()
+    reads = [
+        readSpecificConsents(patient, receiver),
+        readPatientConsents(roleFunction, patient),
+        readPatientConsents("getUniversalConsents", patient),
+        directory.registration(receiver)
+    ]
+    if requireGovernment:
+        reads.append(readGovernmentConsents(arg["sender_country"], receiver))
+    with pinned_block():
+        results = await asyncio.gather(*reads)
+    consents = {"getSpecificConsents": results[0], roleFunction: results[1], "getUniversalConsents": results[2]}
+    if requireGovernment:
+        consents["getGovernmentConsents"] = results[4]
+
+    decision = evaluate(requested, receiver, arg["receiver_country"], roleFunction, consents, requireGovernment)
+    registered, receiverRole = results[3]
+    if not registered:
+        decision.update(valid=False, allowed_data_types=[], receiver="Receiver is invalid because it is not registered")
+    elif receiverRole != roleId:
+        decision.update(valid=False, allowed_data_types=[], receiver=f"Receiver is invalid because it is registered with role {receiverRole}, not as a {arg['receiver_role']}")
+    else:
+        decision["receiver"] = "Receiver validated successfully"
+    decision["allowed_data_types"] = [DATA_TYPE_MAP[d] for d in decision["allowed_data_types"]]
+    decision["purposes"] = [PURPOSE_MAP[p] for p in from_mask(requested, ALL_PURPOSES)]
+    decision["government_consent_required"] = requireGovernment
+    return json.dumps(decision)
+
+async def record_consent_answer(user_input: str, answer: str, threadId: str):
+    # Keep the thread history complete when the rule engine decided, so follow-up questions have context
+    await client.beta.threads.messages.create(
+        thread_id=threadId,
+        role="user",
+        content=user_input
+    )
+    await client.beta.threads.messages.create(
+        thread_id=threadId,
+        role="assistant",
+        content=answer
+    )
+
+# Tool handlers with progress updates for the UI
+async def getSpecificConsentWithProgress(arg: dict):
+    step("Consent Agent", "🔍 Searching for valid patient consent...")
+    return await getSpecificConsent(arg["patient"], arg["receiver"])
+
+async def getGovernmentConsentWithProgress(arg: dict):
+    step("Consent Agent", "🔍 Searching for valid government consent...")
+    return await getGovernmentConsent(arg["country"], arg["receiver"])
+
+async def validateReceiverWithProgress(arg: dict):
+    step("Consent Agent", "⚙️ Validating the receiver...")
+    return await validateReceiver(arg["address"], arg["role"])
+
+# Consent rows: local mirror first, then the planned or batched on-chain read
+async def readSpecificConsents(patient: str, receiver: str):
+    return await get_consent_mirror().read(
+        "getSpecificConsents", patient, receiver,
+        lambda: planned(("getSpecificConsents", patient, receiver), lambda: batched_call(get_consent_contract().functions.getSpecificConsents(patient, receiver)))
+    )
+
+async def readGovernmentConsents(country: str, receiver: str):
+    government = await get_user_directory().government_address(country)
+    return await get_consent_mirror().read(
+        "getGovernmentConsents", government, receiver,
+        lambda: planned(("getGovernmentConsents", country, receiver), lambda: batched_call(get_consent_contract().functions.getGovernmentConsents(government, receiver)))
+    )
+
+async def readPatientConsents(function: str, patient: str):
+    return await get_consent_mirror().read(
+        function, patient, None,
+        lambda: planned((function, patient), lambda: batched_call(getattr(get_consent_contract().functions, function)(patient)))
+    )
+
+# Convert to a JSON-style list of dicts
+def formatSpecificConsents(rows) -> list:
+    return [
+        {
+            "Receiver Address": r[0],
+            "Data Types": [DATA_TYPE_MAP.get(d, f"Unknown({d})") for d in r[1]],
+            "Purposes": [PURPOSE_MAP.get(p, f"Unknown({p})") for p in r[2]],
+            "Anonymity": r[3],
+            "Duration": r[4],
+            "Active": r[5],
+            "ConsentID": r[6]
+        }
+        for r in rows
+    ]
+
+def formatGeneralConsents(rows) -> list:
+    return [
+        {
+            "Data Types": [DATA_TYPE_MAP.get(d, f"Unknown({d})") for d in r[0]],
+            "Purposes": [PURPOSE_MAP.get(p, f"Unknown({p})") for p in r[1]],
+            "Receiver Locations": r[2],
+            "Anonymity": r[3],
+            "Duration": r[4],
+            "Active": r[5],
+            "ConsentID": r[6]
+        }
+        for r in rows
+    ]
+
+def formatGovernmentConsents(rows) -> list:
+    return [
+        {
+            "Data Types": [DATA_TYPE_MAP.get(d, f"Unknown({d})") for d in r[0]],
+            "Purposes": [PURPOSE_MAP.get(p, f"Unknown({p})") for p in r[1]],
+            "Receiver Address": r[2],
+            "Active": r[3],
+            "ConsentID": r[4]
+        }
+        for r in rows
+    ]
+
+def _columns(function: str):
+    if function == "getSpecificConsents":
+        return COMPACT_COLUMNS["specific"]
+    return COMPACT_COLUMNS["government" if function == "getGovernmentConsents" else "general"]
+
+def _cell(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (list, tuple)):
+        return ",".join(str(v) for v in value)
+    return str(value)
+
+def consentLegend() -> str:
+    # ID legend for the compact tables, only in the first tool output of a thread
+    thread = current_consent_thread.get()
+    if thread is not None:
+        if thread.legend_pending or legend_submitted(thread.id):
+            return ""
+        thread.legend_pending = True
+    return (
+        "dt: " + "; ".join(f"{id}={name}" for id, name in DATA_TYPE_MAP.items()) + "\n"
+        "p: " + "; ".join(f"{id}={name}" for id, name in PURPOSE_MAP.items()) + "\n"
+        "anon: 1=anonymization required; rows are active, unexpired consents\n"
+    )
+
+def compactConsents(function: str, rows) -> str:
+    # Active, unexpired rows as a table under a short header; empty string when none are left
+    now = time.time()
+    activeSlot = 3 if function == "getGovernmentConsents" else 5
+    header, columns = _columns(function)
+    rows = [r for r in rows or [] if r[activeSlot] and not is_expired(function, r, now)]
+    if not rows:
+        return ""
+    return "\n".join([header] + ["|".join(_cell(v) for v in columns(r)) for r in rows])
+
+def encodeConsents(function: str, rows, verbose) -> str:
+    # Tool output for a getter; verbose is the JSON-style value (or the "no consent" message)
+    if CONSENT_OUTPUT_FORMAT != "compact":
+        return json.dumps(verbose)
+    if isinstance(verbose, str):
+        return verbose
+    return consentLegend() + (compactConsents(function, rows) or "No active consents")
+
 # Calling SC functions
 async def getSpecificConsent(patient: str, receiver: str):
-    response = await consentSC.functions.getSpecificConsents(patient, receiver).call()
+    response = await readSpecificConsents(patient, receiver)
     if (not response or (
         len(response) == 1 and
         response[0][0] == '0x0000000000000000000000000000000000000000' and
         response[0][5] is False)):
         specificConsent = "No specific consent available for the specific receiver"
     else:
-        # Convert to a JSON-style list of dicts
-        specificConsent = [
-            {
-                "Receiver Address": r[0],
-                "Data Types": [DATA_TYPE_MAP.get(d, f"Unknown({d})") for d in r[1]],
-                "Purposes": [PURPOSE_MAP.get(p, f"Unknown({p})") for p in r[2]],
-                "Anonymity": r[3],
-                "Duration": r[4],
-                "Active": r[5],
-                "ConsentID": r[6]
-            }
-            for r in response
-        ]
-    return json.dumps(specificConsent)
+        specificConsent = formatSpecificConsents(response)
+    return encodeConsents("getSpecificConsents", response, specificConsent)
 
 async def getGovernmentConsent(country: str, receiver: str):
-    government = await dataSC.functions.getGovernmentAddress(country).call()
-    response = await consentSC.functions.getGovernmentConsents(government, receiver).call()
+    response = await readGovernmentConsents(country, receiver)
     if (not response or (
         len(response) == 1 and
         response[0][0] == '0x0000000000000000000000000000000000000000' and
         response[0][5] is False)):
         governmentConsents = "No government consent available for the specific receiver"
     else:
-        # Convert to a JSON-style list of dicts
-        governmentConsents = [
-            {
-                "Data Types": [DATA_TYPE_MAP.get(d, f"Unknown({d})") for d in r[0]],
-                "Purposes": [PURPOSE_MAP.get(p, f"Unknown({p})") for p in r[1]],
-                "Receiver Address": r[2],
-                "Active": r[3],
-                "ConsentID": r[4]
-            }
-            for r in response
-        ]
-    return json.dumps(governmentConsents)
+        governmentConsents = formatGovernmentConsents(response)
+    return encodeConsents("getGovernmentConsents", response, governmentConsents)
 
 async def getUniversalConsents(patient: str):
-    response = await consentSC.functions.getUniversalConsents(patient).call()
+    response = await readPatientConsents("getUniversalConsents", patient)
     if not response:
         universalConsents = "No universal consents available for this patient"
     else:
-        # Convert to a JSON-style list of dicts
-        universalConsents = [
-            {
-                "Data Types": [DATA_TYPE_MAP.get(d, f"Unknown({d})") for d in r[0]],
-                "Purposes": [PURPOSE_MAP.get(p, f"Unknown({p})") for p in r[1]],
-                "Receiver Locations": r[2],
-                "Anonymity": r[3],
-                "Duration": r[4],
-                "Active": r[5],
-                "ConsentID": r[6]
-            }
-            for r in response
-        ]
-    return json.dumps(universalConsents)
+        universalConsents = formatGeneralConsents(response)
+    return encodeConsents("getUniversalConsents", response, universalConsents)
 
 async def getHospitalConsents(patient: str):
-    response = await consentSC.functions.getHospitalConsents(patient).call()
+    response = await readPatientConsents("getHospitalConsents", patient)
     if not response:
         hospitalConsents = "No hospital consents available for this patient"
     else:
-        # Convert to a JSON-style list of dicts
-        hospitalConsents = [
-            {
-                "Data Types": [DATA_TYPE_MAP.get(d, f"Unknown({d})") for d in r[0]],
-                "Purposes": [PURPOSE_MAP.get(p, f"Unknown({p})") for p in r[1]],
-                "Receiver Locations": r[2],
-                "Anonymity": r[3],
-                "Duration": r[4],
-                "Active": r[5],
-                "ConsentID": r[6]
-            }
-            for r in response
-        ]
-    return json.dumps(hospitalConsents)
+        hospitalConsents = formatGeneralConsents(response)
+    return encodeConsents("getHospitalConsents", response, hospitalConsents)
 
 async def getResearchLabConsents(patient: str):
-    response = await consentSC.functions.getLabConsents(patient).call()
+    response = await readPatientConsents("getLabConsents", patient)
     if not response:
         labConsents = "No research lab consents available for this patient"
     else:
-        # Convert to a JSON-style list of dicts
-        labConsents = [
-            {
-                "Data Types": [DATA_TYPE_MAP.get(d, f"Unknown({d})") for d in r[0]],
-                "Purposes": [PURPOSE_MAP.get(p, f"Unknown({p})") for p in r[1]],
-                "Receiver Locations": r[2],
-                "Anonymity": r[3],
-                "Duration": r[4],
-                "Active": r[5],
-                "ConsentID": r[6]
-            }
-            for r in response
-        ]
-    return json.dumps(labConsents)
+        labConsents = formatGeneralConsents(response)
+    return encodeConsents("getLabConsents", response, labConsents)
 
 async def getInsuranceConsents(patient: str):
-    response = await consentSC.functions.getInsuranceConsents(patient).call()
+    response = await readPatientConsents("getInsuranceConsents", patient)
     if not response:
         insuranceConsents = "No insurance company consents available for this patient"
     else:
-        # Convert to a JSON-style list of dicts
-        insuranceConsents = [
-            {
-                "Data Types": [DATA_TYPE_MAP.get(d, f"Unknown({d})") for d in r[0]],
-                "Purposes": [PURPOSE_MAP.get(p, f"Unknown({p})") for p in r[1]],
-                "Receiver Locations": r[2],
-                "Anonymity": r[3],
-                "Duration": r[4],
-                "Active": r[5],
-                "ConsentID": r[6]
-            }
-            for r in response
-        ]
-    return json.dumps(insuranceConsents)
+        insuranceConsents = formatGeneralConsents(response)
+    return encodeConsents("getInsuranceConsents", response, insuranceConsents)
 
 async def validateReceiver(address: str, role):
-    registered = await dataSC.functions.isUserRegistered(address).call()
-    userRole = await dataSC.functions.getUserRole(address).call()
+    registered, userRole = await get_user_directory().registration(address)
     if (registered and (userRole == role)):
         return "Receiver validated successfully"
     elif not registered:
         return "Receiver is invalid because it is not registered"
     elif (userRole != role):
-        return f"Receiver is invalid because you are assuming the receiver is a {role}, but but it is actually a {userRole}"
\ No newline at end of file
+        return f"Receiver is invalid because you are assuming the receiver is a {role}, but but it is actually a {userRole}"
+
+# Function definition of the composite consent tool, to be registered on the Consent assistant
+CONSENT_BUNDLE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "getConsentBundle",
+        "description": (
+            "Fetches every consent category relevant to a data sharing request (specific, role-based, universal and "
+            "government consents) together with the receiver validation in one step. Only active, unexpired consents "
+            "that cover the requested purposes and the receiver or its country are returned."
+        ),
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "patient": {"type": "string", "description": "Ethereum address of the patient"},
+                "receiver": {"type": "string", "description": "Ethereum address of the receiver"},
+                "role": {"type": "string", "description": "Receiver role: Hospital, Research Lab or Insurance Company"},
+                "receiver_country": {"type": "string", "description": "Country the receiver is located in"},
+                "sender_country": {"type": "string", "description": "Country of the sender, whose government consents apply"},
+                "purposes": {"type": "array", "items": {"type": "string"}, "description": "Requested purposes of sharing"},
+                "data_types": {"type": "array", "items": {"type": "string"}, "description": "Requested data types; all data types when omitted"}
+            },
+            "required": ["patient", "receiver", "role", "receiver_country", "sender_country", "purposes"]
+        }
+    }
+}
+CONSENT_CATEGORY_LABELS = {
+    "getSpecificConsents": "Specific Consents",
+    "getHospitalConsents": "Hospital Consents",
+    "getLabConsents": "Research Lab Consents",
+    "getInsuranceConsents": "Insurance Company Consents",
+    "getUniversalConsents": "Universal Consents",
+    "getGovernmentConsents": "Government Consents",
+}
+
+async def getConsentBundle(arg: dict):
+    # All consent reads and the receiver validation of one verification, concurrently and pre-filtered
+    patient, receiver = arg["patient"], arg["receiver"]
+    # Unrecognized purposes or data types leave the rows unfiltered on that dimension for the assistant to judge
+    requested = purpose_mask(arg["purposes"], PURPOSE_MAP) or 0
+    dataTypeIds = {name.lower(): id for id, name in DATA_TYPE_MAP.items()}
+    requestedTypes = [dataTypeIds.get(str(name).strip().lower()) for name in arg.get("data_types") or []]
+    typeMask = to_mask(requestedTypes, ALL_DATA_TYPES) if requestedTypes and None not in requestedTypes else 0
+    category = role_category(arg["role"])
+    # An unknown role could be any of the role-based categories
+    roleFunctions = [category[0]] if category else sorted({function for function, _ in ROLE_CATEGORIES.values()})
+
+    functions = ["getSpecificConsents", *roleFunctions, "getUniversalConsents"]
+    with pinned_block():
+        results = await asyncio.gather(
+            readSpecificConsents(patient, receiver),
+            *(readPatientConsents(function, patient) for function in roleFunctions + ["getUniversalConsents"]),
+            readGovernmentConsents(arg["sender_country"], receiver),
+            validateReceiver(receiver, category[1] if category else arg["role"])
+        )
+
+    now = time.time()
+    rowSets = dict(zip(functions + ["getGovernmentConsents"], results[:-1]))
+    formatters = {"getSpecificConsents": formatSpecificConsents, "getGovernmentConsents": formatGovernmentConsents}
+    bundle = {
+        "Receiver Validation": results[-1],
+        "Requested Purposes": [PURPOSE_MAP[p] for p in from_mask(requested, ALL_PURPOSES)] if requested else arg["purposes"],
+    }
+    compact = CONSENT_OUTPUT_FORMAT == "compact"
+    for function, rows in rowSets.items():
+        rows = [
+            r for r in rows or []
+            if matches(function, r, requested, receiver, arg["receiver_country"], now)
+            and (not typeMask or to_mask(r[0 if function != "getSpecificConsents" else 1], ALL_DATA_TYPES) & typeMask)
+        ]
+        if compact:
+            bundle[CONSENT_CATEGORY_LABELS[function]] = compactConsents(function, rows) or "none"
+        else:
+            bundle[CONSENT_CATEGORY_LABELS[function]] = formatters.get(function, formatGeneralConsents)(rows) if rows else "No matching consents"
+    if compact:
+        # One section per category instead of JSON, so the tables are not escaped
+        return consentLegend() + "\n".join(
+            f"[{label}]\n{value}" if "\n" in str(value) else f"{label}: {_cell(value)}" for label, value in bundle.items()
+        )
+    return json.dumps(bundle)
+
+async def getConsentBundleWithProgress(arg: dict):
+    step("Consent Agent", "🔍 Collecting all consents and validating the receiver...")
+    return await getConsentBundle(arg)
+
+CONSENT_TOOLS = {
+    "getConsentBundle": getConsentBundle,
+    "getSpecificConsent": lambda arg: getSpecificConsent(arg["patient"], arg["receiver"]),
+    "getGovernmentConsent": lambda arg: getGovernmentConsent(arg["country"], arg["receiver"]),
+    "getUniversalConsents": lambda arg: getUniversalConsents(arg["patient"]),
+    "getHospitalConsents": lambda arg: getHospitalConsents(arg["patient"]),
+    "getResearchLabConsents": lambda arg: getResearchLabConsents(arg["patient"]),
+    "getInsuranceCompanyConsents": lambda arg: getInsuranceConsents(arg["patient"]),
+    "validateReceiver": lambda arg: validateReceiver(arg["address"], arg["role"]),
+}
@@ -1,122 +1,83 @@
-import streamlit as st
-from openai import OpenAI
+from openaiClient import client
 import os
+from progressEvents import step
+from runExecutor import RunExecutor
 
 
 # Set up your API key
 os.environ["OPENAI_API_KEY"] = ""
 SHARING_ASSISTANT_ID = ""
 
-client = OpenAI()
 
-def submitToolOutputs(output, threadId, runId, callID):
-    run = client.beta.threads.runs.submit_tool_outputs(
-        thread_id=threadId,
-        run_id=runId,
-        tool_outputs=[
-            {
-                "tool_call_id": callID,
-                "output": output
-            }
-        ]
-    )
-    return run
-
-
-async def run_data_filtering_agent(user_input: str, file_path: str, output_path: str, threadId: str):
+async def run_data_filtering_agent(user_input: str, file_path: str, threadId: str):
     # Step 1: Read patient data from file as plain text
-    st.markdown(
-        '<span style="font-size:14px;">📂 Reading uploaded patient data...</span>',
-        unsafe_allow_html=True
-    )
-    st.session_state.chat_history.append({
-        "role": "status",
-        "agent": "Data Filtering Agent",
-        "label": "✓ 📝 Data Filtering Agent analysis completed!",
-        "details": (
-            "📂 Reading uploaded patient data..."
-        )
-    })
+    step("Data Filtering Agent", "📂 Reading uploaded patient data...")
     with open(file_path, 'r', encoding='utf-8') as file:
         patient_data_text = file.read()
 
     # Step 2: Add user messages
-    client.beta.threads.messages.create(
+    await client.beta.threads.messages.create(
         thread_id=threadId,
         role="user",
         content=f"These are the data sharing requirements:\n{user_input}"
     )
     
-    client.beta.threads.messages.create(
+    await client.beta.threads.messages.create(
         thread_id=threadId,
         role="user",
         content=f"This is the patient data:\n{patient_data_text}"
     )
 
     # Step 3: Run the assistant on the thread
-    st.markdown(
-        '<span style="font-size:14px;">⚙️ Filtering out restricted fields and applying anonymization...</span>',
-        unsafe_allow_html=True
-    )
-    for chat in st.session_state.chat_history:
-        if chat["role"] == "status" and chat["agent"] == "Data Filtering Agent":
-            chat["details"] += "\n ⚙️ Filtering out restricted fields and applying anonymization..."
-            break
-    run = client.beta.threads.runs.create(
+    step("Data Filtering Agent", "⚙️ Filtering out restricted fields and applying anonymization...")
+    run = await client.beta.threads.runs.create(
         thread_id=threadId, 
         assistant_id=SHARING_ASSISTANT_ID)
 
     # Step 4: Wait for run completion
+    executor = RunExecutor(client, "Data Filtering Agent")
     while True:
-        run = client.beta.threads.runs.retrieve(thread_id=threadId, run_id=run.id)
-        if (run.status == "completed"):
-            messages = client.beta.threads.messages.list(thread_id=threadId)
+        run = await executor.wait(threadId, run.id)
+        if run.status in ["failed", "cancelled", "expired", "incomplete", "requires_action"]:
+            raise Exception(f"Assistant run failed with status: {run.status}")
+        elif (run.status == "completed"):
+            messages = await client.beta.threads.messages.list(thread_id=threadId)
             if (messages.data and messages.data[0].role == "assistant" and len(messages.data[0].content) > 0):
                 llmResponse = messages.data[0].content[0].text.value
-                
-                st.markdown(
-                    '<span style="font-size:14px;">📂 Saving filtered data to new file...</span>',
-                    unsafe_allow_html=True
-                )
-                for chat in st.session_state.chat_history:
-                    if chat["role"] == "status" and chat["agent"] == "Data Filtering Agent":
-                        chat["details"] += "\n 📂 Saving filtered data to new file..."
-                        break
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    f.write(llmResponse)
-                print(f"✅ Filtered file saved to: {output_path}")
-                break
-                
-    return "✅ Data Filtered Successfully"
+                # The filtered record stays in memory and is handed straight to the sharing stage
+                print("✅ Patient data filtered")
+                executor.report()
+                return llmResponse
+            raise Exception("Assistant run completed without a response")
 
-async def run_data_filtering_agent2(user_input: str, output_path: str, threadId: str):
+async def run_data_filtering_agent2(user_input: str, threadId: str):
 
     # Step 2: Add user messages
-    client.beta.threads.messages.create(
+    await client.beta.threads.messages.create(
         thread_id=threadId,
         role="user",
         content=user_input
     )
 
     # Step 3: Run the assistant on the thread
-    run = client.beta.threads.runs.create(
+    run = await client.beta.threads.runs.create(
         thread_id=threadId, 
         assistant_id=SHARING_ASSISTANT_ID)
 
     # Step 4: Wait for run completion
+    executor = RunExecutor(client, "Data Filtering Agent")
     while True:
-        run = client.beta.threads.runs.retrieve(thread_id=threadId, run_id=run.id)
-        if (run.status == "completed"):
-            messages = client.beta.threads.messages.list(thread_id=threadId)
+        run = await executor.wait(threadId, run.id)
+        if run.status in ["failed", "cancelled", "expired", "incomplete", "requires_action"]:
+            raise Exception(f"Assistant run failed with status: {run.status}")
+        elif (run.status == "completed"):
+            messages = await client.beta.threads.messages.list(thread_id=threadId)
             if (messages.data and messages.data[0].role == "assistant" and len(messages.data[0].content) > 0):
                 llmResponse = messages.data[0].content[0].text.value
-                
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    f.write(llmResponse)
-                print(f"✅ Filtered file saved to: {output_path}")
-                break
-                    
-    return "✅ Data Filtered Again Successfully"
+                print("✅ Patient data filtered again")
+                executor.report()
+                return llmResponse
+            raise Exception("Assistant run completed without a response")
 
 async def run_data_filtering_agent3(user_input: str, file_path: str, threadId: str):
     # Step 1: Read patient data from file as plain text
@@ -124,28 +85,33 @@ async def run_data_filtering_agent3(user_input: str, file_path: str, threadId: s
         patient_data_text = file.read()
 
     # Step 2: Add user messages
-    client.beta.threads.messages.create(
+    await client.beta.threads.messages.create(
         thread_id=threadId,
         role="user",
         content=f"These are the data sharing requirements:\n{user_input}"
     )
     
-    client.beta.threads.messages.create(
+    await client.beta.threads.messages.create(
         thread_id=threadId,
         role="user",
         content=f"This is the patient data:\n{patient_data_text}"
     )
 
     # Step 3: Run the assistant on the thread
-    run = client.beta.threads.runs.create(
+    run = await client.beta.threads.runs.create(
         thread_id=threadId, 
         assistant_id=SHARING_ASSISTANT_ID)
 
     # Step 4: Wait for run completion
+    executor = RunExecutor(client, "Data Filtering Agent")
     while True:
-        run = client.beta.threads.runs.retrieve(thread_id=threadId, run_id=run.id)
-        if (run.status == "completed"):
-            messages = client.beta.threads.messages.list(thread_id=threadId)
+        run = await executor.wait(threadId, run.id)
+        if run.status in ["failed", "cancelled", "expired", "incomplete", "requires_action"]:
+            raise Exception(f"Assistant run failed with status: {run.status}")
+        elif (run.status == "completed"):
+            messages = await client.beta.threads.messages.list(thread_id=threadId)
             if (messages.data and messages.data[0].role == "assistant" and len(messages.data[0].content) > 0):
                 llmResponse = messages.data[0].content[0].text.value
-                return llmResponse
\ No newline at end of file
+                executor.report()
+                return llmResponse
+            raise Exception("Assistant run completed without a response")
\ No newline at end of file
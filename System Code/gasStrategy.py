@@ -0,0 +1,118 @@
+import threading
+import time
+from runtimeContext import get_web3
+from tracing import span
+
+
+# Gas limits come from estimate_gas, cached per function and calldata shape; fees follow EIP-1559 using a
+# rolling eth_feeHistory window. Profiles trade inclusion speed against cost.
+DEFAULT_GAS_LIMIT = 3000000
+GAS_LIMIT_MARGIN = 1.25
+GAS_ESTIMATE_TTL = 3600
+FEE_HISTORY_BLOCKS = 20
+FEE_HISTORY_TTL = 12
+REWARD_PERCENTILES = [10, 25, 50, 75, 90]
+MIN_PRIORITY_FEE = 10 ** 9
+
+URGENCY_PROFILES = {
+    # Treatment shares should land in the next blocks even if the base fee jumps
+    "treatment": {"reward_percentile": 75, "base_fee_multiplier": 2.0},
+    "standard": {"reward_percentile": 50, "base_fee_multiplier": 1.5},
+    # Research and trial shares can wait for cheaper blocks
+    "research": {"reward_percentile": 25, "base_fee_multiplier": 1.125},
+}
+PURPOSE_URGENCY = {
+    "treatment": "treatment",
+    "research": "research",
+    "clinical trial": "research",
+    1: "treatment",
+    2: "research",
+    4: "research",
+}
+
+_lock = threading.Lock()
+_gas_estimates = {}
+_fee_history = {"fetched_at": 0, "base_fee": None, "rewards": None}
+
+
+def urgency_for_purpose(purposes) -> str:
+    # Accepts purpose names or contract purpose ids; the most urgent purpose wins
+    if not isinstance(purposes, (list, tuple)):
+        purposes = [purposes]
+    urgencies = {PURPOSE_URGENCY.get(p.strip().lower() if isinstance(p, str) else p, "standard") for p in purposes}
+    for urgency in ["treatment", "standard", "research"]:
+        if urgency in urgencies:
+            return urgency
+    return "standard"
+
+
+def _shape(value):
+    # Calldata size depends on list lengths and byte lengths (in 32-byte words), not on the values
+    if isinstance(value, (list, tuple)):
+        return ("list", len(value), tuple(_shape(item) for item in value[:8]))
+    if isinstance(value, (bytes, str)):
+        return ("bytes", (len(value) + 31) // 32)
+    return type(value).__name__
+
+
+def calldata_shape(function) -> tuple:
+    return (function.address, function.fn_name, tuple(_shape(arg) for arg in function.args))
+
+
+async def estimate_gas_limit(function, sender: str) -> int:
+    key = calldata_shape(function)
+    with _lock:
+        cached = _gas_estimates.get(key)
+    if cached is not None and time.time() - cached[1] < GAS_ESTIMATE_TTL:
+        return cached[0]
+    try:
+        with span("web3.estimate_gas", function=function.fn_name):
+            estimate = await function.estimate_gas({'from': sender})
+    except Exception as e:
+        if "revert" in str(e).lower():
+            raise
+        print(f"⚠️ Gas estimation for {function.fn_name} failed ({e}). Using the default gas limit.")
+        return DEFAULT_GAS_LIMIT
+    limit = int(estimate * GAS_LIMIT_MARGIN)
+    with _lock:
+        _gas_estimates[key] = (limit, time.time())
+    return limit
+
+
+async def refresh_fee_history(force: bool = False):
+    with _lock:
+        fresh = time.time() - _fee_history["fetched_at"] < FEE_HISTORY_TTL
+    if fresh and not force:
+        return _fee_history
+    with span("web3.fee_history", blocks=FEE_HISTORY_BLOCKS):
+        history = await get_web3().eth.fee_history(FEE_HISTORY_BLOCKS, "latest", REWARD_PERCENTILES)
+    # The last base fee is the one of the next block
+    base_fee = history["baseFeePerGas"][-1] if history.get("baseFeePerGas") else None
+    rewards = [sorted(block[i] for block in history.get("reward") or []) for i in range(len(REWARD_PERCENTILES))]
+    with _lock:
+        _fee_history.update(fetched_at=time.time(), base_fee=base_fee, rewards=rewards)
+    return _fee_history
+
+
+async def fee_params(urgency: str = "standard") -> dict:
+    profile = URGENCY_PROFILES.get(urgency, URGENCY_PROFILES["standard"])
+    try:
+        history = await refresh_fee_history()
+    except Exception as e:
+        print(f"⚠️ Fee history unavailable ({e}). Falling back to the legacy gas price.")
+        history = {"base_fee": None}
+    if not history["base_fee"]:
+        # Chains without EIP-1559 base fees
+        return {'gasPrice': await get_web3().eth.gas_price}
+
+    rewards = history["rewards"][REWARD_PERCENTILES.index(profile["reward_percentile"])]
+    # Median of the window at the profile's percentile smooths out single-block spikes
+    priority_fee = max(rewards[len(rewards) // 2] if rewards else 0, MIN_PRIORITY_FEE)
+    return {
+        'maxPriorityFeePerGas': priority_fee,
+        'maxFeePerGas': int(history["base_fee"] * profile["base_fee_multiplier"]) + priority_fee
+    }
+
+
+async def transaction_params(function, sender: str, urgency: str = "standard") -> dict:
+    return {'gas': await estimate_gas_limit(function, sender), **(await fee_params(urgency))}
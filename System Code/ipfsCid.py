@@ -0,0 +1,87 @@
+import base64
+import hashlib
+
+
+# Local CIDv1 computation matching `ipfs add --cid-version=1` (and Pinata with cidVersion 1):
+# fixed 256 KiB chunks stored as raw leaves, linked by a balanced UnixFS dag-pb tree of up to 174 links per node
+CHUNK_SIZE = 256 * 1024
+MAX_LINKS = 174
+RAW_CODEC = 0x55
+DAG_PB_CODEC = 0x70
+SHA2_256 = 0x12
+UNIXFS_FILE = 2
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field_bytes(number: int, value: bytes) -> bytes:
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def _field_varint(number: int, value: int) -> bytes:
+    return _varint(number << 3) + _varint(value)
+
+
+def _cid(codec: int, data: bytes) -> bytes:
+    return b"\x01" + _varint(codec) + bytes([SHA2_256, 32]) + hashlib.sha256(data).digest()
+
+
+def encode_cid(cid: bytes) -> str:
+    # Multibase base32 (the "b..." form the IPFS APIs return for CIDv1)
+    return "b" + base64.b32encode(cid).decode("ascii").lower().rstrip("=")
+
+
+def _parent_node(children: list) -> tuple:
+    # children are (cid, file bytes, total serialized size) tuples
+    unixfs = _field_varint(1, UNIXFS_FILE) + _field_varint(3, sum(size for _, size, _ in children))
+    unixfs += b"".join(_field_varint(4, size) for _, size, _ in children)
+    links = b"".join(
+        _field_bytes(2, _field_bytes(1, cid) + _field_bytes(2, b"") + _field_varint(3, tsize))
+        for cid, _, tsize in children
+    )
+    node = links + _field_bytes(1, unixfs)
+    return _cid(DAG_PB_CODEC, node), sum(size for _, size, _ in children), len(node) + sum(tsize for _, _, tsize in children)
+
+
+class CIDBuilder:
+    # Incremental: feed the content with update() in any block sizes, then call cid()
+    def __init__(self):
+        self.buffer = bytearray()
+        self.leaves = []
+
+    def update(self, data: bytes):
+        self.buffer += data
+        while len(self.buffer) >= CHUNK_SIZE:
+            self._add_leaf(bytes(self.buffer[:CHUNK_SIZE]))
+            del self.buffer[:CHUNK_SIZE]
+
+    def _add_leaf(self, chunk: bytes):
+        self.leaves.append((_cid(RAW_CODEC, chunk), len(chunk), len(chunk)))
+
+    def cid(self) -> str:
+        if self.buffer or not self.leaves:
+            self._add_leaf(bytes(self.buffer))
+            self.buffer.clear()
+        level = self.leaves
+        if len(level) == 1:
+            return encode_cid(level[0][0])
+        while len(level) > 1:
+            level = [_parent_node(level[i:i + MAX_LINKS]) for i in range(0, len(level), MAX_LINKS)]
+        return encode_cid(level[0][0])
+
+
+def compute_cid(chunks) -> str:
+    builder = CIDBuilder()
+    for chunk in chunks:
+        builder.update(chunk)
+    return builder.cid()
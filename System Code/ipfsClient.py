@@ -0,0 +1,143 @@
+import asyncio
+import json
+import random
+import threading
+import uuid
+import weakref
+import httpx
+from metrics import ipfsBytes
+from progressEvents import emit
+from tracing import span
+
+
+# Binary multipart uploads to Pinata or any IPFS node exposing the Kubo /api/v0/add endpoint
+PINATA_PIN_FILE_URL = "https://api.pinata.cloud/pinning/pinFileToIPFS"
+LOCAL_IPFS_ADD_URL = "http://127.0.0.1:5001/api/v0/add?cid-version=1&pin=true"
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 60.0
+UPLOAD_TIMEOUT = httpx.Timeout(300.0, connect=10.0)
+UPLOAD_RETRIES = 3
+RETRY_BACKOFF = 0.5
+PROGRESS_INTERVAL = 1024 * 1024
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+_lock = threading.Lock()
+_http_clients = weakref.WeakKeyDictionary()
+
+
+class IPFSUploadError(Exception):
+    pass
+
+
+class PinataBackend:
+    def __init__(self, api_key: str, secret_api_key: str, url: str = PINATA_PIN_FILE_URL):
+        self.name = "pinata"
+        self.url = url
+        self.api_key = api_key
+        self.secret_api_key = secret_api_key
+
+    def headers(self) -> dict:
+        return {"pinata_api_key": self.api_key, "pinata_secret_api_key": self.secret_api_key}
+
+    def form_fields(self, name: str) -> dict:
+        return {
+            "pinataOptions": json.dumps({"cidVersion": 1}),
+            "pinataMetadata": json.dumps({"name": name})
+        }
+
+    def parse_cid(self, body: dict) -> str:
+        return body["IpfsHash"]
+
+
+class LocalIPFSBackend:
+    # A local IPFS node (or any stand-in speaking the same API) for development and offline runs
+    def __init__(self, url: str = LOCAL_IPFS_ADD_URL):
+        self.name = "local"
+        self.url = url
+
+    def headers(self) -> dict:
+        return {}
+
+    def form_fields(self, name: str) -> dict:
+        return {}
+
+    def parse_cid(self, body: dict) -> str:
+        return body["Hash"]
+
+
+def get_http_client() -> httpx.AsyncClient:
+    # Keep-alive connections are bound to the loop that opened them, so keep one pooled client per loop
+    loop = asyncio.get_running_loop()
+    with _lock:
+        http = _http_clients.get(loop)
+        if http is None:
+            http = httpx.AsyncClient(
+                timeout=UPLOAD_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY
+                )
+            )
+            _http_clients[loop] = http
+    return http
+
+
+def _multipart_parts(boundary: str, fields: dict, filename: str) -> tuple:
+    head = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+        for name, value in fields.items()
+    )
+    head += (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode("utf-8")
+    tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return head, tail
+
+
+async def upload_stream(chunks_factory, backend, name: str = "encrypted-data", size: int = None) -> str:
+    # chunks_factory() returns a fresh iterable of byte chunks, so a failed attempt can be replayed
+    boundary = uuid.uuid4().hex
+    head, tail = _multipart_parts(boundary, backend.form_fields(name), name)
+    headers = {**backend.headers(), "Content-Type": f"multipart/form-data; boundary={boundary}"}
+    if size is not None:
+        headers["Content-Length"] = str(len(head) + size + len(tail))
+
+    with span("ipfs.upload", backend=backend.name, bytes=size) as upload:
+        for attempt in range(1, UPLOAD_RETRIES + 1):
+            progress = {"sent": 0, "reported": 0}
+
+            async def body():
+                yield head
+                for chunk in chunks_factory():
+                    progress["sent"] += len(chunk)
+                    if progress["sent"] - progress["reported"] >= PROGRESS_INTERVAL:
+                        progress["reported"] = progress["sent"]
+                        emit("upload_progress", agent="Data Sharing", sent=progress["sent"], total=size)
+                    yield bytes(chunk)
+                yield tail
+
+            try:
+                response = await get_http_client().post(backend.url, content=body(), headers=headers)
+            except httpx.TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code == 200:
+                    cid = backend.parse_cid(response.json())
+                    ipfsBytes.inc(progress["sent"])
+                    emit("upload_progress", agent="Data Sharing", sent=progress["sent"], total=size)
+                    upload.set(attempts=attempt, bytes=progress["sent"])
+                    print(f"✅ Encrypted data uploaded to IPFS. CID: {cid}")
+                    return cid
+                if response.status_code not in RETRY_STATUSES:
+                    raise IPFSUploadError(f"❌ Failed to upload to IPFS: {response.status_code} - {response.text}")
+                error = f"{response.status_code} - {response.text}"
+
+            upload.set(attempts=attempt)
+            if attempt < UPLOAD_RETRIES:
+                print(f"⚠️ IPFS upload attempt {attempt} failed ({error}). Retrying...")
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1) * random.uniform(0.8, 1.2))
+
+    raise IPFSUploadError(f"❌ Failed to upload to IPFS after {UPLOAD_RETRIES} attempts: {error}")
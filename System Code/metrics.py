@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+
+
+# Process-level counters and histograms, rendered as Prometheus text or written to a snapshot file
+METRICS_SNAPSHOT_PATH = "metrics_snapshot.json"
+METRICS_SNAPSHOT_INTERVAL = 60
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+POLL_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+_lock = threading.Lock()
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+    def snapshot(self) -> list:
+        return [{"labels": dict(key), "value": value} for key, value in sorted(self.values.items())]
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with _lock:
+            series = self.values.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, series["counts"]):
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+    def snapshot(self) -> list:
+        return [
+            {"labels": dict(key), "count": series["count"], "sum": series["sum"],
+             "mean": series["sum"] / series["count"] if series["count"] else None}
+            for key, series in sorted(self.values.items())
+        ]
+
+
+toolCalls = Counter("tool_calls_total", "Tool calls dispatched, by tool name")
+toolErrors = Counter("tool_call_errors_total", "Tool calls that returned an error to the assistant, by tool name")
+llmRunDuration = Histogram("llm_run_duration_seconds", "Wall time of Assistants runs until a terminal status, by agent")
+llmPollsPerRun = Histogram("llm_polls_per_run", "Status polls issued per Assistants run, by agent", POLL_BUCKETS)
+rpcCalls = Counter("rpc_calls_total", "Contract reads sent to the Ethereum node, by function")
+rpcDuration = Histogram("rpc_call_duration_seconds", "Latency of contract reads, by function", (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+# rpc_calls_total counts a multicall batch once as aggregate3; the reads inside it are counted here
+batchedReads = Counter("batched_reads_total", "Contract reads sent inside a multicall batch, by function")
+multicallBatchSize = Histogram("multicall_batch_size", "Contract reads per multicall batch", BATCH_BUCKETS)
+ipfsBytes = Counter("ipfs_uploaded_bytes_total", "Bytes uploaded to IPFS")
+transactionsSent = Counter("transactions_sent_total", "Transactions submitted, by contract function")
+transactionsConfirmed = Counter("transactions_confirmed_total", "Transactions seen mined with a receipt, by contract function")
+transactionsFailed = Counter("transactions_failed_total", "Transactions that reverted, were dropped or were replaced externally, by contract function and status")
+cacheLookups = Counter("cache_lookups_total", "Cache lookups, by cache and result (hit or miss)")
+
+REGISTRY = [toolCalls, toolErrors, llmRunDuration, llmPollsPerRun, rpcCalls, rpcDuration, batchedReads, multicallBatchSize,
+            ipfsBytes, transactionsSent, transactionsConfirmed, transactionsFailed, cacheLookups]
+
+
+def record_cache(cache: str, hit: bool):
+    cacheLookups.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def cache_hit_ratios() -> dict:
+    totals = {}
+    with _lock:
+        for key, value in cacheLookups.values.items():
+            labels = dict(key)
+            hits, lookups = totals.get(labels["cache"], (0, 0))
+            totals[labels["cache"]] = (hits + (value if labels["result"] == "hit" else 0), lookups + value)
+    return {cache: hits / lookups for cache, (hits, lookups) in totals.items() if lookups}
+
+
+def render_prometheus() -> str:
+    with _lock:
+        lines = [line for metric in REGISTRY for line in metric.render()]
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> dict:
+    with _lock:
+        metrics = {metric.name: metric.snapshot() for metric in REGISTRY}
+    return {"time": time.time(), "metrics": metrics, "cache_hit_ratios": cache_hit_ratios()}
+
+
+def write_snapshot(path: str = METRICS_SNAPSHOT_PATH):
+    data = json.dumps(snapshot(), indent=2)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(data)
+
+
+def start_snapshot_writer(path: str = METRICS_SNAPSHOT_PATH, interval: float = METRICS_SNAPSHOT_INTERVAL):
+    # Rewrites the snapshot file periodically on a daemon thread for processes without a /metrics endpoint
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(path)
+            except Exception as e:
+                print(f"⚠️ Could not write metrics snapshot: {e}")
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
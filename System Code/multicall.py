@@ -0,0 +1,163 @@
+import asyncio
+import contextlib
+import contextvars
+import threading
+import weakref
+from eth_abi import decode
+from web3 import Web3
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from metrics import batchedReads, multicallBatchSize, record_cache
+from runtimeContext import call_contract, get_web3
+from tracing import span
+
+
+# Contract reads issued within a short window are sent as one Multicall3 aggregate3 eth_call.
+# Multicall3 is deployed at the same address on mainnet, Sepolia and most other EVM chains.
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+MULTICALL3_ABI = [
+    {
+        "name": "aggregate3", "type": "function", "stateMutability": "payable",
+        "inputs": [{"name": "calls", "type": "tuple[]", "components": [
+            {"name": "target", "type": "address"},
+            {"name": "allowFailure", "type": "bool"},
+            {"name": "callData", "type": "bytes"}
+        ]}],
+        "outputs": [{"name": "returnData", "type": "tuple[]", "components": [
+            {"name": "success", "type": "bool"},
+            {"name": "returnData", "type": "bytes"}
+        ]}]
+    },
+    {
+        "name": "getBlockNumber", "type": "function", "stateMutability": "view",
+        "inputs": [], "outputs": [{"name": "blockNumber", "type": "uint256"}]
+    }
+]
+BATCH_WINDOW = 0.005
+MAX_BATCH_CALLS = 100
+
+
+class BlockPin:
+    # All batched reads of one request see the chain at the same block; the first batch decides which
+    def __init__(self, block: int = None):
+        self.block = block
+
+
+current_block_pin = contextvars.ContextVar("current_block_pin", default=None)
+
+
+class MulticallError(Exception):
+    pass
+
+
+def _decode_result(function, data: bytes):
+    # Same decoding and normalization (checksummed addresses...) as ContractFunction.call()
+    output_types = get_abi_output_types(function.abi)
+    result = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, decode(output_types, data))
+    return result[0] if len(result) == 1 else result
+
+
+class MulticallBatcher:
+    def __init__(self):
+        self.multicall = get_web3().eth.contract(address=Web3.to_checksum_address(MULTICALL3_ADDRESS), abi=MULTICALL3_ABI)
+        self.pending = {}
+        self.scheduled = set()
+
+    async def call(self, function):
+        pin = current_block_pin.get()
+        future = asyncio.get_running_loop().create_future()
+        queue = self.pending.setdefault(id(pin), (pin, []))[1]
+        queue.append((function, future))
+        if len(queue) >= MAX_BATCH_CALLS:
+            self._flush(id(pin))
+        elif id(pin) not in self.scheduled:
+            self.scheduled.add(id(pin))
+            asyncio.get_running_loop().call_later(BATCH_WINDOW, self._flush, id(pin))
+        return await future
+
+    def _flush(self, key):
+        self.scheduled.discard(key)
+        pin, calls = self.pending.pop(key, (None, []))
+        if calls:
+            asyncio.create_task(self._execute(pin, calls))
+
+    async def _execute(self, pin: BlockPin, calls: list):
+        pinned = pin is not None and pin.block is not None
+        requests = [] if pinned or pin is None else [(self.multicall.address, False, self.multicall.encodeABI(fn_name="getBlockNumber"))]
+        requests += [(function.address, True, function._encode_transaction_data()) for function, _ in calls]
+        names = [function.fn_name for function, _ in calls]
+        try:
+            with span("web3.multicall", calls=len(calls), functions=",".join(sorted(set(names)))):
+                results = await call_contract(
+                    self.multicall.functions.aggregate3(requests),
+                    block_identifier=pin.block if pinned else "latest"
+                )
+        except Exception as e:
+            # Multicall3 unavailable or the batch failed as a whole: fall back to individual reads
+            print(f"⚠️ Multicall batch of {len(calls)} reads failed ({e}). Reading individually.")
+            record_cache("multicall", False)
+            await asyncio.gather(*(self._execute_single(pin, function, future) for function, future in calls))
+            return
+
+        record_cache("multicall", True)
+        multicallBatchSize.observe(len(calls))
+        for name in names:
+            batchedReads.inc(function=name)
+        if not pinned and pin is not None:
+            block = decode(["uint256"], results[0][1])[0]
+            if pin.block is None:
+                pin.block = block
+            results = results[1:]
+        for (function, future), (success, data) in zip(calls, results):
+            if future.done():
+                continue
+            if success:
+                try:
+                    future.set_result(_decode_result(function, data))
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                future.set_exception(MulticallError(f"{function.fn_name} reverted inside the multicall batch"))
+
+    async def _execute_single(self, pin: BlockPin, function, future):
+        try:
+            result = await call_contract(function, block_identifier=pin.block if pin is not None and pin.block is not None else "latest")
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+
+_lock = threading.Lock()
+_batchers = weakref.WeakKeyDictionary()
+
+def get_batcher() -> MulticallBatcher:
+    # Futures and timers belong to the running loop, so keep one batcher per loop
+    loop = asyncio.get_running_loop()
+    with _lock:
+        batcher = _batchers.get(loop)
+        if batcher is None:
+            batcher = MulticallBatcher()
+            _batchers[loop] = batcher
+    return batcher
+
+
+async def batched_call(function):
+    # Drop-in for call_contract() for view functions
+    return await get_batcher().call(function)
+
+
+@contextlib.contextmanager
+def pinned_block():
+    # Opens a block pin for the enclosed reads unless an outer request already holds one
+    if current_block_pin.get() is not None:
+        yield current_block_pin.get()
+        return
+    pin = BlockPin()
+    token = current_block_pin.set(pin)
+    try:
+        yield pin
+    finally:
+        current_block_pin.reset(token)
@@ -0,0 +1,44 @@
+import asyncio
+import threading
+import weakref
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+
+# Connection pool shared by every agent running on the same event loop
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 30.0
+REQUEST_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> AsyncOpenAI:
+    # httpx connections are bound to the loop that opened them, so keep one pooled client per loop
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(
+                timeout=REQUEST_TIMEOUT,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=MAX_CONNECTIONS,
+                        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=KEEPALIVE_EXPIRY
+                    )
+                )
+            )
+            _async_clients[loop] = client
+    return client
+
+
+class AsyncClientProxy:
+    # Module-level stand-in for the AsyncOpenAI client of the running loop
+    def __getattr__(self, name):
+        return getattr(get_async_client(), name)
+
+
+client = AsyncClientProxy()
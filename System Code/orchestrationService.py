@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import render_prometheus, write_snapshot
+from orchestrator import run_orchestration_agent
+from orchestrationSession import OrchestrationSession
+from consentMirror import start_consent_mirror
+from runtimeContext import prewarm
+
+
+# Headless entry point: local HTTP/JSON API and CLI batch mode over the same orchestration flow
+WORKER_COUNT = 4
+QUEUE_SIZE = 100
+# The API has no authentication: it only listens locally by default and only reads patient files from this directory
+DEFAULT_HOST = "127.0.0.1"
+UPLOAD_DIR = "uploads"
+# Sessions hold agent threads, the filtered record and their events: idle ones are dropped after SESSION_IDLE_TTL,
+# and the least recently used ones beyond MAX_SESSIONS. Sessions with queued or running requests are kept.
+SESSION_IDLE_TTL = 3600
+MAX_SESSIONS = 1000
+
+
+def resolve_upload_path(file_path: str, upload_dir: str = UPLOAD_DIR) -> str:
+    # Resolves a file_path from a request against the upload directory; anything outside it is rejected
+    root = os.path.realpath(upload_dir)
+    path = os.path.realpath(os.path.join(root, file_path))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise ValueError(f"file_path must name a file inside the upload directory {upload_dir}")
+    return path
+
+
+class OrchestrationService:
+    # Bounded pool of async workers serving orchestration requests; requests of one session run in order
+    def __init__(self, workers: int = WORKER_COUNT, queue_size: int = QUEUE_SIZE,
+                 session_ttl: float = SESSION_IDLE_TTL, max_sessions: int = MAX_SESSIONS):
+        self.worker_count = workers
+        self.queue_size = queue_size
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        # Least recently used first
+        self.sessions = OrderedDict()
+        self.session_locks = {}
+        self.session_used = {}
+        # Requests queued or running per session
+        self.active = {}
+        self.queue = None
+        self.workers = []
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    async def submit(self, user_input: str, session_id: str = None, file_path: str = None, on_event=None) -> dict:
+        session_id = session_id or uuid.uuid4().hex
+        result = asyncio.get_running_loop().create_future()
+        self.active[session_id] = self.active.get(session_id, 0) + 1
+        try:
+            await self.queue.put((user_input, session_id, file_path, on_event, result))
+            return await result
+        finally:
+            self.active[session_id] -= 1
+            if not self.active[session_id]:
+                del self.active[session_id]
+
+    def _session(self, session_id: str, file_path: str) -> OrchestrationSession:
+        now = time.monotonic()
+        if session_id not in self.sessions:
+            self.sessions[session_id] = OrchestrationSession()
+            self.session_locks[session_id] = asyncio.Lock()
+        self.sessions.move_to_end(session_id)
+        self.session_used[session_id] = now
+        if file_path:
+            self.sessions[session_id].file_path = file_path
+        session = self.sessions[session_id]
+        self._evict(now)
+        return session
+
+    def _evict(self, now: float):
+        for session_id in list(self.sessions):
+            # Ordered by last use, so the first session that may stay ends the scan
+            if len(self.sessions) <= self.max_sessions and now - self.session_used[session_id] <= self.session_ttl:
+                break
+            if self.active.get(session_id):
+                continue
+            del self.sessions[session_id]
+            del self.session_locks[session_id]
+            del self.session_used[session_id]
+
+    async def _worker(self):
+        while True:
+            user_input, session_id, file_path, on_event, result = await self.queue.get()
+            try:
+                response = await self._process(user_input, session_id, file_path, on_event)
+                if not result.done():
+                    result.set_result(response)
+            except Exception as e:
+                if not result.done():
+                    result.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def _process(self, user_input: str, session_id: str, file_path: str, on_event) -> dict:
+        session = self._session(session_id, file_path)
+        events = []
+        async with self.session_locks[session_id]:
+            unsubscribe = session.events.subscribe(events.append)
+            unsubscribeCallback = session.events.subscribe(on_event) if on_event else None
+            try:
+                response = await run_orchestration_agent(user_input, session)
+            finally:
+                unsubscribe()
+                if unsubscribeCallback:
+                    unsubscribeCallback()
+        return {"session_id": session_id, "response": response, "events": events}
+
+
+#################################################### HTTP API ################################################
+def make_handler(service: OrchestrationService, loop, upload_dir: str = UPLOAD_DIR):
+    class OrchestrationRequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: dict):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok", "queued": service.queue.qsize()})
+            elif self.path.startswith("/sessions/") and self.path.endswith("/transactions"):
+                session = service.sessions.get(self.path[len("/sessions/"):-len("/transactions")])
+                if session is None:
+                    self._send_json(404, {"error": "Unknown session"})
+                else:
+                    self._send_json(200, {"transactions": list(session.transactions.values())})
+            elif self.path == "/metrics":
+                payload = render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            else:
+                self._send_json(404, {"error": "Not found"})
+
+        def do_POST(self):
+            if self.path != "/requests":
+                self._send_json(404, {"error": "Not found"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                user_input = body["input"]
+            except (ValueError, KeyError):
+                self._send_json(400, {"error": "Expected a JSON body with an 'input' field"})
+                return
+            try:
+                file_path = resolve_upload_path(body["file_path"], upload_dir) if body.get("file_path") else None
+            except (ValueError, TypeError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            future = asyncio.run_coroutine_threadsafe(
+                service.submit(user_input, body.get("session_id"), file_path), loop
+            )
+            try:
+                self._send_json(200, future.result())
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            # Request bodies may contain patient details, so only the request line is logged
+            print(f"🌐 {self.address_string()} {format % args}")
+
+    return OrchestrationRequestHandler
+
+
+def serve(host: str = DEFAULT_HOST, port: int = 8080, workers: int = WORKER_COUNT, upload_dir: str = UPLOAD_DIR):
+    loop = asyncio.new_event_loop()
+    service = OrchestrationService(workers=workers)
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(service.start(), loop).result()
+    asyncio.run_coroutine_threadsafe(prewarm(), loop)
+    start_consent_mirror()
+
+    server = ThreadingHTTPServer((host, port), make_handler(service, loop, upload_dir))
+    print(f"🧠 Orchestration service listening on http://{host}:{port} with {workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        asyncio.run_coroutine_threadsafe(service.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+#################################################### Batch Mode ##############################################
+async def run_batch(input_path: str, output_path: str, workers: int):
+    # Each input line is a JSON object with "input" and optional "session_id" and "file_path"
+    with open(input_path, 'r', encoding='utf-8') as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+
+    service = OrchestrationService(workers=workers)
+    await service.start()
+    start_consent_mirror()
+
+    async def run_one(request: dict):
+        try:
+            return await service.submit(request["input"], request.get("session_id"), request.get("file_path"))
+        except Exception as e:
+            return {"session_id": request.get("session_id"), "error": str(e)}
+
+    try:
+        results = await asyncio.gather(*(run_one(request) for request in requests))
+    finally:
+        await service.stop()
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    write_snapshot()
+    print(f"✅ {len(results)} requests processed. Results saved to: {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless healthcare data sharing orchestration")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serveParser = subparsers.add_parser("serve", help="Run the local HTTP/JSON API")
+    serveParser.add_argument("--host", default=DEFAULT_HOST)
+    serveParser.add_argument("--port", type=int, default=8080)
+    serveParser.add_argument("--workers", type=int, default=WORKER_COUNT)
+    serveParser.add_argument("--upload-dir", default=UPLOAD_DIR, help="Directory patient files given as file_path are read from")
+
+    batchParser = subparsers.add_parser("batch", help="Process a JSONL file of requests")
+    batchParser.add_argument("input")
+    batchParser.add_argument("output")
+    batchParser.add_argument("--workers", type=int, default=WORKER_COUNT)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers, args.upload_dir)
+    else:
+        asyncio.run(run_batch(args.input, args.output, args.workers))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
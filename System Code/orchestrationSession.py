@@ -0,0 +1,30 @@
+from openaiClient import client
+from progressEvents import EventBus
+
+
+AGENT_THREADS = ["orchestrator", "regulation", "consent", "sharing"]
+
+
+class OrchestrationSession:
+    # Conversation state of one user: agent threads, the attached patient file and a progress event bus
+    def __init__(self, file_path: str = None, threads: dict = None):
+        self.file_path = file_path
+        # Latest output of the Data Filtering Agent, shared without being written to disk
+        self.filtered_data = None
+        self.patient_address = None
+        self.purpose = None
+        self.threads = dict(threads or {})
+        # Latest known status of every transaction sent for this session, keyed by its first hash
+        self.transactions = {}
+        self.events = EventBus()
+        self.events.subscribe(self._record_transaction)
+
+    def _record_transaction(self, event):
+        if event["type"] == "transaction_status":
+            self.transactions[event["tx_hash"]] = event
+
+    async def thread(self, agent: str) -> str:
+        # Threads are created on first use instead of at startup
+        if agent not in self.threads:
+            self.threads[agent] = (await client.beta.threads.create()).id
+        return self.threads[agent]
@@ -1,353 +1,355 @@
-import streamlit as st
 import asyncio
 import base64
-from openai import OpenAI
+import contextlib
+from openaiClient import client
 import os
 import re
-import json
 import time
-import requests
 from web3 import Web3
-from web3 import AsyncWeb3
-from web3.providers.async_rpc import AsyncHTTPProvider
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import padding as asym_padding
-import subprocess
+from runtimeContext import get_consent_contract, get_data_contract, start_prewarm
+from runExecutor import RunExecutor, dispatch_tool_calls
+from stagePlanner import ExecutionPlan, current_plan, resolved
+from multicall import BlockPin, batched_call, current_block_pin
+from regulationCache import get_regulation_cache, normalize_corridor
+from progressEvents import current_events, stage, step, agent_response
+from metrics import start_snapshot_writer
+from tracing import span
+from transactionManager import get_sender
+from userDirectory import get_user_directory
+from consentMirror import PATIENT_FUNCTIONS, current_read_blocks, get_consent_mirror, read_block, start_consent_mirror
+from consentDecisionCache import decision_key, get_consent_decision_cache
+from gasStrategy import refresh_fee_history, transaction_params, urgency_for_purpose
+from payloadCodec import CODEC_NAMES, CODEC_NONE, compress_chunks, default_codec, dictionary_id
+from payloadCrypto import encrypt_stream, generate_data_key, iter_chunks, iter_file_chunks, seal_for_receiver, unwrap_data_key, wrap_data_key
+from ipfsClient import LocalIPFSBackend, PinataBackend, upload_stream
+from blobStore import content_digest, get_blob_store
+from orchestrationSession import OrchestrationSession
+from regulatoryComplianceAgent import run_regulation_agent_shared, run_regulation_agent2, record_regulation_answer
+from consentVerificationAgent import evaluate_consent, record_consent_answer, run_consent_agent, run_consent_agent2
+from dataFilteringAgent import run_data_filtering_agent, run_data_filtering_agent2, run_data_filtering_agent3
 
 
 # Set up your API key
 os.environ["OPENAI_API_KEY"] = ""
 ORCHESTRATOR_ASSISTANT_ID = ""
 VSID = ""
-infuraUrl = ""
 ethSenderKey = "";
 ethSenderAddr = "";
 AESKey = ""
+# Compress records before encryption (zstd with the trained dictionary if available, zlib otherwise)
+compressPayloads = True
 pinata_secret_api_key = ""
 pinata_api_key = ""
 
-# Web3 setup
-web3 = AsyncWeb3(AsyncHTTPProvider(infuraUrl))
-assert web3.is_connected()
-
-# Smart contract ABIs & addresses
-consentSCAddr = "0x39daf39dc5999B19fc737AfF18B1513B477f4BFf";
-dataSCAddr = "0xb9cf17726836E7c067124F947255329c31D23429";
-consentSCAbi = []
-dataSCAbi = []
-
-if "consentSC" not in st.session_state:
-    st.session_state.consentSC = web3.eth.contract(address=Web3.to_checksum_address(consentSCAddr), abi=consentSCAbi)
-if "dataSC" not in st.session_state:
-    st.session_state.dataSC = web3.eth.contract(address=Web3.to_checksum_address(dataSCAddr), abi=dataSCAbi)
-consentSC = st.session_state.consentSC
-dataSC = st.session_state.dataSC
-
-client = OpenAI()
-
-# Create threads for all agents
-if "regThreadID" not in st.session_state:
-    st.session_state.regThreadID = client.beta.threads.create().id
-if "consentThreadID" not in st.session_state:
-    st.session_state.consentThreadID = client.beta.threads.create().id
-if "sharingThreadID" not in st.session_state:
-    st.session_state.sharingThreadID = client.beta.threads.create().id
-if "orchThreadID" not in st.session_state:
-    st.session_state.orchThreadID = client.beta.threads.create().id
-
-regThreadID = st.session_state.regThreadID
-consentThreadID = st.session_state.consentThreadID
-sharingThreadID = st.session_state.sharingThreadID
-orchThreadID = st.session_state.orchThreadID
-
-if "uploaded_file_name" in st.session_state:
-    file_path = st.session_state.uploaded_file_name
-
-output_path = "filtered_file.txt"
-
-def submitToolOutputs(output, threadId, runId, callID):
-    run = client.beta.threads.runs.submit_tool_outputs(
-        thread_id=threadId,
-        run_id=runId,
-        tool_outputs=[
-            {
-                "tool_call_id": callID,
-                "output": output
-            }
-        ]
-    )
-    return run
+# Use LocalIPFSBackend() to upload to a local IPFS node (or a stand-in) instead of Pinata
+ipfsBackend = PinataBackend(pinata_api_key, pinata_secret_api_key)
+
 
 
 ################################################## Orchestration Agent #######################################
-async def run_orchestration_agent(user_input: str):
+async def run_orchestration_agent(user_input: str, session: OrchestrationSession):
     print("🧠 Starting orchestration agent...")
     
-    start = time.time()
+    with span("orchestrator.run"):
+        orchThreadID = await session.thread("orchestrator")
 
-    # Step 1: Add user input as a message
-    client.beta.threads.messages.create(
-        thread_id=orchThreadID,
-        role="user",
-        content=user_input
-    )
-
-    # Step 2: Run the assistant
-    run = client.beta.threads.runs.create(
-        thread_id=orchThreadID,
-        assistant_id=ORCHESTRATOR_ASSISTANT_ID
-    )
+        # Step 1: Add user input as a message
+        await client.beta.threads.messages.create(
+            thread_id=orchThreadID,
+            role="user",
+            content=user_input
+        )
 
-    # Step 3: Poll for completion and get final message
-    while True:
-        run_status = client.beta.threads.runs.retrieve(
+        # Step 2: Run the assistant
+        run = await client.beta.threads.runs.create(
             thread_id=orchThreadID,
-            run_id=run.id
+            assistant_id=ORCHESTRATOR_ASSISTANT_ID
         )
-        if run_status.status == "completed":
-            # Retrieve assistant reply
-            messages = client.beta.threads.messages.list(thread_id=orchThreadID)
-            orchestratorResponse = messages.data[0].content[0].text.value  # Plain text response
-            print("\n📘 Final Orchestrator Agent Response:\n")
-            end = time.time()
-            print("Orchestrator Time = ", (end-start))
-            print(orchestratorResponse)
-            return (orchestratorResponse)
-        elif run_status.status in ["failed", "cancelled", "expired"]:
-            raise Exception(f"Assistant run failed with status: {run_status.status}")
-        elif (run_status.status == "requires_action" and run_status.required_action.type == "submit_tool_outputs"):
-            if (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "run_regulation_agent_tool"):
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run_status.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                regulations_query = f"I want the regulation requirements for sharing patient data from {arg['sender_country']} to a {arg['receiver_role']} in {arg['receiver_country']} for {arg['purpose']} purposes"
-                print("Query for regulations agent: " + regulations_query)
-                with st.status("📘 Calling Regulatory Compliance Agent to determine regulation requirements...", state="running", expanded=True) as status:
-                    st.markdown(
-                        '<span style="font-size:14px;">🔍 Retrieving regulations of sender and receiver countries...</span>',
-                        unsafe_allow_html=True
-                    )
-                    st.session_state.chat_history.append({
-                        "role": "status",
-                        "agent": "Regulation Agent",
-                        "label": "✓ 📘 Regulatory Compliance Agent analysis completed!",
-                        "details": (
-                            "🔍 Retrieving regulations of sender and receiver countries..."
-                        )
-                    })
-                    regStart = time.time()
-                    from regulatoryComplianceAgent import run_regulation_agent
-                    output = await run_regulation_agent(regulations_query, regThreadID)
-                    regEnd = time.time()
-                    print("Regulation Agent Response Time = ", (regEnd-regStart))
-                    submitToolOutputs(output, run.thread_id, run.id, callId)
-                    st.markdown(
-                        '<span style="font-size:14px;">✅ Regulatory Compliance Agent response received</span>',
-                        unsafe_allow_html=True
-                    )
-                    status.update(
-                        label="📘 Regulatory Compliance Agent analysis completed!", state="complete", expanded=False
-                    )
-                    for chat in st.session_state.chat_history:
-                        if chat["role"] == "status" and chat["agent"] == "Regulation Agent":
-                            chat["details"] += "\n ✅ Regulatory Compliance Agent response received"
-                            break
-                clean_output = re.sub(r'【\d+:\d+†.*?】', '', output)
-                st.session_state.chat_history.append({
-                    "role": "agent response",
-                    "agent": "Regulation Agent Response",
-                    "label": "📜 Regulatory Compliance Agent Response",
-                    "details": clean_output
-                })
-            elif (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "run_consent_agent_tool"):
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run_status.required_action.submit_tool_outputs.tool_calls[0].function.arguments)                
-                consent_query = (
-                    f"We want to share patient data.\n"
-                    f"The sender is in {arg['sender_country']}, and the receiver is a {arg['receiver_role']} "
-                    f"located in {arg['receiver_country']} with Ethereum address {arg['receiver_address']}.\n"
-                    f"The purpose of sharing is: {arg['purposes']}.\n"
-                    f"The patient's Ethereum address is {arg['patient_address']}.\n"
-                    f"According to the regulation, the consent requirement is: {arg['consent_requirements']}.\n\n"
-                    "Please check if valid consent exists and whether it satisfies this requirement and validate the receiver. If valid consent(s) exist, please return the full details of all the consent(s) that apply to this case."
-                )
-                print("Query for consent agent: "+ consent_query)
-                with st.status("🔐 Calling Consent Verification Agent to validate required consents...", state="running", expanded=True) as status:
-                    consentStart = time.time()
-                    from consentVerificationAgent import run_consent_agent
-                    output = await run_consent_agent(consent_query, consentThreadID)
-                    consentEnd = time.time()
-                    print("Consent Agent Response Time = ", (consentEnd-consentStart))
-                    submitToolOutputs(output, run.thread_id, run.id, callId)
-                    st.markdown(
-                        '<span style="font-size:14px;">✅ Consent Verification Agent response received</span>',
-                        unsafe_allow_html=True
-                    )
-                    status.update(
-                        label="🔐 Consent Verification Agent analysis completed!", state="complete", expanded=False
-                    )
-                    for chat in st.session_state.chat_history:
-                        if chat["role"] == "status" and chat["agent"] == "Consent Agent":
-                            chat["details"] += "\n ✅ Consent Verification Agent response received"
-                            break
-                st.session_state.chat_history.append({
-                    "role": "agent response",
-                    "agent": "Consent Agent Response",
-                    "label": "📜 Consent Verification Agent Response",
-                    "details": output
-                })
-            elif (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "run_data_filtering_tool"):
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run_status.required_action.submit_tool_outputs.tool_calls[0].function.arguments)                
-                redaction_query = (
-                    f"Please process the attached patient data file.\n\n"
-                    f"The following data types are allowed to be shared: {arg['allowed_data_types']}.\n"
-                )
-                if arg["anonymization_required"]:
-                    redaction_query += "Also, make sure the included data is properly anonymized before sharing, as anonymization is required in this case."
+
+        # Tool handlers share the session and the original user input for the explanation tools
+        handlers = {name: (lambda arg, handler=handler: handler(arg, session, user_input)) for name, handler in ORCHESTRATOR_TOOLS.items()}
+
+        # Speculative prerequisite stages of this request, reused by the later agents
+        plan = ExecutionPlan()
+        planToken = current_plan.set(plan)
+        eventsToken = current_events.set(session.events)
+        # Consent and registry reads of this request are batched and see the chain at one block
+        pinToken = current_block_pin.set(BlockPin())
+
+        # Step 3: Poll for completion and get final message
+        executor = RunExecutor(client, "Orchestrator Agent")
+        try:
+            while True:
+                run_status = await executor.wait(orchThreadID, run.id)
+                if run_status.status == "completed":
+                    # Retrieve assistant reply
+                    messages = await client.beta.threads.messages.list(thread_id=orchThreadID)
+                    orchestratorResponse = messages.data[0].content[0].text.value  # Plain text response
+                    print("\n📘 Final Orchestrator Agent Response:\n")
+                    executor.report()
+                    print(orchestratorResponse)
+                    return (orchestratorResponse)
+                elif run_status.status in ["failed", "cancelled", "expired", "incomplete"]:
+                    raise Exception(f"Assistant run failed with status: {run_status.status}")
+                elif (run_status.status == "requires_action" and run_status.required_action.type == "submit_tool_outputs"):
+                    # All tool calls of this step run concurrently and are submitted together
+                    await dispatch_tool_calls(client, run_status, handlers)
+        finally:
+            plan.cancel()
+            current_plan.reset(planToken)
+            current_events.reset(eventsToken)
+            current_block_pin.reset(pinToken)
+
+
+################################################## Stage Planning ############################################
+ADDRESS_PATTERN = re.compile(r'0x[a-fA-F0-9]{40}(?![a-fA-F0-9])')
+
+def schedule_consent_prerequisites(user_input: str, arg: dict):
+    # Receiver validation, key lookup, government lookups and consent reads do not depend on
+    # the regulation verdict, so they start while the Regulatory Compliance Agent is reasoning
+    plan = current_plan.get()
+    if plan is None:
+        return
+    addresses = {Web3.to_checksum_address(address) for address in ADDRESS_PATTERN.findall(user_input)}
+    directory = get_user_directory()
+    mirror = get_consent_mirror()
+    for address in addresses:
+        # Counterparties already in the directory cache need no prefetch
+        if not directory.cached("registered", address)[0]:
+            plan.add(("isUserRegistered", address), lambda address=address: batched_call(get_data_contract().functions.isUserRegistered(address)))
+        if not directory.cached("role", address)[0]:
+            plan.add(("getUserRole", address), lambda address=address: batched_call(get_data_contract().functions.getUserRole(address)))
+        if not directory.cached("public_key", address)[0]:
+            plan.add(("getUserPublicKey", address), lambda address=address: batched_call(get_data_contract().functions.getUserPublicKey(address)))
+        # The patient is not known yet, so every address is treated as a candidate; the consent mirror answers fresh ones locally
+        for function in PATIENT_FUNCTIONS:
+            if not mirror.is_fresh(function, address):
+                plan.add((function, address), lambda address=address, function=function: batched_call(getattr(get_consent_contract().functions, function)(address)))
+        for receiver in addresses - {address}:
+            if not mirror.is_fresh("getSpecificConsents", address, receiver):
+                plan.add(("getSpecificConsents", address, receiver), lambda address=address, receiver=receiver: batched_call(get_consent_contract().functions.getSpecificConsents(address, receiver)))
+    for country in {arg["sender_country"], arg["receiver_country"]}:
+        found, government = directory.cached("government", country)
+        if found:
+            plan.add(("getGovernmentAddress", country), lambda government=government: resolved(government))
+        else:
+            plan.add(("getGovernmentAddress", country), lambda country=country: batched_call(get_data_contract().functions.getGovernmentAddress(country)))
+        for receiver in addresses:
+            plan.add(
+                ("getGovernmentConsents", country, receiver),
+                lambda government, receiver=receiver: batched_call(get_consent_contract().functions.getGovernmentConsents(government, receiver)),
+                after=[("getGovernmentAddress", country)]
+            )
+
+def schedule_transaction_prerequisites():
+    # The nonce manager is synced and the fee history fetched while the file is being filtered
+    plan = current_plan.get()
+    if plan is None:
+        return
+    plan.add(("nonce_sync", ethSenderAddr), lambda: get_sender(ethSenderKey).nonces.prepare())
+    plan.add(("fee_history",), lambda: refresh_fee_history())
+
+
+async def handle_regulation_agent_tool(arg: dict, session: OrchestrationSession, user_input: str):
+    regulations_query = f"I want the regulation requirements for sharing patient data from {arg['sender_country']} to a {arg['receiver_role']} in {arg['receiver_country']} for {arg['purpose']} purposes"
+    print("Query for regulations agent: " + regulations_query)
+    schedule_consent_prerequisites(user_input, arg)
+    session.purpose = arg['purpose']
+    regThreadID = await session.thread("regulation")
+    with stage("Regulation Agent", "📘 Calling Regulatory Compliance Agent to determine regulation requirements...",
+               done_label="📘 Regulatory Compliance Agent analysis completed!",
+               history_label="✓ 📘 Regulatory Compliance Agent analysis completed!"):
+        step("Regulation Agent", "🔍 Retrieving regulations of sender and receiver countries...")
+        regulationCache = get_regulation_cache()
+        output = regulationCache.get(arg['sender_country'], arg['receiver_country'], arg['receiver_role'], arg['purpose'])
+        if output is not None:
+            step("Regulation Agent", "♻️ Reusing stored regulation requirements for this corridor...")
+            await record_regulation_answer(regulations_query, output, regThreadID)
+        else:
+            corridor = normalize_corridor(arg['sender_country'], arg['receiver_country'], arg['receiver_role'], arg['purpose'])
+            output, searchedWeb = await run_regulation_agent_shared(regulations_query, corridor, regThreadID)
+            # Only verdicts from the vector store are stored; web search results still wait for the user's approval
+            if not searchedWeb:
+                regulationCache.put(arg['sender_country'], arg['receiver_country'], arg['receiver_role'], arg['purpose'], output)
+        step("Regulation Agent", "✅ Regulatory Compliance Agent response received")
+    clean_output = re.sub(r'【\d+:\d+†.*?】', '', output)
+    agent_response("Regulation Agent Response", "📜 Regulatory Compliance Agent Response", clean_output)
+    return output
+
+async def handle_consent_agent_tool(arg: dict, session: OrchestrationSession, user_input: str):
+    consent_query = (
+        f"We want to share patient data.\n"
+        f"The sender is in {arg['sender_country']}, and the receiver is a {arg['receiver_role']} "
+        f"located in {arg['receiver_country']} with Ethereum address {arg['receiver_address']}.\n"
+        f"The purpose of sharing is: {arg['purposes']}.\n"
+        f"The patient's Ethereum address is {arg['patient_address']}.\n"
+        f"According to the regulation, the consent requirement is: {arg['consent_requirements']}.\n\n"
+        "Please check if valid consent exists and whether it satisfies this requirement and validate the receiver. If valid consent(s) exist, please return the full details of all the consent(s) that apply to this case."
+    )
+    print("Query for consent agent: "+ consent_query)
+    session.patient_address = arg['patient_address']
+    consentThreadID = await session.thread("consent")
+    with stage("Consent Agent", "🔐 Calling Consent Verification Agent to validate required consents...",
+               done_label="🔐 Consent Verification Agent analysis completed!",
+               history_label="✓ 🔐 Consent Verification Agent analysis completed!"):
+        decisions = get_consent_decision_cache()
+        key = decision_key(
+            arg['patient_address'], arg['receiver_address'], arg['purposes'], arg.get('data_types'), arg['consent_requirements'],
+            arg['receiver_role'], arg['receiver_country'], arg['sender_country']
+        )
+        output = decisions.get(key)
+        if output is not None:
+            step("Consent Agent", "♻️ Reusing the consent decision for this request...")
+            await record_consent_answer(consent_query, output, consentThreadID)
+        else:
+            # Tagged with the oldest block its consent rows were read at (pinned, prefetched or mirrored);
+            # any later event for these subjects drops the decision
+            checkpoint = get_consent_mirror().checkpoint()
+            started = time.monotonic()
+            readBlocks = []
+            readToken = current_read_blocks.set(readBlocks)
+            try:
+                step("Consent Agent", "🔍 Matching on-chain consents against the requirement...")
+                output = await evaluate_consent(arg)
+                if output is not None:
+                    await record_consent_answer(consent_query, output, consentThreadID)
                 else:
-                    redaction_query += "Date anonymization is not required."
-                print("Query for redaction agent: "+ redaction_query)
-                with st.status("📝 Calling Data Filtering Agent to process the patient file...", state="running", expanded=True) as status:
-                    filteringStart = time.time()
-                    from dataFilteringAgent import run_data_filtering_agent
-                    output = await run_data_filtering_agent(redaction_query, file_path, output_path, sharingThreadID)
-                    filteringEnd = time.time()
-                    print("Filtering Agent Response Time = ", (filteringEnd-filteringStart))
-                    submitToolOutputs(output, run.thread_id, run.id, callId)
-                    st.markdown(
-                        '<span style="font-size:14px;">✅ Filtering and anonymization completed!</span>',
-                        unsafe_allow_html=True
-                    )
-                    status.update(
-                        label="📝 Data Filtering Agent analysis completed!", state="complete", expanded=False
-                    )
-                    for chat in st.session_state.chat_history:
-                        if chat["role"] == "status" and chat["agent"] == "Data Filtering Agent":
-                            chat["details"] += "\n ✅ Filtering and anonymization completed!"
-                            break
-            elif (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "run_regulation_agent_tool_for_explanation"):
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                with st.spinner("📘 Calling the Regulatory Compliance Agent to clarify data sharing rules..."):
-                    regStart2 = time.time()
-                    from regulatoryComplianceAgent import run_regulation_agent2
-                    output = await run_regulation_agent2(user_input, regThreadID)
-                    regEnd2 = time.time()
-                    print("Regulation Agent Response Time for Questions = ", (regEnd2-regStart2))
-                    submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "run_consent_agent_tool_for_explanation"):
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                with st.spinner("🔐 Routing your question to the Consent Verification Agent for clarification..."):
-                    consentStart2 = time.time()
-                    from consentVerificationAgent import run_consent_agent2
-                    output = await run_consent_agent2(user_input, consentThreadID)
-                    consentEnd2 = time.time()
-                    print("Consent Agent Response Time for Questions = ", (consentEnd2-consentStart2))
-                    submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "run_data_filtering_tool_for_explanation"):
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                with st.spinner("📝 Routing your question to the Data Filtering Agent for clarification..."):
-                    filteringStart2 = time.time()
-                    from dataFilteringAgent import run_data_filtering_agent3
-                    output = await run_data_filtering_agent3(user_input, file_path, sharingThreadID)
-                    filteringEnd2 = time.time()
-                    print("Filtering Agent Response Time for Questions = ", (filteringEnd2-filteringStart2))
-                    submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "requestGovernmentConsent"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                with st.spinner("🌐 Requesting government consent..."):
-                    output = await requestGovernmentConsent(arg["receiver"], arg["country"], arg["dataTypes"], arg["purposes"])
-                    submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "requestPatientConsent"):
-                callId = run.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                with st.spinner("🌐 Requesting patient consent..."):
-                    output = await requestPatientConsent(arg["patient"], arg["receiver"], arg["dataTypes"], arg["purposes"])
-                    submitToolOutputs(output, run.thread_id, run.id, callId) 
-            elif (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "run_data_filtering_tool_for_extra_modifications"):
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run_status.required_action.submit_tool_outputs.tool_calls[0].function.arguments)                
-                redaction_query = (
-                    f"The user asked for the extra modifications as follows: {arg['user_request']}. Please re-filter the file again."
-                )
-                print("Query for redaction agent: "+ redaction_query)
-                with st.spinner("📝 Calling the Data Filtering Agent for further data modifications..."):
-                    from dataFilteringAgent import run_data_filtering_agent2
-                    output = await run_data_filtering_agent2(redaction_query, output_path, sharingThreadID)
-                    submitToolOutputs(output, run.thread_id, run.id, callId)
-            elif (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "data_sharing_tool"):
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run_status.required_action.submit_tool_outputs.tool_calls[0].function.arguments)                
-                with st.status("📨 Sharing patient data...", state="running", expanded=True) as status:
-                    sharingStart = time.time()
-                    output = await shareData(arg["receiver_address"], output_path)
-                    sharingEnd = time.time()
-                    print("Full sharing time = ", (sharingEnd-sharingStart))
-                    submitToolOutputs(output, run.thread_id, run.id, callId)
-                    status.update(
-                        label="📨 Data shared successfully via blockchain!", state="complete", expanded=False
-                    )
-            elif (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "upload_web_sources_to_database"):
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run_status.required_action.submit_tool_outputs.tool_calls[0].function.arguments)                
-                with st.spinner("🗃️ Adding retrieved regulations to the database..."):
-                    output = save_webpage_as_pdf(arg["urls"])
-                    submitToolOutputs(output, run.thread_id, run.id, callId)
-                if "Failed" not in output:
-                    text = "✅ Regulation files successfully uploaded to the vector store (ID: vs_685937bd583c819198aedb09b658b57f)"
-                    with st.expander("🗃️ Retrieved regulation files added to the database!", expanded=False):
-                        st.markdown(f'<div style="font-size:14px;">{text}</div>', unsafe_allow_html=True)
-                    st.session_state.chat_history.append({
-                        "role": "agent response",
-                        "agent": "Regulation Agent Response",
-                        "label": "✓ 🗃️ Retrieved regulation files added to the database!",
-                        "details": text
-                    })
-            elif (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "request_more_sources"):
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run_status.required_action.submit_tool_outputs.tool_calls[0].function.arguments)                
-                with st.spinner("🔍 Searching the web for additional regulatory sources..."):
-                    output = await run_web_search_tool2(arg["query"], arg["previous_urls"], arg["user_response"])
-                    submitToolOutputs(output, run.thread_id, run.id, callId)    
+                    # The request could not be mapped onto consent IDs, so the assistant interprets it
+                    output = await run_consent_agent(consent_query, consentThreadID)
+            finally:
+                current_read_blocks.reset(readToken)
+            government = await get_user_directory().government_address(arg['sender_country'])
+            decisions.put(key, output, read_block(readBlocks, checkpoint), [arg['patient_address'], government], started)
+        step("Consent Agent", "✅ Consent Verification Agent response received")
+    agent_response("Consent Agent Response", "📜 Consent Verification Agent Response", output)
+    return output
+
+async def handle_data_filtering_tool(arg: dict, session: OrchestrationSession, user_input: str):
+    redaction_query = (
+        f"Please process the attached patient data file.\n\n"
+        f"The following data types are allowed to be shared: {arg['allowed_data_types']}.\n"
+    )
+    if arg["anonymization_required"]:
+        redaction_query += "Also, make sure the included data is properly anonymized before sharing, as anonymization is required in this case."
+    else:
+        redaction_query += "Date anonymization is not required."
+    print("Query for redaction agent: "+ redaction_query)
+    schedule_transaction_prerequisites()
+    sharingThreadID = await session.thread("sharing")
+    with stage("Data Filtering Agent", "📝 Calling Data Filtering Agent to process the patient file...",
+               done_label="📝 Data Filtering Agent analysis completed!",
+               history_label="✓ 📝 Data Filtering Agent analysis completed!"):
+        session.filtered_data = await run_data_filtering_agent(redaction_query, session.file_path, sharingThreadID)
+        step("Data Filtering Agent", "✅ Filtering and anonymization completed!")
+    return "✅ Data Filtered Successfully"
+
+async def handle_regulation_explanation_tool(arg: dict, session: OrchestrationSession, user_input: str):
+    regThreadID = await session.thread("regulation")
+    with stage("Regulation Agent", "📘 Calling the Regulatory Compliance Agent to clarify data sharing rules...", kind="spinner"):
+        output = await run_regulation_agent2(user_input, regThreadID)
+    return output
+
+async def handle_consent_explanation_tool(arg: dict, session: OrchestrationSession, user_input: str):
+    consentThreadID = await session.thread("consent")
+    with stage("Consent Agent", "🔐 Routing your question to the Consent Verification Agent for clarification...", kind="spinner"):
+        output = await run_consent_agent2(user_input, consentThreadID)
+    return output
+
+async def handle_data_filtering_explanation_tool(arg: dict, session: OrchestrationSession, user_input: str):
+    sharingThreadID = await session.thread("sharing")
+    with stage("Data Filtering Agent", "📝 Routing your question to the Data Filtering Agent for clarification...", kind="spinner"):
+        output = await run_data_filtering_agent3(user_input, session.file_path, sharingThreadID)
+    return output
+
+async def handle_request_government_consent(arg: dict, session: OrchestrationSession, user_input: str):
+    with stage("Government Consent Request", "🌐 Requesting government consent...", kind="spinner"):
+        output = await requestGovernmentConsent(arg["receiver"], arg["country"], arg["dataTypes"], arg["purposes"])
+    return output
+
+async def handle_request_patient_consent(arg: dict, session: OrchestrationSession, user_input: str):
+    with stage("Patient Consent Request", "🌐 Requesting patient consent...", kind="spinner"):
+        output = await requestPatientConsent(arg["patient"], arg["receiver"], arg["dataTypes"], arg["purposes"])
+    return output
+
+async def handle_data_filtering_modifications_tool(arg: dict, session: OrchestrationSession, user_input: str):
+    redaction_query = (
+        f"The user asked for the extra modifications as follows: {arg['user_request']}. Please re-filter the file again."
+    )
+    print("Query for redaction agent: "+ redaction_query)
+    sharingThreadID = await session.thread("sharing")
+    with stage("Data Filtering Agent", "📝 Calling the Data Filtering Agent for further data modifications...", kind="spinner"):
+        session.filtered_data = await run_data_filtering_agent2(redaction_query, sharingThreadID)
+    return "✅ Data Filtered Again Successfully"
+
+async def handle_data_sharing_tool(arg: dict, session: OrchestrationSession, user_input: str):
+    with stage("Data Sharing", "📨 Sharing patient data...",
+               done_label="📨 Data shared successfully via blockchain!",
+               history_label="✓ 📨 Data shared successfully via blockchain!"):
+        if session.filtered_data is None:
+            raise Exception("No filtered patient data to share. Run the data filtering step first.")
+        receivers = arg.get("receiver_addresses") or arg["receiver_address"]
+        output = await shareData(receivers, session.filtered_data, session.patient_address, urgency_for_purpose(session.purpose))
+    return output
+
+async def handle_upload_web_sources(arg: dict, session: OrchestrationSession, user_input: str):
+    with stage("Regulation Sources", "🗃️ Adding retrieved regulations to the database...", kind="spinner"):
+        output = await save_webpage_as_pdf(arg["urls"])
+    if "Failed" not in output:
+        # Stored verdicts may be outdated by the new regulation sources
+        get_regulation_cache().invalidate()
+        text = "✅ Regulation files successfully uploaded to the vector store (ID: vs_685937bd583c819198aedb09b658b57f)"
+        agent_response("Regulation Agent Response", "✓ 🗃️ Retrieved regulation files added to the database!", text)
+    return output
+
+async def handle_request_more_sources(arg: dict, session: OrchestrationSession, user_input: str):
+    with stage("Regulation Sources", "🔍 Searching the web for additional regulatory sources...", kind="spinner"):
+        output = await run_web_search_tool2(arg["query"], arg["previous_urls"], arg["user_response"])
+    return output
+
+ORCHESTRATOR_TOOLS = {
+    "run_regulation_agent_tool": handle_regulation_agent_tool,
+    "run_consent_agent_tool": handle_consent_agent_tool,
+    "run_data_filtering_tool": handle_data_filtering_tool,
+    "run_regulation_agent_tool_for_explanation": handle_regulation_explanation_tool,
+    "run_consent_agent_tool_for_explanation": handle_consent_explanation_tool,
+    "run_data_filtering_tool_for_explanation": handle_data_filtering_explanation_tool,
+    "requestGovernmentConsent": handle_request_government_consent,
+    "requestPatientConsent": handle_request_patient_consent,
+    "run_data_filtering_tool_for_extra_modifications": handle_data_filtering_modifications_tool,
+    "data_sharing_tool": handle_data_sharing_tool,
+    "upload_web_sources_to_database": handle_upload_web_sources,
+    "request_more_sources": handle_request_more_sources,
+}
 
 
 async def requestGovernmentConsent(receiver: str, country: str, dataTypes: list, purposes: list):
-    government = await dataSC.functions.getGovernmentAddress(country).call()
-    tx = await consentSC.functions.requestGovernmentConsent(
+    government = await get_user_directory().government_address(country)
+    sender = get_sender(ethSenderKey)
+    function = get_consent_contract().functions.requestGovernmentConsent(
         Web3.to_checksum_address(government),
         Web3.to_checksum_address(receiver),
         dataTypes,
         purposes
-    ).build_transaction({
-        'from': Web3.to_checksum_address(ethSenderAddr),
-        'nonce': await web3.eth.get_transaction_count(Web3.to_checksum_address(web3.eth.account.from_key(ethSenderKey).address)),
-        'gas': 3000000,
-        'gasPrice': await web3.eth.gas_price
-    })
-    signed = web3.eth.account.sign_transaction(tx, ethSenderKey)
-    tx_hash = await web3.eth.send_raw_transaction(signed.rawTransaction)
+    )
+    params = await transaction_params(function, sender.address, urgency_for_purpose(purposes))
+    tx_hash = await sender.send(function, "requestGovernmentConsent", params)
+    get_consent_decision_cache().invalidate(government)
     print("📤 Consent request sent via blockchain.")
-    return ("📤 Consent request sent via blockchain. Transaction hash: " + tx_hash.hex())
+    return ("📤 Consent request sent via blockchain. Transaction hash: " + tx_hash)
 
 async def requestPatientConsent(patient: str, receiver: str, dataTypes: list, purposes: list):
-    tx = await consentSC.functions.requestPatientConsent(
+    sender = get_sender(ethSenderKey)
+    function = get_consent_contract().functions.requestPatientConsent(
         Web3.to_checksum_address(patient),
         Web3.to_checksum_address(receiver),
         dataTypes,
         purposes
-    ).build_transaction({
-        'from': Web3.to_checksum_address(ethSenderAddr),
-        'nonce': await web3.eth.get_transaction_count(Web3.to_checksum_address(web3.eth.account.from_key(ethSenderKey).address)),
-        'gas': 3000000,
-        'gasPrice': await web3.eth.gas_price
-    })
-    signed = web3.eth.account.sign_transaction(tx, ethSenderKey)
-    tx_hash = await web3.eth.send_raw_transaction(signed.rawTransaction)
+    )
+    params = await transaction_params(function, sender.address, urgency_for_purpose(purposes))
+    tx_hash = await sender.send(function, "requestPatientConsent", params)
+    get_consent_decision_cache().invalidate(patient)
     print("📤 Consent request sent via blockchain.")
-    return ("📤 Consent request sent via blockchain. Transaction hash: " + tx_hash.hex())
+    return ("📤 Consent request sent via blockchain. Transaction hash: " + tx_hash)
 
 async def run_web_search_tool2(query: str, original_urls: str, user_response: str):
 
@@ -380,7 +382,7 @@ You have to return URLs/links (starts with http....) of sources include the need
 3- https://...
 """
 
-    response2 = client.responses.create(
+    response2 = await client.responses.create(
         model="gpt-4o",
         tools=[{"type": "web_search_preview"}],
         tool_choice="required",
@@ -393,35 +395,37 @@ You have to return URLs/links (starts with http....) of sources include the need
 
     return "New URLs: " + response2.output_text
 
-def save_webpage_as_pdf(urls: str):
-    try:
-        result = subprocess.run(
-            ["python", "save_webpages_worker.py", urls],
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        print(result.stdout)
+async def save_webpage_as_pdf(urls: str):
+    # Run the worker without blocking the event loop
+    process = await asyncio.create_subprocess_exec(
+        "python", "save_webpages_worker.py", urls,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode == 0:
+        print(stdout.decode())
         return "✅ Files saved to database successfully."
-    except subprocess.CalledProcessError as e:
-        print(e.stderr)
+    else:
+        print(stderr.decode())
         return "❌ Failed to save PDFs."
 
-def upload_to_vector_store(filepath: str, vector_store_id: str):
+async def upload_to_vector_store(filepath: str, vector_store_id: str):
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"File not found: {filepath}")
 
     print(f"📁 Uploading file: {filepath}")
-    upload_response = client.files.create(
-        file=open(filepath, "rb"),
-        purpose="user_data"
-    )
+    with open(filepath, "rb") as f:
+        upload_response = await client.files.create(
+            file=f,
+            purpose="user_data"
+        )
 
     file_id = upload_response.id
     print(f"✅ File uploaded. File ID: {file_id}")
 
     print(f"📦 Attaching file to vector store: {vector_store_id}")
-    vs_response = client.vector_stores.files.create(
+    vs_response = await client.vector_stores.files.create(
         vector_store_id=vector_store_id,
         file_id=file_id
     )
@@ -431,134 +435,79 @@ def upload_to_vector_store(filepath: str, vector_store_id: str):
 
 
 ################################################## Sharing Data ##############################################
-async def shareData(receiver: str, output_path: str):
-    st.markdown(
-        '<span style="font-size:14px;">🔑 Getting receiver public key from blockchain...</span>',
-        unsafe_allow_html=True
-    )
-    st.session_state.chat_history.append({
-        "role": "status",
-        "agent": "Data Filtering Agent",
-        "label": "✓ 📨 Data shared successfully via blockchain!",
-        "details": (
-            "🔑 Getting receiver public key from blockchain...\n🔐 Encrypting patient file with receiver key...\n🌐 Uploading encrypted file to IPFS...\n⛓️ Writing transaction to blockchain..."
-        )
-    })
-    receiverKey = await getReceiverKey(receiver)
-    st.markdown(
-        '<span style="font-size:14px;">🔐 Encrypting patient file with receiver key...</span>',
-        unsafe_allow_html=True
-    )
-    encryptedData = encrypt_file_symmetric(output_path, base64.b64decode(AESKey))
-    st.markdown(
-        '<span style="font-size:14px;">🌐 Uploading encrypted file to IPFS...</span>',
-        unsafe_allow_html=True
-    )
-    CID = upload_text_to_ipfs(encryptedData, pinata_api_key, pinata_secret_api_key)
-    encryptedCID = encrypt_cid_with_rsa(receiverKey, CID)
-    st.markdown(
-        '<span style="font-size:14px;">⛓️ Writing transaction to blockchain...</span>',
-        unsafe_allow_html=True
-    )
-    hash = await shareDataSC(receiver, ("0x" + encryptedCID.hex()))
-    return hash
+async def shareData(receivers, data: str, patient: str = None, urgency: str = "standard"):
+    # Envelope encryption: the record is encrypted and uploaded once, then only its data key is sealed per receiver
+    receivers = [receivers] if isinstance(receivers, str) else list(receivers)
+    step("Data Sharing", "🔑 Getting receiver public key from blockchain...")
+    receiverKeys = await asyncio.gather(*(getReceiverKey(receiver) for receiver in receivers))
+    step("Data Sharing", "🔐 Encrypting patient file and uploading it to IPFS...")
+    CID, dataKey = await upload_encrypted_to_ipfs(data.encode('utf-8'), base64.b64decode(AESKey))
+    step("Data Sharing", "⛓️ Writing transaction to blockchain...")
+
+    async def share(receiver: str, receiverKey: bytes):
+        sealedKey = seal_key_for_receiver(receiverKey, dataKey, CID)
+        hash = await shareDataSC(receiver, ("0x" + sealedKey.hex()), urgency)
+        get_blob_store().record_share(CID, receiver, patient, hash)
+        return hash
+
+    # Nonces are assigned locally, so the per-receiver transactions are sent without waiting on each other
+    hashes = await asyncio.gather(*(share(receiver, receiverKey) for receiver, receiverKey in zip(receivers, receiverKeys)))
+    if len(hashes) == 1:
+        return hashes[0]
+    return "\n".join(f"{receiver}: {hash}" for receiver, hash in zip(receivers, hashes))
 
 async def getReceiverKey(address: str):
-    receiverKey = await dataSC.functions.getUserPublicKey(address).call() 
-    return receiverKey
+    # Parsed key object from the directory cache
+    return await get_user_directory().public_key(address)
 
-async def shareDataSC(receiver: str, data):
-    tx = await dataSC.functions.shareData(
+async def shareDataSC(receiver: str, data, urgency: str = "standard"):
+    sender = get_sender(ethSenderKey)
+    function = get_data_contract().functions.shareData(
         Web3.to_checksum_address(receiver),
         data
-    ).build_transaction({
-        'from': Web3.to_checksum_address(ethSenderAddr),
-        'nonce': await web3.eth.get_transaction_count(Web3.to_checksum_address(web3.eth.account.from_key(ethSenderKey).address)),
-        'gas': 3000000,
-        'gasPrice': await web3.eth.gas_price
-    })
-    signed = web3.eth.account.sign_transaction(tx, ethSenderKey)
-    tx_hash = await web3.eth.send_raw_transaction(signed.rawTransaction)
-    print("📤 Data is sent to receiver via blockchain. Transaction hash: " + tx_hash.hex())
-    return tx_hash.hex()
-
-def upload_file_to_ipfs(file_path: str, pinata_api_key: str, pinata_secret_api_key: str) -> str:
-    url = "https://api.pinata.cloud/pinning/pinFileToIPFS"
-    headers = {
-        "pinata_api_key": pinata_api_key,
-        "pinata_secret_api_key": pinata_secret_api_key,
-    }
-
-    with open(file_path, 'rb') as file:
-        files = {
-            'file': (file_path, file)
-        }
-        response = requests.post(url, files=files, headers=headers)
-
-    if response.status_code == 200:
-        cid = response.json()["IpfsHash"]
-        print(f"✅ File uploaded to IPFS via Pinata. CID: {cid}")
-        return cid
-    else:
-        raise Exception(f"❌ Pinata upload failed: {response.status_code} - {response.text}")
-    
-def upload_text_to_ipfs(encrypted_data: str, pinata_api_key: str, pinata_secret_api_key: str, name: str = "encrypted-data") -> str:
-    url = "https://api.pinata.cloud/pinning/pinJSONToIPFS"
-    headers = {
-        "Content-Type": "application/json",
-        "pinata_api_key": pinata_api_key,
-        "pinata_secret_api_key": pinata_secret_api_key,
-    }
-
-    payload = {
-        "pinataOptions": {"cidVersion": 1},
-        "pinataMetadata": {"name": name},
-        "pinataContent": {
-            "encrypted_data": base64.b64encode(encrypted_data).decode('utf-8')
-        }
-    }
-
-    response = requests.post(url, data=json.dumps(payload), headers=headers)
-
-    if response.status_code == 200:
-        cid = response.json()["IpfsHash"]
-        print(f"✅ Encrypted data uploaded to IPFS. CID: {cid}")
-        return cid
-    else:
-        raise Exception(f"❌ Failed to upload to IPFS: {response.status_code} - {response.text}")
-
-def encrypt_file_symmetric(input_file_path: str, key: bytes) -> bytes:
-    # Read plain text from file
-    with open(input_file_path, 'rb') as f:
-        plaintext = f.read()
-
-    # Pad plaintext to block size
-    padder = padding.PKCS7(128).padder()
-    padded_data = padder.update(plaintext) + padder.finalize()
-
-    # Generate random IV (initialization vector)
-    iv = os.urandom(16)
-
-    # Create AES cipher in CBC mode
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
-    ciphertext = encryptor.update(padded_data) + encryptor.finalize()
-
-    # Return base64-encoded ciphertext + IV
-    return base64.b64encode(iv + ciphertext)
-
-def encrypt_cid_with_rsa(public_key_der: bytes, cid: str):
-    # Load RSA public key from DER bytes
-    public_key = serialization.load_der_public_key(public_key_der)
-
-    # Encrypt CID
-    encrypted = public_key.encrypt(
-        cid.encode('utf-8'),
-        asym_padding.PKCS1v15()
     )
-
-    # Return base64-encoded ciphertext
-    return base64.b64encode(encrypted)
+    params = await transaction_params(function, sender.address, urgency)
+    tx_hash = await sender.send(function, "shareData", params)
+    print("📤 Data is sent to receiver via blockchain. Transaction hash: " + tx_hash)
+    return tx_hash
+
+async def upload_file_to_ipfs(file_path: str, name: str = None) -> str:
+    # Attachments are streamed from disk in fixed-size blocks
+    return await upload_stream(lambda: iter_file_chunks(file_path), ipfsBackend,
+                               name=name or os.path.basename(file_path), size=os.path.getsize(file_path))
+
+async def upload_encrypted_to_ipfs(plaintext: bytes, master_key: bytes, name: str = "encrypted-data") -> tuple:
+    # Identical records are encrypted, stored and pinned once; the locally computed CID decides whether to upload.
+    # Returns the CID and the record's data key.
+    store = get_blob_store()
+    digest = content_digest(plaintext, master_key)
+    found = store.lookup(digest)
+    if found is not None:
+        cid, wrappedKey = found
+        dataKey = unwrap_data_key(wrappedKey, master_key)
+    else:
+        dataKey = generate_data_key()
+        codec = default_codec() if compressPayloads else CODEC_NONE
+        with span("encrypt.payload", bytes=len(plaintext), codec=CODEC_NAMES[codec]) as encryption:
+            chunks = compress_chunks(iter_chunks(plaintext), codec)
+            cid, size = await asyncio.to_thread(store.put_stream, encrypt_stream(chunks, dataKey, codec=codec, dictionary_id=dictionary_id(codec)))
+            encryption.set(stored_bytes=size)
+        store.link(digest, cid, wrap_data_key(dataKey, master_key))
+    if store.is_pinned(cid):
+        step("Data Sharing", "♻️ This encrypted file is already on IPFS, skipping the upload...")
+        return cid, dataKey
+
+    path = store.path(cid)
+    pinnedCID = await upload_stream(lambda: iter_file_chunks(path), ipfsBackend, name=name, size=os.path.getsize(path))
+    if pinnedCID != cid:
+        print(f"⚠️ IPFS returned CID {pinnedCID}, expected {cid}. Indexing the pinned CID.")
+        store.rename(cid, pinnedCID)
+    store.mark_pinned(pinnedCID)
+    return pinnedCID, dataKey
+
+def seal_key_for_receiver(public_key, data_key: bytes, cid: str) -> bytes:
+    with span("encrypt.key_wrap"):
+        return seal_for_receiver(public_key, data_key, cid)
 
 
 
@@ -568,158 +517,237 @@ def get_base64_image(image_path):
     with open(image_path, "rb") as f:
         return base64.b64encode(f.read()).decode()
 
-# CSS for chay UI
-st.markdown("""
-    <style>
-    div[data-testid="stChatMessage"] {
-        margin-bottom: -12px !important;
-        margin-top: -12px !important;
-        background: transparent !important;
-    }
-
-    div[data-testid="stChatMessage"] .stMarkdown {
-        padding-bottom: -12px !important;
-        padding-top: -12px !important;
-        line-height: 1.3;
-        font-size: 25px !important;
-    }
-
-    .stChatAvatar {
-        width: 40px !important;
-        height: 40px !important;
-        margin-left: 0px;
-        margin-right: 6px;
-        background: transparent !important;
-        border: none !important;
-        box-shadow: none !important;
-    }
-
-    .title-box {
-        border: 2px solid #ccc;
-        border-radius: 12px;
-        padding: 8px 10px;
-        margin-bottom: 10px;
-        font-size: 26px;
-        font-weight: bold;
-        background-color: #f9f9f9;
-        text-align: center;
-        box-shadow: 2px 2px 8px rgba(0,0,0,0.05);
-    }
+class StreamlitProgress:
+    # Renders orchestration progress events with Streamlit and records them in the chat history
+    def __init__(self, st):
+        self.st = st
+        self.open_stages = {}
+        self.upload_bars = {}
+
+    def __call__(self, event):
+        st = self.st
+        if event["type"] == "stage_started":
+            if event["kind"] == "spinner":
+                container = contextlib.ExitStack()
+                container.enter_context(st.spinner(event["label"]))
+                self.open_stages[event["agent"]] = (container, None)
+            else:
+                entry = None
+                if event["history_label"]:
+                    entry = {"role": "status", "agent": event["agent"], "label": event["history_label"], "details": ""}
+                    st.session_state.chat_history.append(entry)
+                self.open_stages[event["agent"]] = (st.status(event["label"], state="running", expanded=True), entry)
+        elif event["type"] == "stage_step":
+            container, entry = self.open_stages.get(event["agent"], (None, None))
+            target = container if container is not None and not isinstance(container, contextlib.ExitStack) else st
+            target.markdown(
+                f'<span style="font-size:14px;">{event["message"]}</span>',
+                unsafe_allow_html=True
+            )
+            if entry is not None:
+                entry["details"] += ("\n " if entry["details"] else "") + event["message"]
+        elif event["type"] in ["stage_completed", "stage_failed"]:
+            container, entry = self.open_stages.pop(event["agent"], (None, None))
+            self.upload_bars.pop(event["agent"], None)
+            if isinstance(container, contextlib.ExitStack):
+                container.close()
+            elif container is not None:
+                state = "complete" if event["type"] == "stage_completed" else "error"
+                container.update(label=event["label"], state=state, expanded=False)
+        elif event["type"] == "upload_progress":
+            container, entry = self.open_stages.get(event["agent"], (None, None))
+            if container is not None and not isinstance(container, contextlib.ExitStack) and event["total"]:
+                if event["agent"] not in self.upload_bars:
+                    self.upload_bars[event["agent"]] = container.progress(0.0)
+                self.upload_bars[event["agent"]].progress(min(event["sent"] / event["total"], 1.0))
+        elif event["type"] == "agent_response":
+            st.session_state.chat_history.append({
+                "role": "agent response",
+                "agent": event["agent"],
+                "label": event["label"],
+                "details": event["details"]
+            })
+
+def main():
+    import streamlit as st
+
+    # Clients and contracts are created lazily; warm the node connection once per process
+    st.cache_resource(start_prewarm)()
+    st.cache_resource(start_snapshot_writer)()
+    st.cache_resource(start_consent_mirror)()
+
+    # CSS for chay UI
+    st.markdown("""
+        <style>
+        div[data-testid="stChatMessage"] {
+            margin-bottom: -12px !important;
+            margin-top: -12px !important;
+            background: transparent !important;
+        }
+
+        div[data-testid="stChatMessage"] .stMarkdown {
+            padding-bottom: -12px !important;
+            padding-top: -12px !important;
+            line-height: 1.3;
+            font-size: 25px !important;
+        }
+
+        .stChatAvatar {
+            width: 40px !important;
+            height: 40px !important;
+            margin-left: 0px;
+            margin-right: 6px;
+            background: transparent !important;
+            border: none !important;
+            box-shadow: none !important;
+        }
+
+        .title-box {
+            border: 2px solid #ccc;
+            border-radius: 12px;
+            padding: 8px 10px;
+            margin-bottom: 10px;
+            font-size: 26px;
+            font-weight: bold;
+            background-color: #f9f9f9;
+            text-align: center;
+            box-shadow: 2px 2px 8px rgba(0,0,0,0.05);
+        }
             
-    div[data-testid="stExpander"] summary {
-    	font-size: 24px !important;
-	}
-
-	/* Ensure children (p/span) inherit */
-	div[data-testid="stExpander"] summary * {
-    	font-size: 25px !important;
-	}
-    </style>
-""", unsafe_allow_html=True)
-
-# Title
-st.set_page_config(page_title="Healthcare Assistant", layout="wide")
-image_base64 = get_base64_image("bot.png")  # Replace with your real bot image path
-st.markdown(f"""
-    <div class="title-box">
-        <img src="data:image/png;base64,{image_base64}" width="28" style="vertical-align: middle; margin-right: 4px; margin-top: -4px;">
-        <strong>Healthcare Data Sharing Assistant</strong>
-    </div>
-""", unsafe_allow_html=True)
-
-# Initialize State
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
-
-if "file_uploaded" not in st.session_state:
-    st.session_state.file_uploaded = False
-if "uploaded_file_name" not in st.session_state:
-    st.session_state.uploaded_file_name = None
-
-# Display Chat Messages
-for chat in st.session_state.chat_history:
-    if chat["role"] == "user":
+        div[data-testid="stExpander"] summary {
+        	font-size: 24px !important;
+    	}
+
+    	/* Ensure children (p/span) inherit */
+    	div[data-testid="stExpander"] summary * {
+        	font-size: 25px !important;
+    	}
+        </style>
+    """, unsafe_allow_html=True)
+
+    # Title
+    st.set_page_config(page_title="Healthcare Assistant", layout="wide")
+    image_base64 = get_base64_image("bot.png")  # Replace with your real bot image path
+    st.markdown(f"""
+        <div class="title-box">
+            <img src="data:image/png;base64,{image_base64}" width="28" style="vertical-align: middle; margin-right: 4px; margin-top: -4px;">
+            <strong>Healthcare Data Sharing Assistant</strong>
+        </div>
+    """, unsafe_allow_html=True)
+
+    # Transactions are confirmed in the background; show their latest status on every rerun
+    transactions = st.session_state.orchestration.transactions if "orchestration" in st.session_state else {}
+    if transactions:
+        with st.sidebar:
+            st.markdown("**⛓️ Blockchain transactions**")
+            icons = {"pending": "⏳", "replaced": "⏳", "confirmed": "✅", "reverted": "❌", "dropped": "⚠️", "replaced_externally": "⚠️"}
+            for tx in list(transactions.values()):
+                st.markdown(f'{icons.get(tx["status"], "•")} {tx["label"]}: {tx["status"]}  \n`{tx["current_hash"]}`')
+    # Initialize State
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = []
+
+    if "file_uploaded" not in st.session_state:
+        st.session_state.file_uploaded = False
+    if "uploaded_file_name" not in st.session_state:
+        st.session_state.uploaded_file_name = None
+    if "orchestration" not in st.session_state:
+        st.session_state.orchestration = OrchestrationSession()
+
+    # Display Chat Messages
+    for chat in st.session_state.chat_history:
+        if chat["role"] == "user":
+            with st.chat_message("user", avatar="white.png"):
+                image_base64 = get_base64_image("user.png")
+                st.markdown(
+                    f"""
+                    <div style="display: flex; justify-content: flex-end; margin-bottom: 8px;">
+                        <div style="background-color: #d1e7dd; padding: 10px 14px; border-radius: 12px; font-size: 25px; max-width: 80%; text-align: left;">
+                            {chat["message"]}
+                        </div>
+                        <img src="data:image/png;base64,{image_base64}" width="36" height="36" style="margin-left: 8px; margin-top: 4px;">
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+        elif chat["role"] == "assistant":
+            with st.chat_message("assistant", avatar="bot.png"):
+                st.markdown(
+                    f"""
+                    <div style="display: flex; align-items: flex-start; margin-bottom: 8px;">
+                        <div style="background-color: #e2e3e5; padding: 10px 14px; border-radius: 12px; font-size: 25px;">
+                            {chat["message"]}
+                        </div>
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+        elif chat["role"] == "status":
+            with st.expander(chat["label"], expanded=False):
+                formatted_details = chat["details"].replace("\n", "<br>")
+                styled_details = f'<div style="font-size:22px;">{formatted_details}</div>'
+                st.markdown(styled_details, unsafe_allow_html=True)
+
+    # File Upload (Show Once) 
+    if not st.session_state.file_uploaded:
+        uploaded_file = st.file_uploader("", type=["pdf", "txt", "csv", "docx"])
+        if uploaded_file:
+            st.session_state.uploaded_file_name = uploaded_file.name
+            st.session_state.orchestration.file_path = uploaded_file.name
+            st.session_state.file_uploaded = True
+            st.session_state.file_pending_display = True
+
+    # Chat Input
+    user_input = st.chat_input("Describe your case or ask a question...")
+
+    # Send Message 
+    if user_input:
+        # Combine message with file info if uploaded
+        message = user_input
+        if st.session_state.get("file_pending_display", False):
+            message += f"\n\n \n\n🔗 Attached file: **{st.session_state.uploaded_file_name}**"
+            st.session_state.file_pending_display = False
+
+        # Add user message
+        st.session_state.chat_history.append({"role": "user", "message": message})
         with st.chat_message("user", avatar="white.png"):
             image_base64 = get_base64_image("user.png")
             st.markdown(
                 f"""
                 <div style="display: flex; justify-content: flex-end; margin-bottom: 8px;">
                     <div style="background-color: #d1e7dd; padding: 10px 14px; border-radius: 12px; font-size: 25px; max-width: 80%; text-align: left;">
-                        {chat["message"]}
+                        {message}
                     </div>
                     <img src="data:image/png;base64,{image_base64}" width="36" height="36" style="margin-left: 8px; margin-top: 4px;">
                 </div>
                 """,
                 unsafe_allow_html=True
             )
-    elif chat["role"] == "assistant":
+
+        # Simulate assistant
+        with st.spinner("🧠 Processing..."):
+            # The UI is one subscriber of the session's progress events
+            session = st.session_state.orchestration
+            unsubscribe = session.events.subscribe(StreamlitProgress(st))
+            try:
+                response = asyncio.run(run_orchestration_agent(user_input, session))
+            finally:
+                unsubscribe()
+
+        # Add assistant message
+        st.session_state.chat_history.append({"role": "assistant", "message": response})
         with st.chat_message("assistant", avatar="bot.png"):
             st.markdown(
                 f"""
                 <div style="display: flex; align-items: flex-start; margin-bottom: 8px;">
                     <div style="background-color: #e2e3e5; padding: 10px 14px; border-radius: 12px; font-size: 25px;">
-                        {chat["message"]}
+                        {response}
                     </div>
                 </div>
                 """,
                 unsafe_allow_html=True
             )
-    elif chat["role"] == "status":
-        with st.expander(chat["label"], expanded=False):
-            formatted_details = chat["details"].replace("\n", "<br>")
-            styled_details = f'<div style="font-size:22px;">{formatted_details}</div>'
-            st.markdown(styled_details, unsafe_allow_html=True)
-
-# File Upload (Show Once) 
-if not st.session_state.file_uploaded:
-    uploaded_file = st.file_uploader("", type=["pdf", "txt", "csv", "docx"])
-    if uploaded_file:
-        st.session_state.uploaded_file_name = uploaded_file.name
-        file_path = st.session_state.uploaded_file_name
-        st.session_state.file_uploaded = True
-        st.session_state.file_pending_display = True
-
-# Chat Input
-user_input = st.chat_input("Describe your case or ask a question...")
-
-# Send Message 
-if user_input:
-    # Combine message with file info if uploaded
-    message = user_input
-    if st.session_state.get("file_pending_display", False):
-        message += f"\n\n \n\n🔗 Attached file: **{st.session_state.uploaded_file_name}**"
-        st.session_state.file_pending_display = False
-
-    # Add user message
-    st.session_state.chat_history.append({"role": "user", "message": message})
-    with st.chat_message("user", avatar="white.png"):
-        image_base64 = get_base64_image("user.png")
-        st.markdown(
-            f"""
-            <div style="display: flex; justify-content: flex-end; margin-bottom: 8px;">
-                <div style="background-color: #d1e7dd; padding: 10px 14px; border-radius: 12px; font-size: 25px; max-width: 80%; text-align: left;">
-                    {message}
-                </div>
-                <img src="data:image/png;base64,{image_base64}" width="36" height="36" style="margin-left: 8px; margin-top: 4px;">
-            </div>
-            """,
-            unsafe_allow_html=True
-        )
 
-    # Simulate assistant
-    with st.spinner("🧠 Processing..."):
-        response = asyncio.run(run_orchestration_agent(user_input))
-
-    # Add assistant message
-    st.session_state.chat_history.append({"role": "assistant", "message": response})
-    with st.chat_message("assistant", avatar="bot.png"):
-        st.markdown(
-            f"""
-            <div style="display: flex; align-items: flex-start; margin-bottom: 8px;">
-                <div style="background-color: #e2e3e5; padding: 10px 14px; border-radius: 12px; font-size: 25px;">
-                    {response}
-                </div>
-            </div>
-            """,
-            unsafe_allow_html=True
-        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import argparse
+import os
+import re
+import sys
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Optional compression of records before encryption; the codec id is written into the payload header
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_NAMES = {CODEC_NONE: "none", CODEC_ZLIB: "zlib", CODEC_ZSTD: "zstd"}
+
+# Dictionary trained on synthetic or de-identified records (see `train_dictionary` below); receivers need the same
+# file to decode zstd payloads. A dictionary holds verbatim substrings of its samples, so it must never be trained on
+# real patient records. Payload headers carry its id (see dictionary_id) so a mismatch is reported instead of decoded.
+ZSTD_DICTIONARY_PATH = "records.zdict"
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 9
+DICTIONARY_SIZE = 112640
+OUTPUT_CHUNK_SIZE = 64 * 1024
+# Identifiers masked in training samples in case one slipped in: e-mail and Ethereum addresses, digit runs (dates,
+# phone numbers, record numbers...)
+SAMPLE_IDENTIFIERS = re.compile(rb"[\w.+-]+@[\w-]+(\.[\w-]+)+|0x[0-9a-fA-F]{40}|\d+")
+
+_lock = threading.Lock()
+_dictionary = None
+_dictionary_loaded = False
+
+
+class CodecError(Exception):
+    pass
+
+
+def get_dictionary():
+    global _dictionary, _dictionary_loaded
+    with _lock:
+        if not _dictionary_loaded:
+            _dictionary_loaded = True
+            if zstandard is not None and os.path.exists(ZSTD_DICTIONARY_PATH):
+                with open(ZSTD_DICTIONARY_PATH, 'rb') as f:
+                    _dictionary = zstandard.ZstdCompressionDict(f.read())
+    return _dictionary
+
+
+def dictionary_id(codec: int) -> int:
+    # Id of the dictionary compress_chunks uses for codec, 0 when there is none
+    dictionary = get_dictionary() if codec == CODEC_ZSTD else None
+    return dictionary.dict_id() if dictionary is not None else 0
+
+
+def check_dictionary(codec: int, payload_dictionary_id: int = None):
+    # Local dictionary needed to decode a payload; payload_dictionary_id None means a header without one (version 2),
+    # which is decoded with the local dictionary as before
+    if codec != CODEC_ZSTD:
+        return None
+    if zstandard is None:
+        raise CodecError("This payload is zstd-compressed; install the zstandard package to decode it")
+    dictionary = get_dictionary()
+    if payload_dictionary_id is None:
+        return dictionary
+    localId = dictionary.dict_id() if dictionary is not None else 0
+    if localId != payload_dictionary_id:
+        raise CodecError(
+            f"This payload was compressed with zstd dictionary {payload_dictionary_id or 'none'}, "
+            f"but {ZSTD_DICTIONARY_PATH} " + (f"has id {localId}" if dictionary is not None else "is missing")
+        )
+    return dictionary
+
+
+def default_codec() -> int:
+    # zstd when the package is installed, otherwise zlib from the standard library
+    return CODEC_ZSTD if zstandard is not None else CODEC_ZLIB
+
+
+def _rechunk(pieces, size: int):
+    # Compressors emit irregular pieces; encryption frames expect blocks of at most `size` bytes
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _compress_pieces(chunks, codec: int):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise CodecError("zstd compression requires the zstandard package")
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=get_dictionary()).compressobj()
+    else:
+        compressor = zlib.compressobj(ZLIB_LEVEL)
+    for chunk in chunks:
+        yield compressor.compress(bytes(chunk))
+    yield compressor.flush()
+
+
+def compress_chunks(chunks, codec: int, chunk_size: int = OUTPUT_CHUNK_SIZE):
+    if codec == CODEC_NONE:
+        return chunks
+    return _rechunk(_compress_pieces(chunks, codec), chunk_size)
+
+
+def decompress_chunks(chunks, codec: int, payload_dictionary_id: int = None):
+    if codec == CODEC_NONE:
+        yield from chunks
+        return
+    if codec == CODEC_ZSTD:
+        decompressor = zstandard.ZstdDecompressor(dict_data=check_dictionary(codec, payload_dictionary_id)).decompressobj()
+    elif codec == CODEC_ZLIB:
+        decompressor = zlib.decompressobj()
+    else:
+        raise CodecError(f"Unknown payload codec: {codec}")
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    if codec == CODEC_ZLIB:
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+def scrub_sample(data: bytes) -> bytes:
+    return SAMPLE_IDENTIFIERS.sub(b"#", data)
+
+
+def train_dictionary(sample_paths: list, output_path: str = ZSTD_DICTIONARY_PATH, size: int = DICTIONARY_SIZE):
+    # sample_paths must be synthetic or de-identified records with the layout of filtered records: the dictionary is
+    # shipped to every receiver. Identifiers are masked on top of that.
+    if zstandard is None:
+        raise CodecError("Training a dictionary requires the zstandard package")
+    samples = []
+    for path in sample_paths:
+        with open(path, 'rb') as f:
+            samples.append(scrub_sample(f.read()))
+    dictionary = zstandard.train_dictionary(size, samples)
+    with open(output_path, 'wb') as f:
+        f.write(dictionary.as_bytes())
+    print(f"✅ Trained dictionary {dictionary.dict_id()} ({len(dictionary.as_bytes())} bytes) on {len(samples)} records. Saved to: {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the zstd dictionary used to compress shared records")
+    parser.add_argument("samples", nargs="+", help="Synthetic or de-identified record files (never real patient records)")
+    parser.add_argument("--output", default=ZSTD_DICTIONARY_PATH)
+    parser.add_argument("--size", type=int, default=DICTIONARY_SIZE)
+    args = parser.parse_args()
+    train_dictionary(args.samples, args.output, args.size)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import os
+import struct
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding as asym_padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from payloadCodec import CODEC_NONE, CodecError, check_dictionary, decompress_chunks
+
+
+# Chunked AES-GCM payload format shared with receivers:
+#   header: MAGIC (4) | version (1) | codec (1) | dictionary id (4) | chunk size (4) | nonce prefix (7)
+#   frames: final flag (top bit) + ciphertext length (4) | ciphertext + 16-byte tag, repeated
+# Chunk nonces are nonce prefix | chunk counter (4) | final flag (1) and the header is the associated data,
+# so reordered, truncated or extended payloads fail authentication. The codec (payloadCodec) applies to the
+# concatenated plaintext of all frames; the dictionary id names the zstd dictionary it used (0: none).
+# Version 1 headers had no codec byte and version 2 headers no dictionary id; both are still readable.
+MAGIC = b"HDSP"
+VERSION = 3
+CHUNK_SIZE = 64 * 1024
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+FINAL_FRAME = 0x80000000
+
+# Envelope encryption: each record is encrypted once under its own random data key.
+# Locally the data key is kept wrapped with the sender's master key; each receiver gets it RSA-OAEP sealed
+# together with the CID (version (1) | data key (32) | CID), which fits a single 2048-bit RSA block.
+DATA_KEY_SIZE = 32
+ENVELOPE_VERSION = 1
+KEY_WRAP_NONCE_SIZE = 12
+KEY_WRAP_CONTEXT = b"HDSP data key"
+
+_PREFIX = struct.Struct(">4sB")
+_HEADER = struct.Struct(">4sBBII7s")
+_HEADER_V2 = struct.Struct(">4sBBI7s")
+_HEADER_V1 = struct.Struct(">4sBI7s")
+_FRAME = struct.Struct(">I")
+
+
+class PayloadError(Exception):
+    pass
+
+
+def iter_chunks(data: bytes, chunk_size: int = CHUNK_SIZE):
+    # Slices of an in-memory payload without copying it
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset:offset + chunk_size]
+
+
+def iter_file_chunks(file_path: str, chunk_size: int = CHUNK_SIZE):
+    # Large attachments are read block by block instead of all at once
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _nonce(prefix: bytes, counter: int, final: bool) -> bytes:
+    return prefix + struct.pack(">IB", counter, 1 if final else 0)
+
+
+def encrypt_stream(chunks, key: bytes, chunk_size: int = CHUNK_SIZE, codec: int = CODEC_NONE, dictionary_id: int = 0):
+    # Yields the header and then one encrypted frame per input chunk; only one chunk is held at a time.
+    # codec and dictionary_id only label the payload: chunks must already be compressed with them.
+    aesgcm = AESGCM(key)
+    prefix = os.urandom(NONCE_PREFIX_SIZE)
+    header = _HEADER.pack(MAGIC, VERSION, codec, dictionary_id, chunk_size, prefix)
+    yield header
+
+    counter = 0
+    chunks = iter(chunks)
+    current = next(chunks, b"")
+    while True:
+        following = next(chunks, None)
+        final = following is None
+        ciphertext = aesgcm.encrypt(_nonce(prefix, counter, final), bytes(current), header)
+        yield _FRAME.pack(len(ciphertext) | (FINAL_FRAME if final else 0)) + ciphertext
+        if final:
+            return
+        current = following
+        counter += 1
+
+
+def _read_exact(read, size: int) -> bytes:
+    data = read(size)
+    if len(data) != size:
+        raise PayloadError("Encrypted payload is truncated")
+    return data
+
+
+def decrypt_stream(read, key: bytes):
+    # read is a file-like read(size) callable; yields the decoded plaintext chunk by chunk
+    start = _read_exact(read, _PREFIX.size)
+    magic, version = _PREFIX.unpack(start)
+    if magic != MAGIC or version not in [1, 2, VERSION]:
+        raise PayloadError("Unsupported encrypted payload format")
+    dictionary_id = None
+    if version == 1:
+        header = start + _read_exact(read, _HEADER_V1.size - _PREFIX.size)
+        _, _, chunk_size, prefix = _HEADER_V1.unpack(header)
+        codec = CODEC_NONE
+    elif version == 2:
+        header = start + _read_exact(read, _HEADER_V2.size - _PREFIX.size)
+        _, _, codec, chunk_size, prefix = _HEADER_V2.unpack(header)
+    else:
+        header = start + _read_exact(read, _HEADER.size - _PREFIX.size)
+        _, _, codec, dictionary_id, chunk_size, prefix = _HEADER.unpack(header)
+    # A receiver without the payload's dictionary is told so before anything is decrypted
+    try:
+        check_dictionary(codec, dictionary_id)
+    except CodecError as e:
+        raise PayloadError(str(e)) from None
+    return decompress_chunks(_decrypt_frames(read, key, header, chunk_size, prefix), codec, dictionary_id)
+
+
+def _decrypt_frames(read, key: bytes, header: bytes, chunk_size: int, prefix: bytes):
+    aesgcm = AESGCM(key)
+    counter = 0
+    while True:
+        frame = _FRAME.unpack(_read_exact(read, _FRAME.size))[0]
+        final = bool(frame & FINAL_FRAME)
+        length = frame & ~FINAL_FRAME
+        if length > chunk_size + TAG_SIZE:
+            raise PayloadError("Encrypted payload frame is too large")
+        ciphertext = _read_exact(read, length)
+        try:
+            plaintext = aesgcm.decrypt(_nonce(prefix, counter, final), ciphertext, header)
+        except Exception:
+            raise PayloadError("Encrypted payload failed authentication") from None
+        yield plaintext
+        if final:
+            if read(1):
+                raise PayloadError("Unexpected data after the final payload frame")
+            return
+        counter += 1
+
+
+def generate_data_key() -> bytes:
+    return AESGCM.generate_key(bit_length=DATA_KEY_SIZE * 8)
+
+
+def wrap_data_key(data_key: bytes, master_key: bytes) -> bytes:
+    nonce = os.urandom(KEY_WRAP_NONCE_SIZE)
+    return nonce + AESGCM(master_key).encrypt(nonce, data_key, KEY_WRAP_CONTEXT)
+
+
+def unwrap_data_key(wrapped: bytes, master_key: bytes) -> bytes:
+    try:
+        return AESGCM(master_key).decrypt(wrapped[:KEY_WRAP_NONCE_SIZE], wrapped[KEY_WRAP_NONCE_SIZE:], KEY_WRAP_CONTEXT)
+    except Exception:
+        raise PayloadError("Stored data key could not be unwrapped with this master key") from None
+
+
+def _oaep():
+    return asym_padding.OAEP(mgf=asym_padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+
+
+def load_public_key(public_key_der: bytes):
+    return serialization.load_der_public_key(public_key_der)
+
+
+def seal_for_receiver(public_key, data_key: bytes, cid: str) -> bytes:
+    # public_key is a loaded key object (see load_public_key) or DER bytes
+    if isinstance(public_key, (bytes, bytearray)):
+        public_key = load_public_key(bytes(public_key))
+    return public_key.encrypt(bytes([ENVELOPE_VERSION]) + data_key + cid.encode('utf-8'), _oaep())
+
+
+def open_envelope(private_key, sealed: bytes) -> tuple:
+    # Receiver side: returns (data key, CID) from the value stored on-chain
+    envelope = private_key.decrypt(sealed, _oaep())
+    if envelope[0] != ENVELOPE_VERSION:
+        raise PayloadError("Unsupported key envelope version")
+    return envelope[1:1 + DATA_KEY_SIZE], envelope[1 + DATA_KEY_SIZE:].decode('utf-8')
@@ -0,0 +1,53 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from tracing import span
+
+
+# Event bus of the orchestration request currently being served (inherited by tool-call tasks)
+current_events = contextvars.ContextVar("current_events", default=None)
+
+
+class EventBus:
+    # Progress events of one session; the Streamlit UI and the headless service are just subscribers
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+        return lambda: self.subscribers.remove(callback)
+
+    def emit(self, event_type: str, **data):
+        event = {"type": event_type, "time": time.time(), **data}
+        for callback in list(self.subscribers):
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"⚠️ Progress subscriber failed on {event_type}: {e}")
+
+
+def emit(event_type: str, **data):
+    bus = current_events.get()
+    if bus is not None:
+        bus.emit(event_type, **data)
+
+
+@contextmanager
+def stage(agent: str, label: str, done_label: str = None, history_label: str = None, kind: str = "status"):
+    # kind is "status" for the expandable agent boxes and "spinner" for short tool calls
+    emit("stage_started", agent=agent, label=label, history_label=history_label, kind=kind)
+    try:
+        with span("stage", agent=agent, kind=kind):
+            yield
+    except Exception as e:
+        emit("stage_failed", agent=agent, label=label, error=str(e))
+        raise
+    emit("stage_completed", agent=agent, label=done_label or label)
+
+
+def step(agent: str, message: str):
+    emit("stage_step", agent=agent, message=message)
+
+
+def agent_response(agent: str, label: str, details: str):
+    emit("agent_response", agent=agent, label=label, details=details)
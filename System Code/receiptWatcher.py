@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+from web3.exceptions import TransactionNotFound
+from metrics import transactionsConfirmed, transactionsFailed
+from runtimeContext import get_web3
+
+
+# Background confirmation of sent transactions; requests return right after sending and learn the outcome as events
+RECEIPT_BATCH_SIZE = 20
+MIN_POLL_DELAY = 2.0
+MAX_POLL_DELAY = 15.0
+POLL_BACKOFF_FACTOR = 1.5
+# Pending longer than this (per attempt) gets a replace-by-fee with the same nonce
+STUCK_AFTER = 180
+MAX_REPLACEMENTS = 2
+# A transaction the node no longer knows about is reported dropped after this grace period
+DROP_GRACE = 60
+
+
+class ReceiptWatcher:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def watch(self, sender, nonce: int, tx_hash: str, label: str, bus=None):
+        # bus is the session's event bus; status changes are emitted on it as transaction_status events
+        entry = {
+            "sender": sender, "nonce": nonce, "label": label, "bus": bus,
+            "original_hash": tx_hash, "hashes": [tx_hash], "submitted_at": time.time(), "replacements": 0
+        }
+        with self.lock:
+            self.pending[tx_hash] = entry
+            if self.thread is None or not self.thread.is_alive():
+                # Own thread and loop, so watching outlives the request (and the Streamlit run) that sent the tx
+                self.thread = threading.Thread(target=lambda: asyncio.run(self._loop()), daemon=True)
+                self.thread.start()
+        self._publish(entry, "pending")
+        self.wakeup.set()
+
+    def _publish(self, entry: dict, status: str, **details):
+        if entry["bus"] is not None:
+            entry["bus"].emit(
+                "transaction_status", tx_hash=entry["original_hash"], current_hash=entry["hashes"][-1],
+                label=entry["label"], nonce=entry["nonce"], status=status, **details
+            )
+
+    def _finish(self, entry: dict, status: str, **details):
+        with self.lock:
+            self.pending.pop(entry["hashes"][-1], None)
+        entry["sender"].settled(entry["nonce"])
+        if status == "confirmed":
+            transactionsConfirmed.inc(function=entry["label"])
+        else:
+            transactionsFailed.inc(function=entry["label"], status=status)
+        self._publish(entry, status, **details)
+        print(f"⛓️ {entry['label']} transaction {entry['hashes'][-1]}: {status}")
+
+    async def _loop(self):
+        delay = MIN_POLL_DELAY
+        while True:
+            await asyncio.to_thread(self.wakeup.wait, delay)
+            woken = self.wakeup.is_set()
+            self.wakeup.clear()
+            with self.lock:
+                entries = list(self.pending.values())
+            if not entries:
+                delay = MAX_POLL_DELAY
+                continue
+            try:
+                changed = await self._check(entries)
+            except Exception as e:
+                print(f"⚠️ Receipt check failed: {e}")
+                changed = False
+            # Poll quickly while things are happening, back off while the chain is quiet
+            delay = MIN_POLL_DELAY if changed or woken else min(delay * POLL_BACKOFF_FACTOR, MAX_POLL_DELAY)
+
+    async def _receipt(self, tx_hash: str):
+        try:
+            return await get_web3().eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            return None
+
+    async def _check(self, entries: list) -> bool:
+        changed = False
+        unmined = []
+        for start in range(0, len(entries), RECEIPT_BATCH_SIZE):
+            batch = entries[start:start + RECEIPT_BATCH_SIZE]
+            receipts = await asyncio.gather(*(self._receipt(entry["hashes"][-1]) for entry in batch), return_exceptions=True)
+            for entry, receipt in zip(batch, receipts):
+                if receipt is None or isinstance(receipt, Exception):
+                    unmined.append(entry)
+                else:
+                    self._settle(entry, receipt)
+                    changed = True
+
+        minedNonces = {}
+        for entry in unmined:
+            address = entry["sender"].address
+            if address not in minedNonces:
+                minedNonces[address] = await get_web3().eth.get_transaction_count(address, "latest")
+            changed = await self._check_unmined(entry, minedNonces[address]) or changed
+        return changed
+
+    def _settle(self, entry: dict, receipt):
+        status = "confirmed" if receipt["status"] == 1 else "reverted"
+        self._finish(entry, status, block=receipt["blockNumber"], gas_used=receipt["gasUsed"])
+
+    async def _check_unmined(self, entry: dict, mined_nonce: int) -> bool:
+        if mined_nonce > entry["nonce"]:
+            # The nonce is used up: either one of our attempts was mined or another transaction replaced it.
+            # The current hash is checked again too, since it may have been mined after its receipt was polled.
+            for tx_hash in entry["hashes"]:
+                receipt = await self._receipt(tx_hash)
+                if receipt is not None:
+                    self._settle(entry, receipt)
+                    return True
+            self._finish(entry, "replaced_externally")
+            return True
+
+        age = time.time() - entry["submitted_at"]
+        if age > STUCK_AFTER * (entry["replacements"] + 1) and entry["replacements"] < MAX_REPLACEMENTS:
+            try:
+                tx_hash = await entry["sender"].replace(entry["nonce"])
+            except Exception as e:
+                print(f"⚠️ Could not replace stuck transaction {entry['hashes'][-1]}: {e}")
+                return False
+            with self.lock:
+                self.pending.pop(entry["hashes"][-1], None)
+                entry["hashes"].append(tx_hash)
+                entry["replacements"] += 1
+                self.pending[tx_hash] = entry
+            self._publish(entry, "replaced", replacement_hash=tx_hash)
+            return True
+
+        if age > DROP_GRACE:
+            try:
+                await get_web3().eth.get_transaction(entry["hashes"][-1])
+            except TransactionNotFound:
+                # Evicted from the mempool; later nonces would wait on this gap, so resync the sender
+                await entry["sender"].nonces.resync()
+                self._finish(entry, "dropped")
+                return True
+        return False
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+def get_receipt_watcher() -> ReceiptWatcher:
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = ReceiptWatcher()
+    return _watcher
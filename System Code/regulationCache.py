@@ -0,0 +1,80 @@
+import json
+import sqlite3
+import threading
+import time
+from metrics import record_cache
+
+
+# Local store of Regulatory Compliance Agent verdicts
+REGULATION_CACHE_PATH = "regulation_cache.db"
+REGULATION_CACHE_TTL = 7 * 24 * 3600
+
+
+def normalize_corridor(sender_country: str, receiver_country: str, receiver_role: str, purpose) -> tuple:
+    # Case and whitespace differences in the extracted request fields map to the same corridor
+    if isinstance(purpose, (list, tuple)):
+        purpose = ", ".join(sorted(str(p) for p in purpose))
+    return tuple(" ".join(str(part).lower().split()) for part in (sender_country, receiver_country, receiver_role, purpose))
+
+
+class RegulationCache:
+    def __init__(self, path: str = REGULATION_CACHE_PATH, ttl: float = REGULATION_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS regulation_verdicts (
+                corridor TEXT PRIMARY KEY,
+                sender_country TEXT,
+                receiver_country TEXT,
+                receiver_role TEXT,
+                purpose TEXT,
+                verdict TEXT,
+                created_at REAL
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, sender_country: str, receiver_country: str, receiver_role: str, purpose):
+        corridor = normalize_corridor(sender_country, receiver_country, receiver_role, purpose)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT verdict, created_at FROM regulation_verdicts WHERE corridor = ?", (json.dumps(corridor),)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            record_cache("regulation_verdicts", False)
+            return None
+        record_cache("regulation_verdicts", True)
+        return row[0]
+
+    def put(self, sender_country: str, receiver_country: str, receiver_role: str, purpose, verdict: str):
+        corridor = normalize_corridor(sender_country, receiver_country, receiver_role, purpose)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO regulation_verdicts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (json.dumps(corridor), *corridor, verdict, time.time())
+            )
+            self.conn.commit()
+
+    def invalidate(self, country: str = None):
+        # New regulation sources can change any verdict, so everything is dropped unless a country is given
+        with self.lock:
+            if country is None:
+                self.conn.execute("DELETE FROM regulation_verdicts")
+            else:
+                country = " ".join(country.lower().split())
+                self.conn.execute(
+                    "DELETE FROM regulation_verdicts WHERE sender_country = ? OR receiver_country = ?", (country, country)
+                )
+            self.conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_regulation_cache() -> RegulationCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RegulationCache()
+    return _cache
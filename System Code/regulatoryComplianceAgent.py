@@ -1,125 +1,113 @@
-import streamlit as st
-from openai import OpenAI
+from openaiClient import client
 import os
-import json
+from metrics import record_cache
+from progressEvents import step
+from runExecutor import RunExecutor, dispatch_tool_calls
+from singleFlight import SingleFlight
 
 
 # Set up your API key
 os.environ["OPENAI_API_KEY"] = ""
 REGULATION_ASSISTANT_ID = ""
 
-client = OpenAI()
+# Identical corridors and web searches requested at the same time share one LLM call
+regulationFlight = SingleFlight()
+webSearchFlight = SingleFlight()
 
-def submitToolOutputs(output, threadId, runId, callID):
-    run = client.beta.threads.runs.submit_tool_outputs(
-        thread_id=threadId,
-        run_id=runId,
-        tool_outputs=[
-            {
-                "tool_call_id": callID,
-                "output": output
-            }
-        ]
-    )
-    return run
 
 async def run_regulation_agent(user_request: str, threadId: str):
+    # Returns the answer and whether search_web ran; an answer built on web results is interim, pending the user's approval of the sources
 
     flag = False
     
     # Add user message
-    client.beta.threads.messages.create(
+    await client.beta.threads.messages.create(
         thread_id=threadId,
         role="user",
         content=user_request
     )
 
     # Run the Regulation Assistant
-    run = client.beta.threads.runs.create(
+    run = await client.beta.threads.runs.create(
         thread_id=threadId,
         assistant_id=REGULATION_ASSISTANT_ID,  # Replace with your actual assistant ID
     )
     
     # Poll until the assistant finishes
+    executor = RunExecutor(client, "Regulation Agent")
     while True:
-        run_status = client.beta.threads.runs.retrieve(
-            thread_id=threadId,
-            run_id=run.id
-        )
+        run_status = await executor.wait(threadId, run.id)
         if run_status.status == "completed":
             if not flag:
-                st.markdown(
-                    '<span style="font-size:14px;">🧠 Interpretting and analyzing regulations to identify sharing requirements...</span>',
-                    unsafe_allow_html=True
-                )
-                for chat in st.session_state.chat_history:
-                    if chat["role"] == "status" and chat["agent"] == "Regulation Agent":
-                        chat["details"] += "\n 🧠 Interpretting and analyzing regulations to identify sharing requirements..."
-                        break
+                step("Regulation Agent", "🧠 Interpretting and analyzing regulations to identify sharing requirements...")
             # Retrieve assistant reply
-            messages = client.beta.threads.messages.list(thread_id=threadId)
+            messages = await client.beta.threads.messages.list(thread_id=threadId)
             regulationsAgentResponse = messages.data[0].content[0].text.value  # Plain text response
             print("\n📘 Final Regulation Interpretation:\n")
             print(regulationsAgentResponse)
+            executor.report()
             break
-        elif run_status.status in ["failed", "cancelled", "expired"]:
+        elif run_status.status in ["failed", "cancelled", "expired", "incomplete"]:
             raise Exception(f"Assistant run failed with status: {run_status.status}")
         elif (run_status.status == "requires_action" and run_status.required_action.type == "submit_tool_outputs"):
-            if (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "search_web"):
+            if any(call.function.name == "search_web" for call in run_status.required_action.submit_tool_outputs.tool_calls):
                 flag = True
-                st.markdown(
-                    '<span style="font-size:14px;">🔍 Not enough regulation data found locally. Searching the web for additional information...</span>',
-                    unsafe_allow_html=True
-                )
-                for chat in st.session_state.chat_history:
-                    if chat["role"] == "status" and chat["agent"] == "Regulation Agent":
-                        chat["details"] += "\n 🔍 Not enough regulation data found locally. Searching the web for additional information..."
-                        break
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run_status.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                print(arg["user_query"])
-                output = await run_web_search_tool1(arg["user_query"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
+                step("Regulation Agent", "🔍 Not enough regulation data found locally. Searching the web for additional information...")
+            await dispatch_tool_calls(client, run_status, REGULATION_TOOLS)
 
-    return regulationsAgentResponse
+    return regulationsAgentResponse, flag
+
+async def run_regulation_agent_shared(user_request: str, corridor: tuple, threadId: str):
+    (output, searchedWeb), shared = await regulationFlight.do(corridor, lambda: run_regulation_agent(user_request, threadId))
+    record_cache("regulation_flight", shared)
+    if shared:
+        await record_regulation_answer(user_request, output, threadId)
+    return output, searchedWeb
+
+async def record_regulation_answer(user_request: str, answer: str, threadId: str):
+    # Keep the thread history complete when a stored verdict is reused, so follow-up questions have context
+    await client.beta.threads.messages.create(
+        thread_id=threadId,
+        role="user",
+        content=user_request
+    )
+    await client.beta.threads.messages.create(
+        thread_id=threadId,
+        role="assistant",
+        content=answer
+    )
 
 async def run_regulation_agent2(user_request: str, threadId: str):
 
     # Add user message
-    client.beta.threads.messages.create(
+    await client.beta.threads.messages.create(
         thread_id=threadId,
         role="user",
         content=user_request
     )
 
     # Run the Regulation Assistant
-    run = client.beta.threads.runs.create(
+    run = await client.beta.threads.runs.create(
         thread_id=threadId,
         assistant_id=REGULATION_ASSISTANT_ID,  # Replace with your actual assistant ID
     )
 
     # Poll until the assistant finishes
+    executor = RunExecutor(client, "Regulation Agent")
     while True:
-        run_status = client.beta.threads.runs.retrieve(
-            thread_id=threadId,
-            run_id=run.id
-        )
+        run_status = await executor.wait(threadId, run.id)
         if run_status.status == "completed":
             # Retrieve assistant reply
-            messages = client.beta.threads.messages.list(thread_id=threadId)
+            messages = await client.beta.threads.messages.list(thread_id=threadId)
             regulationsAgentResponse = messages.data[0].content[0].text.value  # Plain text response
             print("\n📘 Final Regulation Interpretation:\n")
             print(regulationsAgentResponse)
+            executor.report()
             break
-        elif run_status.status in ["failed", "cancelled", "expired"]:
+        elif run_status.status in ["failed", "cancelled", "expired", "incomplete"]:
             raise Exception(f"Assistant run failed with status: {run_status.status}")
         elif (run_status.status == "requires_action" and run_status.required_action.type == "submit_tool_outputs"):
-            if (run_status.required_action.submit_tool_outputs.tool_calls[0].function.name == "search_web"):
-                callId = run_status.required_action.submit_tool_outputs.tool_calls[0].id
-                arg = json.loads(run_status.required_action.submit_tool_outputs.tool_calls[0].function.arguments)
-                print(arg["user_query"])
-                output = await run_web_search_tool1(arg["user_query"])
-                submitToolOutputs(output, run.thread_id, run.id, callId)
+            await dispatch_tool_calls(client, run_status, REGULATION_TOOLS)
 
     return regulationsAgentResponse
 
@@ -152,7 +140,7 @@ async def run_web_search_tool1(query: str):
 		3- https://...
 	"""
     
-    response2 = client.responses.create(
+    response2 = await client.responses.create(
         model="gpt-4o",
         tools=[{"type": "web_search_preview"}],
         tool_choice="required",
@@ -163,4 +151,15 @@ async def run_web_search_tool1(query: str):
     print("\nURLs:\n")
     print(response2.output_text)
 
-    return "URLs retrieved form the web: " + response2.output_text
\ No newline at end of file
+    return "URLs retrieved form the web: " + response2.output_text
+
+async def search_web_tool(arg: dict):
+    print(arg["user_query"])
+    query = " ".join(arg["user_query"].lower().split())
+    output, shared = await webSearchFlight.do(query, lambda: run_web_search_tool1(arg["user_query"]))
+    record_cache("web_search_flight", shared)
+    return output
+
+REGULATION_TOOLS = {
+    "search_web": search_web_tool,
+}
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import random
+import time
+from metrics import llmPollsPerRun, llmRunDuration, toolCalls, toolErrors
+from tracing import span
+
+
+# Run statuses that need the caller's attention (everything else is still in progress)
+ACTION_STATUSES = ["requires_action"]
+TERMINAL_STATUSES = ["completed", "failed", "cancelled", "expired", "incomplete"]
+
+# Default polling behaviour for Assistants runs
+INITIAL_POLL_DELAY = 0.25
+MAX_POLL_DELAY = 4.0
+POLL_BACKOFF_FACTOR = 1.6
+# Only time spent waiting on the remote run counts; local tool handlers between polls do not
+RUN_DEADLINE = 300
+
+
+class RunCancelled(Exception):
+    pass
+
+
+class RunDeadlineExceeded(Exception):
+    pass
+
+
+class RunExecutor:
+    # Polls one Assistants run with exponential backoff, a deadline and cooperative cancellation
+    def __init__(self, client, agent: str, deadline: float = RUN_DEADLINE,
+                 initial_delay: float = INITIAL_POLL_DELAY, max_delay: float = MAX_POLL_DELAY,
+                 backoff_factor: float = POLL_BACKOFF_FACTOR):
+        self.client = client
+        self.agent = agent
+        self.deadline = deadline
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff_factor = backoff_factor
+        self.poll_calls = 0
+        self.started = time.monotonic()
+        self.waited = 0.0
+        self.cancelled = False
+
+    def cancel(self):
+        # Picked up before the next poll; the remote run is cancelled as well
+        self.cancelled = True
+
+    async def _cancel_remote_run(self, threadId: str, runId: str):
+        try:
+            await self.client.beta.threads.runs.cancel(thread_id=threadId, run_id=runId)
+        except Exception as e:
+            print(f"⚠️ Could not cancel {self.agent} run {runId}: {e}")
+
+    async def wait(self, threadId: str, runId: str):
+        # Returns the run once it requires action or reaches a terminal status
+        with span("llm.poll_cycle", agent=self.agent, run_id=runId) as cycle:
+            polls = self.poll_calls
+            waitStarted = time.monotonic()
+            try:
+                run = await self._poll(threadId, runId, waitStarted)
+            finally:
+                self.waited += time.monotonic() - waitStarted
+            cycle.set(polls=self.poll_calls - polls, status=run.status)
+            if run.status in TERMINAL_STATUSES:
+                llmRunDuration.observe(time.monotonic() - self.started, agent=self.agent)
+                llmPollsPerRun.observe(self.poll_calls, agent=self.agent)
+                if getattr(run, "usage", None):
+                    cycle.set(prompt_tokens=run.usage.prompt_tokens, completion_tokens=run.usage.completion_tokens)
+            return run
+
+    async def _poll(self, threadId: str, runId: str, wait_started: float):
+        delay = self.initial_delay
+        last_status = None
+        while True:
+            if self.cancelled:
+                await self._cancel_remote_run(threadId, runId)
+                raise RunCancelled(f"{self.agent} run {runId} was cancelled")
+            if self.waited + time.monotonic() - wait_started > self.deadline:
+                await self._cancel_remote_run(threadId, runId)
+                raise RunDeadlineExceeded(f"{self.agent} run {runId} exceeded its {self.deadline}s deadline")
+
+            run = await self.client.beta.threads.runs.retrieve(thread_id=threadId, run_id=runId)
+            self.poll_calls += 1
+            if run.status in ACTION_STATUSES or run.status in TERMINAL_STATUSES:
+                return run
+
+            # Adaptive backoff: restart from the short delay whenever the run changes phase
+            if run.status != last_status:
+                delay = self.initial_delay
+                last_status = run.status
+            try:
+                await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            except asyncio.CancelledError:
+                await self._cancel_remote_run(threadId, runId)
+                raise
+            delay = min(delay * self.backoff_factor, self.max_delay)
+
+    def report(self):
+        print(f"{self.agent} poll calls = {self.poll_calls}")
+
+
+async def dispatch_tool_calls(client, run, handlers: dict):
+    # Runs every tool call of the step concurrently and submits all outputs at once
+    tool_calls = run.required_action.submit_tool_outputs.tool_calls
+
+    async def execute(tool_call):
+        name = tool_call.function.name
+        toolCalls.inc(tool=name)
+        if name not in handlers:
+            print(f"⚠️ No handler for tool call: {name}")
+            return f"❌ Unknown tool: {name}"
+        with span("tool_call", tool=name) as call:
+            try:
+                arg = json.loads(tool_call.function.arguments or "{}")
+                return str(await handlers[name](arg))
+            except Exception as e:
+                # Reported back to the assistant instead of raised, so the span is flagged here
+                call.status = "ERROR"
+                call.set(error_type=type(e).__name__)
+                toolErrors.inc(tool=name)
+                print(f"❌ Tool {name} failed: {e}")
+                return f"❌ Tool {name} failed: {e}"
+
+    outputs = await asyncio.gather(*(execute(tool_call) for tool_call in tool_calls))
+    return await client.beta.threads.runs.submit_tool_outputs(
+        thread_id=run.thread_id,
+        run_id=run.id,
+        tool_outputs=[
+            {
+                "tool_call_id": tool_call.id,
+                "output": output
+            }
+            for tool_call, output in zip(tool_calls, outputs)
+        ]
+    )
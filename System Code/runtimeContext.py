@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+from web3 import Web3
+from web3 import AsyncWeb3
+from web3.providers.async_rpc import AsyncHTTPProvider
+from metrics import rpcCalls, rpcDuration
+from tracing import span
+
+
+# Blockchain connection settings shared by all agents
+infuraUrl = ""
+
+# Smart contract ABIs & addresses
+consentSCAddr = "0x39daf39dc5999B19fc737AfF18B1513B477f4BFf";
+dataSCAddr = "0xb9cf17726836E7c067124F947255329c31D23429";
+consentSCAbi = []
+dataSCAbi = []
+
+# Process-wide singletons, created on first use instead of at import time
+_lock = threading.Lock()
+_web3 = None
+_consentSC = None
+_dataSC = None
+
+
+def get_web3() -> AsyncWeb3:
+    global _web3
+    with _lock:
+        if _web3 is None:
+            _web3 = AsyncWeb3(AsyncHTTPProvider(infuraUrl))
+    return _web3
+
+
+def get_consent_contract():
+    global _consentSC
+    web3 = get_web3()
+    with _lock:
+        if _consentSC is None:
+            _consentSC = web3.eth.contract(address=Web3.to_checksum_address(consentSCAddr), abi=consentSCAbi)
+    return _consentSC
+
+
+def get_data_contract():
+    global _dataSC
+    web3 = get_web3()
+    with _lock:
+        if _dataSC is None:
+            _dataSC = web3.eth.contract(address=Web3.to_checksum_address(dataSCAddr), abi=dataSCAbi)
+    return _dataSC
+
+
+async def call_contract(function, block_identifier="latest"):
+    # Every contract read goes through here so it shows up as its own span
+    rpcCalls.inc(function=function.fn_name)
+    started = time.perf_counter()
+    with span("web3.call", function=function.fn_name, block=str(block_identifier)):
+        try:
+            return await function.call(block_identifier=block_identifier)
+        finally:
+            rpcDuration.observe(time.perf_counter() - started, function=function.fn_name)
+
+
+async def prewarm():
+    # Builds the contracts and checks the node connection before the first tool call needs them
+    get_consent_contract()
+    get_data_contract()
+    if not await get_web3().is_connected():
+        print("⚠️ Ethereum node is not reachable. Check infuraUrl.")
+        return False
+    print("✅ Ethereum node connection ready.")
+    return True
+
+
+def start_prewarm():
+    # Runs prewarm() on a background thread so startup does not wait for the network
+    thread = threading.Thread(target=lambda: asyncio.run(prewarm()), daemon=True)
+    thread.start()
+    return thread
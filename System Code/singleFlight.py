@@ -0,0 +1,36 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    # Concurrent callers with the same key share one in-flight call, even across Streamlit session threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    async def do(self, key, factory):
+        # Returns (result, shared) where shared tells whether another caller did the work
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+        if not leader:
+            # Shielded so a cancelled follower does not cancel the shared call
+            return await asyncio.shield(asyncio.wrap_future(future)), True
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.set_exception(RuntimeError(f"In-flight call for {key} was cancelled"))
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
@@ -0,0 +1,71 @@
+import asyncio
+import contextvars
+from metrics import record_cache
+
+
+# Plan of the orchestration request currently being served (inherited by tool-call tasks)
+current_plan = contextvars.ContextVar("current_plan", default=None)
+
+
+def plan_key(*parts):
+    # Addresses and country names are matched case-insensitively
+    return tuple(part.strip().lower() if isinstance(part, str) else part for part in parts)
+
+
+def _consume_exception(task):
+    # Speculative work may fail silently; the consumer falls back to a direct call
+    if not task.cancelled():
+        task.exception()
+
+
+class ExecutionPlan:
+    # DAG of speculative prerequisite stages shared by the agents of one request
+    def __init__(self):
+        self.tasks = {}
+
+    def add(self, key, factory, after=()):
+        # factory receives the results of the stages listed in `after`
+        key = plan_key(*key)
+        if key in self.tasks:
+            return self.tasks[key]
+        dependencies = [self.tasks[plan_key(*dep)] for dep in after]
+
+        async def run_stage():
+            results = [await dependency for dependency in dependencies]
+            return await factory(*results)
+
+        task = asyncio.create_task(run_stage())
+        task.add_done_callback(_consume_exception)
+        self.tasks[key] = task
+        return task
+
+    def cancel(self):
+        for task in self.tasks.values():
+            if not task.done():
+                task.cancel()
+        self.tasks.clear()
+
+
+async def resolved(value):
+    # Factory for a stage whose result is already known (e.g. from a cache) but that later stages depend on
+    return value
+
+
+async def planned(key, factory, consume: bool = False):
+    # Reuse a speculative stage result when one is scheduled, otherwise run factory() directly
+    plan = current_plan.get()
+    if plan is not None:
+        key = plan_key(*key)
+        task = plan.tasks.pop(key, None) if consume else plan.tasks.get(key)
+        if task is not None:
+            try:
+                result = await task
+                record_cache("stage_prefetch", True)
+                return result
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise
+            except Exception:
+                pass
+        record_cache("stage_prefetch", False)
+    return await factory()
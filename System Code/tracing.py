@@ -0,0 +1,72 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Spans are appended as JSON lines with OTLP-style field names; set to None to disable export
+TRACE_EXPORT_PATH = "traces.jsonl"
+
+# Innermost open span of the current task (inherited by tool-call tasks)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+_export_lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, name: str, attributes: dict, parent=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        # Only identifiers, names and sizes belong here, never patient data or free text
+        self.attributes = dict(attributes)
+        self.status = "OK"
+        self.start_ns = time.time_ns()
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self):
+        self.duration = time.perf_counter() - self.start
+        export_span(self)
+
+
+def export_span(span: Span):
+    if not TRACE_EXPORT_PATH:
+        return
+    record = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "parentSpanId": span.parent_id,
+        "name": span.name,
+        "startTimeUnixNano": span.start_ns,
+        "endTimeUnixNano": span.start_ns + int(span.duration * 1e9),
+        "durationMs": round(span.duration * 1000, 3),
+        "attributes": span.attributes,
+        "status": span.status
+    }
+    line = json.dumps(record, default=str) + "\n"
+    with _export_lock:
+        with open(TRACE_EXPORT_PATH, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    current = Span(name, attributes, current_span.get())
+    token = current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        # The exception message may quote request content, so only its type is recorded
+        current.status = "ERROR"
+        current.set(error_type=type(e).__name__)
+        raise
+    finally:
+        current_span.reset(token)
+        current.end()
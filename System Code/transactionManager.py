@@ -0,0 +1,157 @@
+import threading
+from web3 import Web3
+from metrics import transactionsSent
+from progressEvents import current_events
+from receiptWatcher import get_receipt_watcher
+from runtimeContext import get_web3
+from tracing import span
+
+
+# Errors that mean the local nonce is out of step with the node (another client used the account, a tx was dropped...)
+NONCE_ERRORS = ["nonce too low", "nonce too high", "already known", "replacement transaction underpriced", "invalid nonce"]
+# Nodes only accept a replacement for a pending nonce if its fees are at least 10% higher
+REPLACEMENT_FEE_BUMP = 1.125
+FEE_FIELDS = ["gasPrice", "maxFeePerGas", "maxPriorityFeePerGas"]
+
+
+def is_nonce_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(text in message for text in NONCE_ERRORS)
+
+
+class NonceManager:
+    # Hands out nonces for one sender locally; the node is only asked again after a failure.
+    # Nonces reserved by sends that have not broadcast yet are tracked, so a failed send never hands them out twice.
+    def __init__(self, address: str):
+        self.address = address
+        self.lock = threading.Lock()
+        self.next_nonce = None
+        self.reserved = set()
+        # Nonces whose send failed before broadcasting, handed out again first
+        self.gaps = set()
+        # Nonces broadcast while a resync reads the node, one set per running resync
+        self.resyncs = []
+
+    async def prepare(self):
+        # Loads the pending transaction count once so the first reserve() needs no round trip
+        if self.next_nonce is None:
+            count = await get_web3().eth.get_transaction_count(self.address, "pending")
+            with self.lock:
+                if self.next_nonce is None:
+                    self.next_nonce = count
+
+    async def reserve(self) -> int:
+        await self.prepare()
+        with self.lock:
+            if self.gaps:
+                nonce = min(self.gaps)
+                self.gaps.discard(nonce)
+            else:
+                nonce = self.next_nonce
+                self.next_nonce += 1
+            self.reserved.add(nonce)
+        return nonce
+
+    def sent(self, nonce: int):
+        with self.lock:
+            self.reserved.discard(nonce)
+            for broadcast in self.resyncs:
+                broadcast.add(nonce)
+
+    async def failed(self, nonce: int, error: Exception):
+        # The reserved nonce was not used, so later ones would be stuck behind the gap: it is handed out again.
+        # The node is only asked again when it rejected the nonce or no other send holds a reservation.
+        with self.lock:
+            self.reserved.discard(nonce)
+            self.gaps.add(nonce)
+            resync = is_nonce_error(error) or not self.reserved
+        if resync:
+            await self.resync()
+
+    async def resync(self):
+        # The pending count on the node is the source of truth after an error, except for the nonces concurrent sends
+        # still hold or broadcast while it was being read
+        broadcast = set()
+        with self.lock:
+            self.resyncs.append(broadcast)
+        try:
+            count = await get_web3().eth.get_transaction_count(self.address, "pending")
+        except Exception:
+            with self.lock:
+                self.resyncs.remove(broadcast)
+            raise
+        with self.lock:
+            self.resyncs.remove(broadcast)
+            self.next_nonce = max([count] + [nonce + 1 for nonce in self.reserved | broadcast])
+            self.gaps = {nonce for nonce in self.gaps if count <= nonce < self.next_nonce}
+
+
+class TransactionSender:
+    # One account: cached address, local nonces and the pending transactions that may need replacing
+    def __init__(self, private_key: str):
+        self.private_key = private_key
+        self.address = Web3.to_checksum_address(get_web3().eth.account.from_key(private_key).address)
+        self.nonces = NonceManager(self.address)
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    async def send(self, function, label: str, params: dict) -> str:
+        # Builds, signs and sends a contract call; a stale nonce triggers one resync and retry
+        for attempt in range(2):
+            nonce = await self.nonces.reserve()
+            try:
+                tx = await function.build_transaction({'from': self.address, 'nonce': nonce, **params})
+                tx_hash = await self._send_signed(tx, label)
+            except Exception as e:
+                await self.nonces.failed(nonce, e)
+                if attempt == 0 and is_nonce_error(e):
+                    print(f"⚠️ Nonce {nonce} was rejected for {label}. Resynced with the node and retrying...")
+                    continue
+                raise
+            self.nonces.sent(nonce)
+            with self.lock:
+                self.pending[nonce] = {"tx": tx, "hash": tx_hash, "label": label}
+            # Inclusion is confirmed in the background; the outcome arrives on the session's event bus
+            get_receipt_watcher().watch(self, nonce, tx_hash, label, current_events.get())
+            return tx_hash
+
+    async def _send_signed(self, tx: dict, label: str) -> str:
+        with span("web3.transaction", function=label, nonce=tx['nonce']) as transaction:
+            signed = get_web3().eth.account.sign_transaction(tx, self.private_key)
+            tx_hash = (await get_web3().eth.send_raw_transaction(signed.rawTransaction)).hex()
+            transaction.set(tx_hash=tx_hash)
+        transactionsSent.inc(function=label)
+        return tx_hash
+
+    async def replace(self, nonce: int, bump: float = REPLACEMENT_FEE_BUMP) -> str:
+        # Replace-by-fee: re-sends the pending transaction with the same nonce and higher fees
+        with self.lock:
+            entry = self.pending.get(nonce)
+        if entry is None:
+            raise KeyError(f"No pending transaction with nonce {nonce}")
+        tx = dict(entry["tx"])
+        for field in FEE_FIELDS:
+            if field in tx:
+                tx[field] = int(tx[field] * bump) + 1
+        tx_hash = await self._send_signed(tx, entry["label"])
+        with self.lock:
+            self.pending[nonce] = {"tx": tx, "hash": tx_hash, "label": entry["label"]}
+        print(f"⛽ Replaced transaction {entry['hash']} (nonce {nonce}) with {tx_hash}")
+        return tx_hash
+
+    def settled(self, nonce: int):
+        # Called once a transaction with this nonce is mined, so it is no longer a replacement candidate
+        with self.lock:
+            self.pending.pop(nonce, None)
+
+
+_senders = {}
+_senders_lock = threading.Lock()
+
+def get_sender(private_key: str) -> TransactionSender:
+    with _senders_lock:
+        sender = _senders.get(private_key)
+        if sender is None:
+            sender = TransactionSender(private_key)
+            _senders[private_key] = sender
+    return sender
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+from metrics import record_cache
+from payloadCrypto import load_public_key
+from multicall import batched_call
+from runtimeContext import get_data_contract
+from stagePlanner import planned
+
+
+# In-memory directory of DataExchange records (registration, role, public key, government per country).
+# DataExchange emits no registration event and does not allow re-registering, so entries live for a TTL and
+# invalidate() is the hook for the rare manual correction. Negative answers expire quickly so new users show up.
+USER_DIRECTORY_TTL = 3600
+NEGATIVE_TTL = 60
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+
+class UserDirectory:
+    def __init__(self, ttl: float = USER_DIRECTORY_TTL, negative_ttl: float = NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def _key(self, kind: str, key: str) -> tuple:
+        return (kind, key.strip().lower())
+
+    def cached(self, kind: str, key: str):
+        # (found, value); expired entries count as missing
+        with self.lock:
+            entry = self.entries.get(self._key(kind, key))
+        if entry is None or entry[1] < time.monotonic():
+            return False, None
+        return True, entry[0]
+
+    def _put(self, kind: str, key: str, value, negative: bool = False):
+        expires = time.monotonic() + (self.negative_ttl if negative else self.ttl)
+        with self.lock:
+            self.entries[self._key(kind, key)] = (value, expires)
+
+    async def _lookup(self, kind: str, key: str, fetch, is_negative, transform=None):
+        found, value = self.cached(kind, key)
+        record_cache("user_directory", found)
+        if found:
+            return value
+        value = await fetch()
+        negative = is_negative(value)
+        if transform is not None and not negative:
+            value = transform(value)
+        self._put(kind, key, value, negative)
+        return value
+
+    async def is_registered(self, address: str) -> bool:
+        return await self._lookup(
+            "registered", address,
+            lambda: planned(("isUserRegistered", address), lambda: batched_call(get_data_contract().functions.isUserRegistered(address))),
+            lambda registered: not registered
+        )
+
+    async def role(self, address: str) -> int:
+        return await self._lookup(
+            "role", address,
+            lambda: self._fetch_role(address),
+            # getUserRole answers for unknown addresses too; only a registered user's role is kept for long
+            lambda role: not self.cached("registered", address)[1]
+        )
+
+    async def registration(self, address: str) -> tuple:
+        # (registered, role) with both reads issued together, so a cold lookup is one multicall batch.
+        # The role is stored once both returned, with the same rule as role()
+        found, role = self.cached("role", address)
+        if found:
+            record_cache("user_directory", True)
+            return await self.is_registered(address), role
+        record_cache("user_directory", False)
+        registered, role = await asyncio.gather(self.is_registered(address), self._fetch_role(address))
+        self._put("role", address, role, negative=not registered)
+        return registered, role
+
+    def _fetch_role(self, address: str):
+        return planned(("getUserRole", address), lambda: batched_call(get_data_contract().functions.getUserRole(address)))
+
+    async def public_key(self, address: str):
+        # Parsed RSA key object, so repeated shares skip DER parsing
+        return await self._lookup(
+            "public_key", address,
+            lambda: planned(("getUserPublicKey", address), lambda: batched_call(get_data_contract().functions.getUserPublicKey(address))),
+            lambda key: not key,
+            load_public_key
+        )
+
+    async def government_address(self, country: str) -> str:
+        return await self._lookup(
+            "government", country,
+            lambda: planned(("getGovernmentAddress", country), lambda: batched_call(get_data_contract().functions.getGovernmentAddress(country))),
+            lambda government: not government or government == ZERO_ADDRESS
+        )
+
+    def invalidate(self, address: str = None, country: str = None):
+        # Drops everything about an address and/or a country; no arguments clears the directory
+        with self.lock:
+            if address is None and country is None:
+                self.entries.clear()
+                return
+            keys = {key.strip().lower() for key in (address, country) if key is not None}
+            for entry in [entry for entry in self.entries if entry[1] in keys]:
+                del self.entries[entry]
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+def get_user_directory() -> UserDirectory:
+    global _directory
+    with _directory_lock:
+        if _directory is None:
+            _directory = UserDirectory()
+    return _directory
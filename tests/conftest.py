@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The system modules import each other by name from "System Code"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "System Code"))
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from blobStore import BlobStore, content_digest
+from ipfsCid import CHUNK_SIZE, compute_cid
+
+MASTER_KEY = b"k" * 32
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path / "blob_store"))
+
+
+def test_same_payload_is_stored_once(store):
+    payload = bytes(range(256)) * (CHUNK_SIZE // 128)
+
+    first = store.put_stream([payload[:1000], payload[1000:]])
+    second = store.put_stream([payload])
+
+    assert first == second == (compute_cid([payload]), len(payload))
+    assert sorted(os.listdir(store.directory)) == sorted(["index.db", first[0]])
+    assert store.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 1
+
+
+def test_linked_content_is_found_by_digest(store):
+    digest = content_digest(b"filtered record", MASTER_KEY)
+    assert store.lookup(digest) is None
+
+    cid, _ = store.put_stream([b"encrypted record"])
+    store.link(digest, cid, b"wrapped key")
+
+    assert store.lookup(digest) == (cid, b"wrapped key")
+
+
+def test_content_whose_blob_is_gone_is_stored_again(store):
+    digest = content_digest(b"filtered record", MASTER_KEY)
+    cid, _ = store.put_stream([b"encrypted record"])
+    store.link(digest, cid, b"wrapped key")
+
+    os.remove(store.path(cid))
+
+    assert store.lookup(digest) is None
+
+
+def test_content_digest_depends_on_the_key():
+    assert content_digest(b"filtered record", MASTER_KEY) != content_digest(b"filtered record", b"j" * 32)
@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+pytest.importorskip("web3")
+
+from consentDecisionCache import ConsentDecisionCache, decision_key
+
+PATIENT = "0x00000000000000000000000000000000000000Aa"
+GOVERNMENT = "0x00000000000000000000000000000000000000Bb"
+
+
+@pytest.fixture
+def cache():
+    return ConsentDecisionCache()
+
+
+def test_put_after_invalidation_during_computation_is_refused(cache):
+    key = decision_key(PATIENT, "0x1", ["Treatment"], None, "Explicit consent")
+    started = time.monotonic()
+    # A revoke is handled by the mirror while the decision is still being computed
+    cache.invalidate(PATIENT.lower(), 105)
+
+    assert cache.put(key, "granted", 100, [PATIENT, GOVERNMENT], started) is False
+    assert cache.get(key) is None
+
+
+def test_put_tagged_before_a_handled_event_is_refused(cache):
+    cache.invalidate(GOVERNMENT, 105)
+    key = decision_key(PATIENT, "0x1", ["Treatment"], None, "Explicit consent")
+
+    assert cache.put(key, "granted", 100, [PATIENT, GOVERNMENT], time.monotonic()) is False
+
+
+def test_put_after_the_mirror_caught_up_is_kept_until_the_next_event(cache):
+    cache.invalidate(PATIENT, 105)
+    key = decision_key(PATIENT, "0x1", ["Treatment"], None, "Explicit consent")
+
+    assert cache.put(key, "granted", 105, [PATIENT], time.monotonic()) is True
+    assert cache.get(key) == "granted"
+    cache.invalidate(PATIENT, 104)
+    assert cache.get(key) == "granted"
+    cache.invalidate(PATIENT, 106)
+    assert cache.get(key) is None
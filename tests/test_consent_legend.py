@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("web3")
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+import consentVerificationAgent as agent
+
+
+@pytest.fixture(autouse=True)
+def legend_threads(monkeypatch):
+    monkeypatch.setattr(agent, "_legendThreads", agent.OrderedDict())
+
+
+def test_legend_is_marked_only_after_submit():
+    agent.current_consent_thread.set(agent.ConsentThread("thread_a"))
+    assert agent.consentLegend()
+    # Other outputs of the same step do not repeat it
+    assert agent.consentLegend() == ""
+    assert not agent.legend_submitted("thread_a")
+
+    agent.mark_legend_submitted()
+    assert agent.legend_submitted("thread_a")
+
+
+def test_failed_submit_sends_the_legend_again():
+    agent.current_consent_thread.set(agent.ConsentThread("thread_a"))
+    assert agent.consentLegend()
+    # The submit failed, so no mark; the next run of the thread gets the legend
+    agent.current_consent_thread.set(agent.ConsentThread("thread_a"))
+    assert agent.consentLegend()
+
+
+def test_legend_threads_are_bounded(monkeypatch):
+    monkeypatch.setattr(agent, "LEGEND_THREADS_LIMIT", 2)
+    for threadId in ["thread_a", "thread_b", "thread_c"]:
+        agent.current_consent_thread.set(agent.ConsentThread(threadId))
+        agent.consentLegend()
+        agent.mark_legend_submitted()
+    assert not agent.legend_submitted("thread_a")
+    assert agent.legend_submitted("thread_b") and agent.legend_submitted("thread_c")
@@ -0,0 +1,80 @@
+import asyncio
+import types
+
+import pytest
+
+pytest.importorskip("web3")
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+from consentDecisionCache import ConsentDecisionCache, decision_key
+from consentMirror import ConsentMirror, current_read_blocks, is_expired, read_block
+from multicall import BlockPin, current_block_pin
+
+NOW = 2_000_000_000
+PATIENT = "0x00000000000000000000000000000000000000aa"
+RECEIVER = "0x00000000000000000000000000000000000000bb"
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    return ConsentMirror(str(tmp_path / "consent_mirror.db"))
+
+
+@pytest.fixture
+def following(mirror):
+    mirror.thread = types.SimpleNamespace(is_alive=lambda: True)
+    return mirror
+
+
+def test_snapshots_are_not_served_without_a_follower(mirror):
+    rows = [[[1], [2], ["all"], False, 0, True, 3]]
+    mirror.store("getUniversalConsents", PATIENT, None, rows)
+
+    assert mirror.lookup("getUniversalConsents", PATIENT) is None
+
+    mirror.thread = types.SimpleNamespace(is_alive=lambda: True)
+    assert mirror.lookup("getUniversalConsents", PATIENT) == rows
+
+
+@pytest.mark.parametrize("valid_until, expired", [(NOW - 1, True), (NOW + 60, False), (0, False)])
+def test_government_consents_expire(valid_until, expired):
+    row = [[1], [2], RECEIVER, True, 4, valid_until]
+    assert is_expired("getGovernmentConsents", row, NOW) == expired
+
+
+def test_reads_record_the_block_their_rows_come_from(following):
+    rows = [[[1], [2], ["all"], False, 0, True, 3]]
+    following.store("getUniversalConsents", PATIENT, None, rows, block=90)
+
+    async def fetch():
+        # Prefetched at the request's pin, which the first batch set to block 95
+        current_block_pin.get().block = 95
+        return []
+
+    async def scenario():
+        blocks = []
+        current_read_blocks.set(blocks)
+        current_block_pin.set(BlockPin())
+        await following.read("getUniversalConsents", PATIENT, None, fetch)
+        await following.read("getSpecificConsents", PATIENT, RECEIVER, fetch)
+        return blocks
+
+    assert asyncio.run(scenario()) == [90, 95]
+    assert following._snapshot("getSpecificConsents", PATIENT, RECEIVER) == ([], 95)
+
+
+@pytest.mark.parametrize("blocks, expected", [([], 100), ([95, 90], 90), ([95, None], None)])
+def test_read_block_is_the_oldest_read(blocks, expected):
+    assert read_block(blocks, 100) == expected
+
+
+def test_event_between_the_read_block_and_the_checkpoint_evicts_the_decision():
+    cache = ConsentDecisionCache()
+    key = decision_key(PATIENT, RECEIVER, ["Treatment"], None, "Explicit consent")
+    # Rows were read at block 90 while the mirror had already reached block 100
+    cache.put(key, "granted", read_block([90, 95], 100), [PATIENT])
+
+    cache.invalidate(PATIENT, 97)
+
+    assert cache.get(key) is None
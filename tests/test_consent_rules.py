@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip("web3")
+
+from consentRules import government_required, role_category
+
+
+@pytest.mark.parametrize("requirement", [
+    "Explicit patient consent and approval by the ministry of health",
+    "Patient consent plus authorization from the data protection authority",
+    "Explicit consent and prior approval from the national regulator",
+    "Informed consent; the health data agency must authorise the transfer",
+])
+def test_non_government_approval_defers_to_the_assistant(requirement):
+    assert government_required(requirement) is None
+
+
+@pytest.mark.parametrize("requirement, expected", [
+    ("Explicit patient consent is required", False),
+    ("Explicit patient consent and government consent are required", True),
+    ("Patient consent and government approval", True),
+])
+def test_clear_requirements_are_mapped(requirement, expected):
+    assert government_required(requirement) is expected
+
+
+def test_negated_requirements_defer_to_the_assistant():
+    assert government_required("No consent required") is None
+
+
+@pytest.mark.parametrize("role, expected", [
+    ("Insurance Company", ("getInsuranceConsents", 3)),
+    ("insurance companies", ("getInsuranceConsents", 3)),
+    ("Hospitals", ("getHospitalConsents", 1)),
+    ("research labs", ("getLabConsents", 2)),
+    ("Government", None),
+])
+def test_role_category_handles_plurals(role, expected):
+    assert role_category(role) == expected
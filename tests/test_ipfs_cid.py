@@ -0,0 +1,47 @@
+import base64
+import hashlib
+
+import pytest
+
+from ipfsCid import CHUNK_SIZE, compute_cid
+
+
+def sha256(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+# `ipfs add --cid-version=1` stores a single chunk as one raw leaf
+@pytest.mark.parametrize("data, cid", [
+    (b"", "bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku"),
+    (b"hello world", "bafkreifzjut3te2nhyekklss27nh3k72ysco7y32koao5eei66wof36n5e"),
+])
+def test_single_chunk_vectors(data, cid):
+    assert compute_cid([data]) == cid
+
+
+def test_full_single_chunk_is_a_raw_leaf():
+    data = bytes(CHUNK_SIZE)
+    expected = "b" + base64.b32encode(b"\x01\x55\x12\x20" + sha256(data)).decode().lower().rstrip("=")
+    assert compute_cid([data]) == expected
+
+
+def test_several_chunks_are_linked_by_a_unixfs_file_node():
+    chunks = [b"\x00" * CHUNK_SIZE, b"\x01" * CHUNK_SIZE, b"tail"]
+    # dag-pb links: Hash (raw leaf CIDv1), empty Name, Tsize; then the UnixFS Data: File, filesize, blocksizes.
+    # Varints: 262144 = 80 80 10, 524292 = 84 80 20
+    links = b""
+    for chunk, tsize in zip(chunks, [b"\x80\x80\x10", b"\x80\x80\x10", b"\x04"]):
+        link = b"\x0a\x24\x01\x55\x12\x20" + sha256(chunk) + b"\x12\x00\x18" + tsize
+        links += b"\x12" + bytes([len(link)]) + link
+    unixfs = b"\x08\x02" + b"\x18\x84\x80\x20" + b"\x20\x80\x80\x10" * 2 + b"\x20\x04"
+    node = links + b"\x0a" + bytes([len(unixfs)]) + unixfs
+    expected = "b" + base64.b32encode(b"\x01\x70\x12\x20" + sha256(node)).decode().lower().rstrip("=")
+
+    assert compute_cid(chunks) == expected
+    assert expected == "bafybeiedyjlsnc24lduee5ktpuu26odfcaxccqqtmzu4bq4bt6ghearmha"
+
+
+def test_cid_does_not_depend_on_how_the_content_is_fed():
+    data = bytes(range(256)) * (3 * CHUNK_SIZE // 256) + b"tail"
+    blocks = [data[i:i + 1000] for i in range(0, len(data), 1000)]
+    assert compute_cid(blocks) == compute_cid([data])
@@ -0,0 +1,75 @@
+import io
+
+import pytest
+
+pytest.importorskip("cryptography")
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from payloadCrypto import (
+    DATA_KEY_SIZE, ENVELOPE_VERSION, PayloadError, _oaep, decrypt_stream, encrypt_stream, generate_data_key,
+    iter_chunks, open_envelope, seal_for_receiver, unwrap_data_key, wrap_data_key
+)
+
+CID = "bafkreifzjut3te2nhyekklss27nh3k72ysco7y32koao5eei66wof36n5e"
+RECORD = b"filtered patient record" * 100
+
+
+@pytest.fixture(scope="module")
+def receiver_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def encrypt(data_key: bytes) -> bytes:
+    return b"".join(encrypt_stream(iter_chunks(RECORD), data_key))
+
+
+def decrypt(payload: bytes, data_key: bytes) -> bytes:
+    return b"".join(decrypt_stream(io.BytesIO(payload).read, data_key))
+
+
+def test_wrapped_data_key_decrypts_the_stored_payload():
+    master_key, data_key = generate_data_key(), generate_data_key()
+    payload = encrypt(data_key)
+
+    wrapped = wrap_data_key(data_key, master_key)
+
+    assert decrypt(payload, unwrap_data_key(wrapped, master_key)) == RECORD
+
+
+def test_data_key_wrapped_under_another_master_key_is_rejected():
+    wrapped = wrap_data_key(generate_data_key(), generate_data_key())
+    with pytest.raises(PayloadError):
+        unwrap_data_key(wrapped, generate_data_key())
+
+
+def test_envelope_layout_is_version_key_cid(receiver_key):
+    data_key = generate_data_key()
+
+    envelope = receiver_key.decrypt(seal_for_receiver(receiver_key.public_key(), data_key, CID), _oaep())
+
+    assert envelope == bytes([ENVELOPE_VERSION]) + data_key + CID.encode()
+    assert len(data_key) == DATA_KEY_SIZE
+
+
+def test_receiver_opens_the_envelope_and_decrypts_the_payload(receiver_key):
+    data_key = generate_data_key()
+    payload = encrypt(data_key)
+
+    key, cid = open_envelope(receiver_key, seal_for_receiver(receiver_key.public_key(), data_key, CID))
+
+    assert cid == CID
+    assert decrypt(payload, key) == RECORD
+
+
+def test_envelope_for_another_receiver_is_rejected(receiver_key):
+    other = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    sealed = seal_for_receiver(other.public_key(), generate_data_key(), CID)
+    with pytest.raises(ValueError):
+        open_envelope(receiver_key, sealed)
+
+
+def test_unknown_envelope_version_is_rejected(receiver_key):
+    sealed = receiver_key.public_key().encrypt(bytes([ENVELOPE_VERSION + 1]) + generate_data_key() + CID.encode(), _oaep())
+    with pytest.raises(PayloadError, match="version"):
+        open_envelope(receiver_key, sealed)
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+pytest.importorskip("web3")
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+pytest.importorskip("cryptography")
+
+import orchestrationService
+from orchestrationService import OrchestrationService, resolve_upload_path
+
+
+@pytest.fixture
+def upload_dir(tmp_path):
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+    (directory / "record.txt").write_text("patient record")
+    (tmp_path / "secret.txt").write_text("not for upload")
+    return str(directory)
+
+
+def test_file_inside_the_upload_directory_is_accepted(upload_dir):
+    assert resolve_upload_path("record.txt", upload_dir) == os.path.realpath(os.path.join(upload_dir, "record.txt"))
+
+
+@pytest.mark.parametrize("file_path", ["../secret.txt", "/etc/passwd", "missing.txt"])
+def test_paths_outside_the_upload_directory_are_rejected(upload_dir, file_path):
+    with pytest.raises(ValueError):
+        resolve_upload_path(file_path, upload_dir)
+
+
+def test_symlinks_leaving_the_upload_directory_are_rejected(upload_dir):
+    os.symlink(os.path.join(os.path.dirname(upload_dir), "secret.txt"), os.path.join(upload_dir, "link.txt"))
+    with pytest.raises(ValueError):
+        resolve_upload_path("link.txt", upload_dir)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(orchestrationService.time, "monotonic", lambda: clock[0])
+    return clock
+
+
+def test_idle_sessions_are_evicted(clock):
+    service = OrchestrationService(session_ttl=60)
+    old = service._session("old", None)
+    clock[0] += 61
+
+    service._session("new", None)
+
+    assert list(service.sessions) == ["new"]
+    assert service._session("old", None) is not old
+
+
+def test_least_recently_used_sessions_beyond_the_limit_are_evicted(clock):
+    service = OrchestrationService(max_sessions=2)
+    for session_id in ["a", "b", "c"]:
+        service._session(session_id, None)
+        clock[0] += 1
+
+    assert list(service.sessions) == ["b", "c"]
+    assert set(service.session_locks) == set(service.session_used) == {"b", "c"}
+
+
+def test_sessions_with_pending_requests_are_kept(clock):
+    service = OrchestrationService(session_ttl=60)
+    busy = service._session("busy", None)
+    service.active["busy"] = 1
+    clock[0] += 61
+
+    service._session("new", None)
+
+    assert service.sessions["busy"] is busy
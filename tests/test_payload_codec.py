@@ -0,0 +1,143 @@
+import asyncio
+import io
+import os
+
+import pytest
+
+import payloadCodec
+from payloadCodec import CODEC_NONE, CODEC_ZLIB, CODEC_ZSTD, CodecError, compress_chunks, decompress_chunks, default_codec, scrub_sample
+
+RECORD = b"Patient: Jane Doe\nDiagnosis: hypertension\nMedication: lisinopril 10 mg daily\n" * 200
+
+
+def round_trip(data: bytes, codec: int, payload_dictionary_id: int = None) -> bytes:
+    chunks = list(compress_chunks([data[i:i + 1000] for i in range(0, len(data), 1000)], codec, chunk_size=512))
+    # Compressed output is re-cut into encryption-sized chunks; uncompressed chunks pass through as they are
+    assert all(len(chunk) <= (512 if codec != CODEC_NONE else 1000) for chunk in chunks)
+    return b"".join(decompress_chunks(chunks, codec, payload_dictionary_id))
+
+
+def synthetic_samples(count: int = 500) -> list:
+    return [
+        f"Patient: Synthetic {i}\nAge: {20 + i % 60}\nDiagnosis: {['asthma', 'diabetes', 'hypertension'][i % 3]}\n"
+        f"Medication: {['salbutamol', 'metformin', 'lisinopril'][i % 3]} {i % 50} mg\n".encode()
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def dictionary(monkeypatch):
+    zstandard = pytest.importorskip("zstandard")
+    trained = zstandard.train_dictionary(4096, synthetic_samples())
+    monkeypatch.setattr(payloadCodec, "_dictionary", trained)
+    monkeypatch.setattr(payloadCodec, "_dictionary_loaded", True)
+    return trained
+
+
+@pytest.mark.parametrize("data", [b"", RECORD])
+def test_zlib_round_trip(data):
+    assert round_trip(data, CODEC_ZLIB) == data
+
+
+def test_zstd_round_trip(monkeypatch):
+    pytest.importorskip("zstandard")
+    monkeypatch.setattr(payloadCodec, "_dictionary_loaded", True)
+    monkeypatch.setattr(payloadCodec, "_dictionary", None)
+    assert round_trip(RECORD, CODEC_ZSTD, payloadCodec.dictionary_id(CODEC_ZSTD)) == RECORD
+
+
+def test_zstd_round_trip_with_dictionary(dictionary):
+    assert payloadCodec.dictionary_id(CODEC_ZSTD) == dictionary.dict_id() != 0
+    assert round_trip(RECORD, CODEC_ZSTD, dictionary.dict_id()) == RECORD
+
+
+def test_zstd_payload_of_another_dictionary_is_refused(dictionary):
+    with pytest.raises(CodecError, match="dictionary"):
+        round_trip(RECORD, CODEC_ZSTD, dictionary.dict_id() + 1)
+
+
+def test_zlib_is_the_fallback_without_zstandard(monkeypatch):
+    monkeypatch.setattr(payloadCodec, "zstandard", None)
+    assert default_codec() == CODEC_ZLIB
+    with pytest.raises(CodecError):
+        list(compress_chunks([RECORD], CODEC_ZSTD))
+
+
+def test_uncompressed_chunks_pass_through():
+    assert round_trip(RECORD, CODEC_NONE) == RECORD
+
+
+def test_training_samples_are_scrubbed():
+    sample = b"Patient: Jane Doe, born 1984-02-03, jane@example.org, wallet 0x" + b"ab" * 20 + b"\n"
+    assert scrub_sample(sample) == b"Patient: Jane Doe, born #-#-#, #, wallet #\n"
+
+
+class TestPayloadHeaders:
+    @pytest.fixture(autouse=True)
+    def crypto(self):
+        pytest.importorskip("cryptography")
+
+    def decrypt(self, payload: bytes, key: bytes) -> bytes:
+        from payloadCrypto import decrypt_stream
+        return b"".join(decrypt_stream(io.BytesIO(payload).read, key))
+
+    def legacy_payload(self, version: int, data: bytes, key: bytes, codec: int = CODEC_NONE) -> bytes:
+        # Single-frame payload with a version 1 (no codec) or version 2 (no dictionary id) header
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        from payloadCrypto import CHUNK_SIZE, FINAL_FRAME, MAGIC, _FRAME, _HEADER_V1, _HEADER_V2, _nonce
+        prefix = os.urandom(7)
+        if version == 1:
+            header = _HEADER_V1.pack(MAGIC, 1, CHUNK_SIZE, prefix)
+        else:
+            header = _HEADER_V2.pack(MAGIC, 2, codec, CHUNK_SIZE, prefix)
+        ciphertext = AESGCM(key).encrypt(_nonce(prefix, 0, True), data, header)
+        return header + _FRAME.pack(len(ciphertext) | FINAL_FRAME) + ciphertext
+
+    def test_version_1_payloads_are_still_readable(self):
+        from payloadCrypto import generate_data_key
+        key = generate_data_key()
+        assert self.decrypt(self.legacy_payload(1, b"record", key), key) == b"record"
+
+    def test_version_2_payloads_are_still_readable(self):
+        from payloadCrypto import generate_data_key
+        key = generate_data_key()
+        compressed = b"".join(compress_chunks([RECORD], CODEC_ZLIB))
+        assert self.decrypt(self.legacy_payload(2, compressed, key, CODEC_ZLIB), key) == RECORD
+
+    def test_compressed_payload_round_trip(self):
+        from payloadCrypto import encrypt_stream, generate_data_key
+        key = generate_data_key()
+        payload = b"".join(encrypt_stream(compress_chunks([RECORD], CODEC_ZLIB), key, codec=CODEC_ZLIB))
+        assert self.decrypt(payload, key) == RECORD
+
+    def test_missing_dictionary_is_reported_before_decrypting(self, dictionary, monkeypatch):
+        from payloadCrypto import PayloadError, encrypt_stream, generate_data_key
+        key = generate_data_key()
+        payload = b"".join(encrypt_stream(compress_chunks([RECORD], CODEC_ZSTD), key, codec=CODEC_ZSTD, dictionary_id=dictionary.dict_id()))
+        monkeypatch.setattr(payloadCodec, "_dictionary", None)
+        with pytest.raises(PayloadError, match="is missing"):
+            self.decrypt(payload, key)
+
+
+def test_records_are_stored_uncompressed_when_compression_is_off(tmp_path, monkeypatch):
+    for module in ["cryptography", "web3", "openai", "httpx"]:
+        pytest.importorskip(module)
+    import orchestrator
+    from blobStore import BlobStore
+    from ipfsCid import compute_cid
+    from payloadCrypto import _HEADER, decrypt_stream, generate_data_key, iter_file_chunks
+
+    store = BlobStore(str(tmp_path / "blob_store"))
+
+    async def upload_stream(open_chunks, backend, name=None, size=None):
+        return compute_cid(open_chunks())
+    monkeypatch.setattr(orchestrator, "get_blob_store", lambda: store)
+    monkeypatch.setattr(orchestrator, "upload_stream", upload_stream)
+    monkeypatch.setattr(orchestrator, "compressPayloads", False)
+
+    cid, data_key = asyncio.run(orchestrator.upload_encrypted_to_ipfs(RECORD, generate_data_key()))
+
+    with open(store.path(cid), 'rb') as f:
+        payload = f.read()
+    assert _HEADER.unpack(payload[:_HEADER.size])[2] == CODEC_NONE
+    assert b"".join(decrypt_stream(io.BytesIO(payload).read, data_key)) == RECORD
@@ -0,0 +1,87 @@
+import io
+
+import pytest
+
+pytest.importorskip("cryptography")
+
+from payloadCrypto import FINAL_FRAME, PayloadError, _FRAME, _HEADER, decrypt_stream, encrypt_stream, generate_data_key, iter_chunks
+
+CHUNK_SIZE = 16
+
+
+@pytest.fixture
+def key():
+    return generate_data_key()
+
+
+def encrypt(data: bytes, key: bytes) -> bytes:
+    return b"".join(encrypt_stream(iter_chunks(data, CHUNK_SIZE), key, CHUNK_SIZE))
+
+
+def decrypt(payload: bytes, key: bytes) -> bytes:
+    return b"".join(decrypt_stream(io.BytesIO(payload).read, key))
+
+
+def split(payload: bytes) -> tuple:
+    # Header and the list of length-prefixed frames
+    header, rest = payload[:_HEADER.size], payload[_HEADER.size:]
+    frames = []
+    while rest:
+        length = _FRAME.unpack(rest[:_FRAME.size])[0] & ~FINAL_FRAME
+        frames.append(rest[:_FRAME.size + length])
+        rest = rest[_FRAME.size + length:]
+    return header, frames
+
+
+@pytest.mark.parametrize("data", [b"", b"short record", bytes(range(256)) * 3])
+def test_round_trip(key, data):
+    assert decrypt(encrypt(data, key), key) == data
+
+
+def test_payload_without_its_final_frame_is_rejected(key):
+    header, frames = split(encrypt(bytes(100), key))
+    with pytest.raises(PayloadError, match="truncated"):
+        decrypt(header + b"".join(frames[:-1]), key)
+
+
+def test_payload_cut_inside_a_frame_is_rejected(key):
+    payload = encrypt(bytes(100), key)
+    with pytest.raises(PayloadError, match="truncated"):
+        decrypt(payload[:-5], key)
+
+
+def test_dropped_middle_frame_is_rejected(key):
+    header, frames = split(encrypt(bytes(100), key))
+    with pytest.raises(PayloadError, match="authentication"):
+        decrypt(header + frames[0] + b"".join(frames[2:]), key)
+
+
+def test_reordered_frames_are_rejected(key):
+    header, frames = split(encrypt(bytes(range(100)), key))
+    frames[0], frames[1] = frames[1], frames[0]
+    with pytest.raises(PayloadError, match="authentication"):
+        decrypt(header + b"".join(frames), key)
+
+
+def test_tampered_tag_is_rejected(key):
+    header, frames = split(encrypt(bytes(100), key))
+    frames[0] = frames[0][:-1] + bytes([frames[0][-1] ^ 1])
+    with pytest.raises(PayloadError, match="authentication"):
+        decrypt(header + b"".join(frames), key)
+
+
+def test_tampered_header_is_rejected(key):
+    payload = bytearray(encrypt(bytes(100), key))
+    payload[_HEADER.size - 1] ^= 1
+    with pytest.raises(PayloadError, match="authentication"):
+        decrypt(bytes(payload), key)
+
+
+def test_data_after_the_final_frame_is_rejected(key):
+    with pytest.raises(PayloadError, match="after the final"):
+        decrypt(encrypt(bytes(100), key) + b"x", key)
+
+
+def test_wrong_key_is_rejected(key):
+    with pytest.raises(PayloadError, match="authentication"):
+        decrypt(encrypt(b"record", key), generate_data_key())
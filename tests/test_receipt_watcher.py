@@ -0,0 +1,55 @@
+import asyncio
+import types
+
+import pytest
+
+pytest.importorskip("web3")
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+import receiptWatcher
+from receiptWatcher import ReceiptWatcher
+
+
+class FakeNode:
+    def __init__(self, receipts: dict):
+        self.eth = self
+        self.receipts = receipts
+
+    async def get_transaction_receipt(self, tx_hash: str):
+        if tx_hash not in self.receipts:
+            raise receiptWatcher.TransactionNotFound(tx_hash)
+        return self.receipts[tx_hash]
+
+
+class Bus:
+    def __init__(self):
+        self.events = []
+
+    def emit(self, kind: str, **data):
+        self.events.append(data)
+
+
+def entry(hashes: list, bus: Bus) -> dict:
+    sender = types.SimpleNamespace(address="0x0000000000000000000000000000000000000001", settled=lambda nonce: None)
+    return {
+        "sender": sender, "nonce": 3, "label": "shareData", "bus": bus, "original_hash": hashes[0],
+        "hashes": hashes, "submitted_at": 0, "replacements": len(hashes) - 1
+    }
+
+
+@pytest.mark.parametrize("hashes", [["0xa"], ["0xa", "0xb"]])
+def test_current_hash_mined_after_the_receipt_poll_is_confirmed(monkeypatch, hashes):
+    monkeypatch.setattr(receiptWatcher, "get_web3", lambda: FakeNode({hashes[-1]: {"status": 1, "blockNumber": 10, "gasUsed": 21000}}))
+    bus = Bus()
+
+    assert asyncio.run(ReceiptWatcher()._check_unmined(entry(hashes, bus), mined_nonce=4))
+    assert bus.events[-1]["status"] == "confirmed"
+
+
+def test_nonce_used_by_another_transaction_is_replaced_externally(monkeypatch):
+    monkeypatch.setattr(receiptWatcher, "get_web3", lambda: FakeNode({}))
+    bus = Bus()
+
+    assert asyncio.run(ReceiptWatcher()._check_unmined(entry(["0xa", "0xb"], bus), mined_nonce=4))
+    assert bus.events[-1]["status"] == "replaced_externally"
@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("cryptography")
+pytest.importorskip("web3")
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import orchestrator
+from payloadCrypto import generate_data_key, load_public_key, open_envelope
+
+
+@pytest.fixture
+def receiver_keys():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    der = private_key.public_key().public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private_key, der
+
+
+@pytest.mark.parametrize("as_object", [True, False])
+def test_seal_key_for_receiver_round_trip(receiver_keys, as_object):
+    private_key, der = receiver_keys
+    data_key = generate_data_key()
+    cid = "bafkreigh2akiscaildcqabsyg3dfr6chu3fgpregiymsck7e7aqa4s52zy"
+
+    sealed = orchestrator.seal_key_for_receiver(load_public_key(der) if as_object else der, data_key, cid)
+
+    assert open_envelope(private_key, sealed) == (data_key, cid)
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import types
+
+import pytest
+
+pytest.importorskip("web3")
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+import transactionManager
+from transactionManager import NonceManager, TransactionSender
+
+
+class FakeNode:
+    # Pending count is the first nonce not broadcast yet, like a node without queued transactions
+    def __init__(self):
+        self.eth = self
+        self.broadcast = []
+        self.external = 0
+
+    async def get_transaction_count(self, address, block):
+        await asyncio.sleep(0)
+        count = self.external
+        while count in self.broadcast:
+            count += 1
+        return count
+
+
+class Function:
+    def __init__(self, error: Exception = None):
+        self.error = error
+
+    async def build_transaction(self, params: dict) -> dict:
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        return dict(params)
+
+
+@pytest.fixture
+def node(monkeypatch):
+    node = FakeNode()
+    monkeypatch.setattr(transactionManager, "get_web3", lambda: node)
+    monkeypatch.setattr(transactionManager, "get_receipt_watcher", lambda: types.SimpleNamespace(watch=lambda *args: None))
+    return node
+
+
+@pytest.fixture
+def sender(node):
+    sender = TransactionSender.__new__(TransactionSender)
+    sender.private_key = "key"
+    sender.address = "0x0000000000000000000000000000000000000001"
+    sender.nonces = NonceManager(sender.address)
+    sender.lock = threading.Lock()
+    sender.pending = {}
+
+    async def send_signed(tx: dict, label: str) -> str:
+        # Concurrent sends are still in flight when a sibling fails
+        await asyncio.sleep(0.01)
+        node.broadcast.append(tx["nonce"])
+        return hex(tx["nonce"])
+    sender._send_signed = send_signed
+    return sender
+
+
+def test_failed_send_does_not_rewind_over_concurrent_reservations(node, sender):
+    async def scenario():
+        results = await asyncio.gather(
+            sender.send(Function(), "first", {}),
+            sender.send(Function(ValueError("execution reverted")), "reverted", {}),
+            sender.send(Function(), "third", {}),
+            return_exceptions=True
+        )
+        return results, await sender.send(Function(), "later", {})
+
+    results, later = asyncio.run(scenario())
+
+    assert results[0] == "0x0" and results[2] == "0x2"
+    assert isinstance(results[1], ValueError)
+    # The failed nonce is filled by the next send instead of a sibling's nonce being reused
+    assert later == "0x1"
+    assert sorted(node.broadcast) == [0, 1, 2]
+
+
+def test_nonce_error_resync_keeps_concurrent_reservations(node):
+    nonces = NonceManager("0x0000000000000000000000000000000000000001")
+
+    async def scenario():
+        first = await nonces.reserve()
+        second = await nonces.reserve()
+        # Another client used the account meanwhile
+        node.external = 5
+        await nonces.failed(first, ValueError("nonce too low"))
+        return second, await nonces.reserve()
+
+    second, following = asyncio.run(scenario())
+
+    assert second == 1
+    assert following == 5
+    assert nonces.reserved == {1, 5}
+
+
+def test_failure_without_other_reservations_resyncs(node):
+    nonces = NonceManager("0x0000000000000000000000000000000000000001")
+
+    async def scenario():
+        nonce = await nonces.reserve()
+        await nonces.failed(nonce, TimeoutError("request timed out"))
+        return await nonces.reserve()
+
+    assert asyncio.run(scenario()) == 0
+    assert not nonces.gaps
@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("web3")
+pytest.importorskip("cryptography")
+
+import userDirectory
+from userDirectory import NEGATIVE_TTL, UserDirectory
+
+
+@pytest.fixture
+def issued(monkeypatch):
+    # Contract reads of an unregistered address; each checks on return that the other read was already issued
+    issued = []
+
+    async def planned(key, factory):
+        issued.append(key[0])
+        await asyncio.sleep(0)
+        assert sorted(issued) == ["getUserRole", "isUserRegistered"]
+        return {"isUserRegistered": False, "getUserRole": 2}[key[0]]
+    monkeypatch.setattr(userDirectory, "planned", planned)
+    return issued
+
+
+def test_registration_issues_both_reads_together(issued):
+    assert asyncio.run(UserDirectory().registration("0xABC")) == (False, 2)
+
+
+def test_role_of_an_unregistered_address_expires_quickly(issued):
+    directory = UserDirectory()
+
+    asyncio.run(directory.registration("0xABC"))
+
+    assert directory.cached("role", "0xabc") == (True, 2)
+    assert directory.entries[("role", "0xabc")][1] <= time.monotonic() + NEGATIVE_TTL